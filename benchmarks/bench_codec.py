@@ -0,0 +1,82 @@
+
+'''
+This file is part of MSR Ensemble for Python (MSRE-Py).
+
+MSRE-Py is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+MSRE-Py is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with MSRE-Py. If not, see <http://www.gnu.org/licenses/>.
+
+MSR Ensemble for Python (MSRE-Py) Version 0.9, Prototype Alpha
+
+Authors:
+Edmund S. L. Lam      sllam@qatar.cmu.edu
+Iliano Cervesato      iliano@cmu.edu
+
+* Development of MSRE-Py is funded by the Qatar National Research Fund as project NPRP 09-667-1-100 (Effective Programming for Large Distributed Ensembles)
+'''
+
+# Wire codec benchmark: Encoding and decoding of batches of facts with the JSON and binary codecs
+# (see misc/codec.py), for the fact shapes sent between ranks by the example ensembles. Sorting
+# ensembles send lists of integers, benchmarked with lists of increasing length.
+#
+# Usage: python benchmarks/bench_codec.py [<num of facts> [<batch size>]]
+
+import gc
+import sys
+import time
+
+from msr_ensemble.misc.codec import CODEC_JSON, CODEC_BINARY, new_codec
+
+UUID = 'a619a3ab-364f-4df7-8eca-fe318717a3b9'
+
+def fact(sym_id, values, rank=1, prior=0):
+	return { 'prior':prior, 'sym_id':sym_id, 'values':values, 'rank':rank, 'proc_id':str(rank) }
+
+# Fact shapes: Name, function from a counter to a fact, and length of its lists. Shapes with lists
+# of length n are benchmarked with n/10 times fewer facts.
+FACT_SHAPES = [ ('short_path Path(L,D)', lambda i: fact(3, [u'%s::%s' % (i%8,i%8), i]), 0)
+              , ('swap Swapmatch(L,C,C,L)', lambda i: fact(10, [u'3::3', 'purple', 'green', u'%s::%s' % (i%4,i%4)], prior=2), 0)
+              , ('p2p_blocksworld Get(L,L,B,B)', lambda i: fact(10, [u'0::0', u'1::1', 'b%s' % (i%10), 'b9'], prior=2), 0)
+              , ('min_span_tree Decided(L,L,W)', lambda i: fact(5, [u'1::1', u'5::5', i]), 0)
+              , ('hyper_quick_sort Swap(L,L,U,[A],[A])', lambda i: fact(12, [u'1::1', u'3::3', UUID, [2,9,i], [48,212]]), 3)
+              ] + [ ('hyper_quick_sort Sorted([A]) x%s' % n, (lambda n: lambda i: fact(1, [range(i,i+n), UUID]))(n), n) for n in [100,1000,10000] ]
+
+def bench_codec(codec, facts, batch_size):
+	gc.collect()
+	gc.disable()
+	start = time.time()
+	batches = []
+	for i in xrange(0,len(facts),batch_size):
+		batches.append( codec.encode_batch( [ codec.encode_fact(f) for f in facts[i:i+batch_size] ] ) )
+	encode_time = time.time() - start
+	start = time.time()
+	for batch in batches:
+		codec.decode_batch(buffer(batch))
+	decode_time = time.time() - start
+	gc.enable()
+	size = sum(map(len,batches))
+	return (len(facts)/encode_time, len(facts)/decode_time, size)
+
+def run_bench(name, make_fact, num_of_facts, batch_size):
+	facts = [ make_fact(i) for i in xrange(0,num_of_facts) ]
+	(json_enc,json_dec,json_size) = bench_codec(new_codec(CODEC_JSON), facts, batch_size)
+	(bin_enc,bin_dec,bin_size) = bench_codec(new_codec(CODEC_BINARY), facts, batch_size)
+	print "%-40s encode: %9.0f -> %9.0f facts/s (x%.2f)   decode: %9.0f -> %9.0f facts/s (x%.2f)   bytes/fact: %8.1f -> %8.1f (x%.2f)" % (name
+              ,json_enc, bin_enc, bin_enc/json_enc, json_dec, bin_dec, bin_dec/json_dec
+              ,json_size/float(num_of_facts), bin_size/float(num_of_facts), bin_size/float(json_size))
+
+if __name__ == "__main__":
+	num_of_facts = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+	batch_size   = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+	print "Wire codecs, %s facts in batches of %s (JSON -> binary)" % (num_of_facts,batch_size)
+	for name,make_fact,list_len in FACT_SHAPES:
+		run_bench(name, make_fact, max(num_of_facts / max(list_len/10,1), 10), batch_size)
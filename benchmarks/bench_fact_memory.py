@@ -0,0 +1,105 @@
+
+'''
+This file is part of MSR Ensemble for Python (MSRE-Py).
+
+MSRE-Py is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+MSRE-Py is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with MSRE-Py. If not, see <http://www.gnu.org/licenses/>.
+
+MSR Ensemble for Python (MSRE-Py) Version 0.9, Prototype Alpha
+
+Authors:
+Edmund S. L. Lam      sllam@qatar.cmu.edu
+Iliano Cervesato      iliano@cmu.edu
+
+* Development of MSRE-Py is funded by the Qatar National Research Fund as project NPRP 09-667-1-100 (Effective Programming for Large Distributed Ensembles)
+'''
+
+# Memory benchmark: Resident memory per stored fact, comparing the slotted fact records
+# against the former per-fact dicts (a fact dict, an id dict, a hash value list and a
+# history defaultdict per fact), and against the columnar fact store. Each variant is
+# measured in a fresh interpreter.
+#
+# Usage: python benchmarks/bench_fact_memory.py [<num of facts>]
+
+import gc
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+from msr_ensemble.facts.term import Term
+from msr_ensemble.facts.fact import Fact, register_fact
+from msr_ensemble.context.store import FactStore, ColumnarFactStore
+from msr_ensemble.context.fact_repr import FactRepr
+
+class BenchEdge(Fact):
+	def __init__(self, x1, x2):
+		self.initialize(x1, x2)
+register_fact(BenchEdge)
+
+# Current resident set size of this process, in bytes
+def current_rss():
+	with open('/proc/self/statm') as f:
+		return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+def new_bench_store(mode):
+	terms = [Term(),Term()]
+	terms[0].bind(0)
+	if mode == 'columnar':
+		store = ColumnarFactStore(BenchEdge.sym_id, ['int','int'])
+	else:
+		store = FactStore(BenchEdge.sym_id)
+	store.generate_lookup( BenchEdge(*terms) )
+	terms[0].unbind()
+	return store
+
+# The former fact representation: A dict per fact and per fact id
+def add_dict_fact(store, fact):
+	store.next_id += 1
+	fact_id = { 'id':store.next_id, 'hash_values':[], 'history_entries':defaultdict(list) }
+	fact['fact_id'] = fact_id
+	store.main_table[fact_id['id']] = fact
+	for hash_table in store.hash_tables:
+		hash_val = hash_table['hash_key'](fact['values'])
+		fact_id['hash_values'].append(hash_val)
+		hash_table['hash_table'][hash_val][fact_id['id']] = fact
+
+def measure(mode, num_of_facts):
+	store = new_bench_store(mode)
+	gc.collect()
+	start_rss = current_rss()
+	for i in xrange(0,num_of_facts):
+		values = (i % 5000, i)
+		if mode == 'dict':
+			add_dict_fact(store, { 'prior':None, 'sym_id':BenchEdge.sym_id, 'values':list(values) })
+		else:
+			store.add_to_store( FactRepr(None, BenchEdge.sym_id, values) )
+	gc.collect()
+	return float(current_rss() - start_rss) / num_of_facts
+
+def run_measure(mode, num_of_facts):
+	out = subprocess.check_output([sys.executable, __file__, mode, str(num_of_facts)])
+	return float(out)
+
+if __name__ == "__main__":
+	if len(sys.argv) > 2:
+		print measure(sys.argv[1], int(sys.argv[2]))
+	else:
+		num_of_facts = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+		print "Fact store memory, %s edge(<int>,<int>) facts with one hash index" % num_of_facts
+		dict_bytes = run_measure('dict', num_of_facts)
+		slot_bytes = run_measure('slots', num_of_facts)
+		col_bytes  = run_measure('columnar', num_of_facts)
+		print "dict records:    %8.1f bytes/fact" % dict_bytes
+		print "slotted records: %8.1f bytes/fact (x%.2f)" % (slot_bytes, dict_bytes/slot_bytes)
+		print "columnar store:  %8.1f bytes/fact (x%.2f)" % (col_bytes, dict_bytes/col_bytes)
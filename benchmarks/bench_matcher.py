@@ -0,0 +1,109 @@
+
+'''
+This file is part of MSR Ensemble for Python (MSRE-Py).
+
+MSRE-Py is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+MSRE-Py is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with MSRE-Py. If not, see <http://www.gnu.org/licenses/>.
+
+MSR Ensemble for Python (MSRE-Py) Version 0.9, Prototype Alpha
+
+Authors:
+Edmund S. L. Lam      sllam@qatar.cmu.edu
+Iliano Cervesato      iliano@cmu.edu
+
+* Development of MSRE-Py is funded by the Qatar National Research Fund as project NPRP 09-667-1-100 (Effective Programming for Large Distributed Ensembles)
+'''
+
+# Matcher benchmark: Time of rule occurrence matching with the closure matchers and with the generated
+# (compiled) matchers of interpret/matcher_gen.py, on a join-heavy rule. Each probe(X) activation joins 
+# two edge lookups, edge(X,Y) and edge(Y,Z), and fails the guard X == Z on every candidate, so each
+# activation goes through all <out degree>^2 two-hop paths from X.
+#
+# Usage: python benchmarks/bench_matcher.py [<num of probes> [<out degree>]]
+
+import sys
+import time
+
+from msr_ensemble.facts.term import Term
+from msr_ensemble.facts.fact import Fact, register_fact
+from msr_ensemble.facts.guard import Eq
+from msr_ensemble.rules.rule import Rule, register_rule
+from msr_ensemble.context.store import new_stores, add_to_stores
+from msr_ensemble.context.fact_repr import FactRepr
+from msr_ensemble.context.goals import HeapGoals
+from msr_ensemble.context.prop_history import new_histories
+from msr_ensemble.interpret.interpreter import interpret_rules
+from msr_ensemble.interpret.mpi_runtime import runtime_options, generate_occurrence_functions, generate_matching_functions
+from msr_ensemble.interpret.mpi_runtime import MATCHER_CLOSURE, MATCHER_COMPILED
+from msr_ensemble.misc.msr_logging import init_logger
+
+class BenchEdge(Fact):
+	def __init__(self, x1, x2):
+		self.initialize(x1, x2)
+register_fact(BenchEdge)
+
+class BenchProbe(Fact):
+	def __init__(self, x1):
+		self.initialize(x1)
+register_fact(BenchProbe)
+
+class BenchCycle(Fact):
+	def __init__(self, x1, x2):
+		self.initialize(x1, x2)
+register_fact(BenchCycle)
+
+# rule cycle :: edge(X,Y), edge(Y,Z) \ probe(X) | X == Z --o cycle(X,Y).
+class BenchCycleRule(Rule):
+	def __init__(self):
+		self.initialize(forall=3,exist_locs=0)
+	def propagate(self):
+		x,y,z = self.get_vars()
+		return [BenchEdge(x,y), BenchEdge(y,z)]
+	def simplify(self):
+		x,y,z = self.get_vars()
+		return [BenchProbe(x)]
+	def guards(self):
+		x,y,z = self.get_vars()
+		return [Eq(x,z)]
+	def consequents(self):
+		x,y,z = self.get_vars()
+		return [BenchCycle(x,y)]
+register_rule(BenchCycleRule)
+
+NUM_OF_NODES = 1000
+
+def measure(matcher_mode, num_of_probes, degree):
+	options = runtime_options(matcher_mode=matcher_mode)
+	fact_stores = new_stores()
+	goals = HeapGoals()
+	interp_rules = interpret_rules([BenchCycleRule()], fact_stores)
+	logger = init_logger("bench_matcher", log_file="/dev/null")
+	occ_funcs = generate_occurrence_functions(goals, fact_stores, new_histories(fact_stores), interp_rules, logger, None, None, options=options)
+	matching_funcs = generate_matching_functions(fact_stores, occ_funcs, interp_rules)
+	for x in xrange(0,NUM_OF_NODES):
+		for k in xrange(1,degree+1):
+			add_to_stores(fact_stores, FactRepr(None, BenchEdge.sym_id, (x,(x+k) % NUM_OF_NODES)))
+	match_probe = matching_funcs[BenchProbe.sym_id]
+	start = time.time()
+	for i in xrange(0,num_of_probes):
+		match_probe( FactRepr(None, BenchProbe.sym_id, (i % NUM_OF_NODES,)) )
+	return time.time() - start
+
+if __name__ == "__main__":
+	num_of_probes = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+	degree = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+	print "Matching %s probe activations, %s two-hop paths each" % (num_of_probes,degree*degree)
+	closure_time  = measure(MATCHER_CLOSURE, num_of_probes, degree)
+	compiled_time = measure(MATCHER_COMPILED, num_of_probes, degree)
+	print "closure matchers:  %.3fs" % closure_time
+	print "compiled matchers: %.3fs (x%.2f)" % (compiled_time, closure_time/compiled_time)
@@ -0,0 +1,80 @@
+
+'''
+This file is part of MSR Ensemble for Python (MSRE-Py).
+
+MSRE-Py is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+MSRE-Py is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with MSRE-Py. If not, see <http://www.gnu.org/licenses/>.
+
+MSR Ensemble for Python (MSRE-Py) Version 0.9, Prototype Alpha
+
+Authors:
+Edmund S. L. Lam      sllam@qatar.cmu.edu
+Iliano Cervesato      iliano@cmu.edu
+
+* Development of MSRE-Py is funded by the Qatar National Research Fund as project NPRP 09-667-1-100 (Effective Programming for Large Distributed Ensembles)
+'''
+
+# Raw value transfer benchmark: Round trips of facts carrying a large list of integers between two
+# MPI nodes, with the list sent as a Python list (encoded by the codec) and as an array('l') raw
+# value (see split_raw_values in misc/mpi_process.py). Rank 0 sends each fact, rank 1 receives it
+# and sends it back.
+#
+# Usage: mpiexec -n 2 python benchmarks/bench_raw_transfer.py [<num of round trips> [<codec mode>]]
+
+import sys
+import time
+
+from array import array
+
+from msr_ensemble.misc.mpi_process import AggregatingSender, default_receiver, comm
+from msr_ensemble.misc.codec import CODEC_BINARY, new_codec
+
+def receive(receiver):
+	fact = None
+	while fact == None:
+		fact = receiver.poll()
+	return fact
+
+def bench_transfer(sender, receiver, value, num_of_trips):
+	rank  = comm.Get_rank()
+	other = 1 - rank
+	comm.Barrier()
+	start = time.time()
+	for _ in xrange(num_of_trips):
+		if rank == 0:
+			sender.send([{ 'prior':0, 'sym_id':1, 'values':[u'1::1', value], 'rank':other, 'proc_id':str(other) }])
+			sender.flush()
+			fact = receive(receiver)
+		else:
+			fact = receive(receiver)
+			sender.send([{ 'prior':0, 'sym_id':1, 'values':fact['values'], 'rank':other, 'proc_id':str(other) }])
+			sender.flush()
+		sender.poll()
+	sender.wait()
+	return (time.time() - start) / num_of_trips
+
+if __name__ == "__main__":
+	num_of_trips = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+	codec_mode   = sys.argv[2] if len(sys.argv) > 2 else CODEC_BINARY
+	codec    = new_codec(codec_mode)
+	receiver = default_receiver(codec)
+	sender   = AggregatingSender(receiver=receiver, codec=codec)
+	if comm.Get_rank() == 0:
+		print "Round trips of a fact with n integers, %s codec (list -> raw array)" % codec_mode
+	for n in [1000,10000,100000,1000000]:
+		trips = max(num_of_trips * 1000 / n, 3)
+		list_time = bench_transfer(sender, receiver, range(n), trips)
+		raw_time  = bench_transfer(sender, receiver, array('l', xrange(n)), trips)
+		if comm.Get_rank() == 0:
+			print "n = %-8s %9.3f ms -> %9.3f ms per round trip (x%.2f)   %8.1f -> %8.1f MB/s" % (n
+                              ,list_time*1000, raw_time*1000, list_time/raw_time, 2*8*n/list_time/1e6, 2*8*n/raw_time/1e6)
@@ -0,0 +1,100 @@
+
+'''
+This file is part of MSR Ensemble for Python (MSRE-Py).
+
+MSRE-Py is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+MSRE-Py is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with MSRE-Py. If not, see <http://www.gnu.org/licenses/>.
+
+MSR Ensemble for Python (MSRE-Py) Version 0.9, Prototype Alpha
+
+Authors:
+Edmund S. L. Lam      sllam@qatar.cmu.edu
+Iliano Cervesato      iliano@cmu.edu
+
+* Development of MSRE-Py is funded by the Qatar National Research Fund as project NPRP 09-667-1-100 (Effective Programming for Large Distributed Ensembles)
+'''
+
+# Micro-benchmark: Fact by fact insertion and deletion (add_to_store, del_from_store) against the
+# bulk add_many_to_store and del_many_from_store, in batches, on dict and columnar fact stores with
+# the given number of hash indexes.
+#
+# Usage: python benchmarks/bench_store_batch.py [<num of facts> [<batch size>]]
+
+import gc
+import sys
+import time
+
+from msr_ensemble.facts.term import Term
+from msr_ensemble.facts.fact import Fact, register_fact
+from msr_ensemble.context.store import FactStore, ColumnarFactStore
+from msr_ensemble.context.fact_repr import make_fact_repr
+
+class BenchEdge(Fact):
+	arg_types = ['int','int','int']
+	def __init__(self, x1, x2, x3):
+		self.initialize(x1, x2, x3)
+register_fact(BenchEdge)
+
+def new_bench_store(columnar, num_of_indexes):
+	if columnar:
+		store = ColumnarFactStore(BenchEdge.sym_id, BenchEdge.arg_types)
+	else:
+		store = FactStore(BenchEdge.sym_id)
+	for i in xrange(0,num_of_indexes):
+		terms = [Term() for _ in xrange(0,3)]
+		terms[i].bind('X')
+		store.generate_lookup( BenchEdge(*terms) )
+	return store
+
+def bench_store(columnar, num_of_indexes, num_of_facts, batch_size, bulk):
+	store = new_bench_store(columnar, num_of_indexes)
+	facts = [ make_fact_repr( BenchEdge(*map(Term,(i % 5000, i % 97, i))) ) for i in xrange(0,num_of_facts) ]
+	batches = [ facts[i:i+batch_size] for i in xrange(0,num_of_facts,batch_size) ]
+
+	# As with timeit, cyclic garbage collection is kept out of the measurements
+	gc.collect()
+	gc.disable()
+	start = time.time()
+	if bulk:
+		for batch in batches:
+			store.add_many_to_store(batch)
+	else:
+		for fact in facts:
+			store.add_to_store(fact)
+	insert_time = time.time() - start
+
+	start = time.time()
+	if bulk:
+		for batch in batches:
+			store.del_many_from_store(batch)
+	else:
+		for fact in facts:
+			store.del_from_store(fact)
+	delete_time = time.time() - start
+	gc.enable()
+
+	return (num_of_facts/insert_time, num_of_facts/delete_time)
+
+def run_bench(name, columnar, num_of_indexes, num_of_facts, batch_size):
+	(one_ins,one_del) = bench_store(columnar, num_of_indexes, num_of_facts, batch_size, False)
+	(bulk_ins,bulk_del) = bench_store(columnar, num_of_indexes, num_of_facts, batch_size, True)
+	print "%-22s insert: %10.0f -> %10.0f facts/s (x%.2f)   delete: %10.0f -> %10.0f facts/s (x%.2f)" % (name
+              ,one_ins, bulk_ins, bulk_ins/one_ins, one_del, bulk_del, bulk_del/one_del)
+
+if __name__ == "__main__":
+	num_of_facts = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+	batch_size   = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+	print "FactStore, %s facts in batches of %s (fact by fact -> bulk)" % (num_of_facts,batch_size)
+	for columnar in [False,True]:
+		for num_of_indexes in [0,1,2]:
+			run_bench("%s, %s indexes" % ("columnar" if columnar else "dict",num_of_indexes), columnar, num_of_indexes, num_of_facts, batch_size)
@@ -0,0 +1,104 @@
+
+'''
+This file is part of MSR Ensemble for Python (MSRE-Py).
+
+MSRE-Py is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+MSRE-Py is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with MSRE-Py. If not, see <http://www.gnu.org/licenses/>.
+
+MSR Ensemble for Python (MSRE-Py) Version 0.9, Prototype Alpha
+
+Authors:
+Edmund S. L. Lam      sllam@qatar.cmu.edu
+Iliano Cervesato      iliano@cmu.edu
+
+* Development of MSRE-Py is funded by the Qatar National Research Fund as project NPRP 09-667-1-100 (Effective Programming for Large Distributed Ensembles)
+'''
+
+# Micro-benchmark: Insert and lookup throughput of FactStore hash indexes,
+# comparing the native value key encoders against the former string based keys.
+#
+# Usage: python benchmarks/bench_store_keys.py [<num of facts>]
+
+import gc
+import sys
+import time
+
+from msr_ensemble.facts.term import Term
+from msr_ensemble.facts.fact import Fact, register_fact
+from msr_ensemble.context.store import FactStore
+from msr_ensemble.context.fact_repr import make_fact_repr
+
+class BenchEdge(Fact):
+	def __init__(self, x1, x2):
+		self.initialize(x1, x2)
+register_fact(BenchEdge)
+
+class BenchPair(Fact):
+	def __init__(self, x1, x2, x3):
+		self.initialize(x1, x2, x3)
+register_fact(BenchPair)
+
+# The string based key encoder, as used before native key encoders
+def str_key_encoder(indices):
+	def lookup_key(vs):
+		ks = [ str(vs[index]) for index in indices ]
+		return tuple(ks) if len(ks) > 1 else ks[0]
+	return lookup_key
+
+def new_bench_store(fact_class, num_of_binded, use_str_keys):
+	terms = [Term() for _ in xrange(0,fact_class.__init__.func_code.co_argcount-1)]
+	for term in terms[:num_of_binded]:
+		term.bind('X')
+	store = FactStore(fact_class.sym_id)
+	lookup_index = store.generate_lookup( fact_class(*terms) )['lookup_index']
+	for term in terms:
+		term.unbind()
+	if use_str_keys:
+		indices = range(0,num_of_binded)
+		store.hash_tables[lookup_index]['hash_key'] = str_key_encoder(indices)
+	return (store,lookup_index)
+
+def bench_store(fact_class, gen_values, num_of_binded, num_of_facts, use_str_keys):
+	(store,lookup_index) = new_bench_store(fact_class, num_of_binded, use_str_keys)
+	facts = []
+	for i in xrange(0,num_of_facts):
+		facts.append( make_fact_repr( fact_class(*map(Term,gen_values(i))) ) )
+
+	# As with timeit, cyclic garbage collection is kept out of the measurements
+	gc.collect()
+	gc.disable()
+	start = time.time()
+	for fact in facts:
+		store.add_to_store(fact)
+	insert_time = time.time() - start
+
+	start = time.time()
+	for fact in facts:
+		next(store.get_candidates(lookup_index, fact.values), None)
+	lookup_time = time.time() - start
+
+	return (num_of_facts/insert_time, num_of_facts/lookup_time)
+
+def run_bench(name, fact_class, gen_values, num_of_binded, num_of_facts):
+	(str_ins,str_look) = bench_store(fact_class, gen_values, num_of_binded, num_of_facts, True)
+	(nat_ins,nat_look) = bench_store(fact_class, gen_values, num_of_binded, num_of_facts, False)
+	print "%-28s insert: %10.0f -> %10.0f facts/s (x%.2f)   lookup: %10.0f -> %10.0f lookups/s (x%.2f)" % (name
+              ,str_ins, nat_ins, nat_ins/str_ins, str_look, nat_look, nat_look/str_look)
+
+if __name__ == "__main__":
+	num_of_facts = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+	print "FactStore hash keys, %s facts (string keys -> native keys)" % num_of_facts
+	run_bench("edge(<int>,_)", BenchEdge, lambda i: (i % 5000, i), 1, num_of_facts)
+	run_bench("edge(<loc>,_)", BenchEdge, lambda i: (u"%s::%s" % (i % 5000,i % 5000), i), 1, num_of_facts)
+	run_bench("pair(<int>,<loc>,_)", BenchPair, lambda i: (i % 1000, u"%s::%s" % (i % 8,i % 8), i), 2, num_of_facts)
+	run_bench("pair(<list>,<int>,_)", BenchPair, lambda i: ([i % 500, i % 7], i % 10, i), 2, num_of_facts)
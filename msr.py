@@ -28,10 +28,22 @@ from msr_ensemble.front_end.compile.transformers.neighbor_restrict_trans import
 
 import sys
 
-args = sys.argv
+# Compiler flags, and the runtime options they set in the generated executable
+flag_options = { '--explain':'explain', '--analyze':'analyze', '--semi-naive':'semi_naive' }
+
+# Compiler options given as --<option>=<value>, the runtime options they set, and the types of their values
+value_options = { '--store-mode':('store_mode',str), '--activation-batch':('activation_batch',int)
+                , '--matcher-mode':('matcher_mode',str), '--matcher-dump-dir':('matcher_dump_dir',str) }
+
+def is_value_option(arg):
+	return arg.split('=',1)[0] in value_options and '=' in arg
+
+args   = filter(lambda arg: arg not in flag_options and not is_value_option(arg), sys.argv)
+flags  = filter(lambda arg: arg in flag_options, sys.argv)
+values = map(lambda arg: arg.split('=',1), filter(is_value_option, sys.argv))
 
 if len(args) < 2:
-	print "Usage: python %s <MSR File Name>" % args[0]
+	print "Usage: python %s [--explain] [--analyze] [--semi-naive] [--store-mode=dict|columnar] [--activation-batch=<N>] [--matcher-mode=closure|compiled] [--matcher-dump-dir=<Dir>] <MSR File Name>" % args[0]
 else:
 	msr_code_gen = MSRCodeGen(args[1])
 	if msr_code_gen.has_errors():
@@ -41,5 +53,11 @@ else:
 		print "There are %s error(s) in total." % len(err_reports)
 	else:
 		msr_code_gen.decs = NeighborRestrictTrans(msr_code_gen.decs, msr_code_gen.source_text).trans()
-		msr_code_gen.gen_code()
+		exec_options = {}
+		for flag in flags:
+			exec_options[flag_options[flag]] = True
+		for (option,value) in values:
+			(exec_option,value_type) = value_options[option]
+			exec_options[exec_option] = value_type(value)
+		msr_code_gen.gen_code(exec_options=exec_options)
 	print "Done!"
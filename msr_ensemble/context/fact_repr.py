@@ -25,8 +25,32 @@ Iliano Cervesato      iliano@cmu.edu
 
 from msr_ensemble.facts.location import loc_rank, loc_proc_id
 
+# Compact record of a fact in the goals and the fact stores. Facts exchanged between
+# processes remain as dicts (see make_fact_repr_loc) and are converted at the receiving end.
+#   - prior, sym_id, values : Priority, predicate symbol id and argument values (tuple) of the fact.
+#   - fact_id               : Store id of the fact, None while it is not stored.
+#   - hash_values           : Hash keys of the fact in each hash index of its store, allocated when stored.
+#   - row                   : Row of the fact in a columnar fact store (see context/store.py).
+class FactRepr(object):
+
+	__slots__ = ('prior','sym_id','values','fact_id','hash_values','row')
+
+	def __init__(self, prior, sym_id, values):
+		self.prior   = prior
+		self.sym_id  = sym_id
+		self.values  = values
+		self.fact_id = None
+		self.hash_values     = None
+		self.row = None
+
+	def __repr__(self):
+		return "%s:%s" % (self.sym_id,pretty_fact_repr(self))
+
 def make_fact_repr(fact):
-	return { 'prior':fact.priority, 'sym_id':fact.sym_id, 'values':[ term.value for term in fact.terms ] }
+	return FactRepr(fact.priority, fact.sym_id, tuple([ term.value for term in fact.terms ]))
+
+def fact_repr_from_msg(msg):
+	return FactRepr(msg['prior'], msg['sym_id'], tuple(msg['values']))
 
 def make_fact_repr_loc(fact):
 	location = fact.location.value
@@ -37,4 +61,4 @@ def make_fact_pat(fact):
 	return { 'sym_id':fact.sym_id, 'terms':fact.terms, 'location':fact.location }
 
 def pretty_fact_repr(fact_repr):
-	return "%s%s" % (tuple(fact_repr['values']), ("#%s" % fact_repr['fact_id']['id']) if 'fact_id' in fact_repr else "")
+	return "%s%s" % (tuple(fact_repr.values), ("#%s" % fact_repr.fact_id) if fact_repr.fact_id != None else "")
@@ -23,8 +23,11 @@ Iliano Cervesato      iliano@cmu.edu
 * Development of MSRE-Py is funded by the Qatar National Research Fund as project NPRP 09-667-1-100 (Effective Programming for Large Distributed Ensembles)
 '''
 
+from heapq import heappush, heappop, heapify
+from collections import deque
+
 from msr_ensemble.facts.fact import Fact, get_fact_class
-from msr_ensemble.context.fact_repr import make_fact_repr
+from msr_ensemble.context.fact_repr import FactRepr, make_fact_repr
 
 def add_goals(goals, facts):
 	map(lambda fact: add_goal(goals,fact),facts)
@@ -49,6 +52,11 @@ class Goals:
 	def push_many(self, facts):
 		pass
 
+	# Pops the next goal and, if its predicate is one of sym_ids, the goals of the same predicate and
+	# priority that follow it in the queue, up to limit goals in all.
+	def pop_batch(self, limit, sym_ids):
+		return [self.pop()]
+
 class ListGoals(Goals):
 
 	def __init__(self):
@@ -64,122 +72,143 @@ class ListGoals(Goals):
 		goals = self.goals
 		map(lambda fact: goals.append(fact), facts)
 
-HEAP_LEAF = 0
-HEAP_LEFT_PARENT = 1
-HEAP_RIGHT_PARENT = 2
-
-def new_heap_leaf():
-	return { 'type':HEAP_LEAF, 'key':None, 'data':None, 'left':None, 'right':None }
-
-def new_heap_left_parent(key, data, left_heap, right_heap):
-	return { 'type':HEAP_LEFT_PARENT, 'key':key, 'data':data, 'left':left_heap, 'right':right_heap }
-
-def new_heap_right_parent(key, data, left_heap, right_heap):
-	return { 'type':HEAP_RIGHT_PARENT, 'key':key, 'data':data, 'left':left_heap, 'right':right_heap }
-
-def insert_heap(heap, key, data):
-	type = heap['type']
-	if type == HEAP_LEAF:
-		heap['type']  = HEAP_LEFT_PARENT
-		heap['key']   = key
-		heap['data']  = data
-		heap['left']  = new_heap_leaf()
-		heap['right'] = new_heap_leaf()
-	else:
-		if type == HEAP_LEFT_PARENT:
-			new_type = HEAP_RIGHT_PARENT
-			i_heap   = heap['left']
-		else:
-			new_type = HEAP_LEFT_PARENT
-			i_heap   = heap['right']
-		my_key  = heap['key']
-		my_data = heap['data']
-		heap['type'] = new_type
-		if key < my_key:
-			insert_heap(i_heap,my_key,my_data)
-			heap['key'] = key
-			heap['data'] = data
-		else:
-			insert_heap(i_heap,key,data)
-			
-
-def get_min_heap(heap):
-	return heap['data']
-
-def to_array_heap(heap):
-	ls = []
-	data = get_min_heap(heap)
-	while data != None:	
-		ls.append((heap['key'],data))
-		delete_min_heap(heap)
-		data = get_min_heap(heap)
-	return ls		
-
-def delete_min_heap(heap):
-	type = heap['type']
-	if type == HEAP_LEAF:
-		pass
-	else:
-		new_heap = merge_heap(heap['left'],heap['right'])
-		heap['type']  = new_heap['type']
-		heap['key']   = new_heap['key']
-		heap['data']  = new_heap['data']
-		heap['left']  = new_heap['left']
-		heap['right'] = new_heap['right']
-
-def merge_heap(heap1,heap2):
-	type1 = heap1['type']
-	type2 = heap2['type']
-	if type1 == HEAP_LEAF and type2 == HEAP_LEAF:
-		return new_heap_leaf()
-	elif type2 == HEAP_LEAF:
-		return heap1
-	elif type1 == HEAP_LEAF:
-		return heap2
-	else:
-		key1 = heap1['key']
-		key2 = heap2['key']
-		if key1 < key2:
-			data1 = heap1['data']
-			delete_min_heap(heap1)
-			return new_heap_left_parent(key1,data1,heap1,heap2) 
-		else:
-			data2 = heap2['data']
-			delete_min_heap(heap2)
-			return new_heap_right_parent(key2,data2,heap1,heap2)
-
+# Goals ordered by fact priority (lowest first), kept in an array-backed binary heap.
+# Heap entries are tuples (prior, seq, fact), where seq is a monotonically increasing
+# insertion counter: It breaks ties between equal priorities in FIFO order, and
+# ensures that fact representations are never compared themselves.
 class HeapGoals(Goals):
 
 	def __init__(self):
-		self.goals = new_heap_leaf()
+		self.goals = []
+		self.seq   = 0
+
+	def __len__(self):
+		return len(self.goals)
 
 	def pop(self):
-		heap = self.goals
-		if heap['type'] == HEAP_LEAF:
-			raise IndexError
-		fact = heap['data']
-		delete_min_heap(heap)
-		return fact
+		# Raises IndexError when empty, like the other goal queues
+		return heappop(self.goals)[2]
 
 	def push(self, fact):
-		heap = self.goals
-		insert_heap(heap, fact['prior'], fact)
+		self.seq += 1
+		heappush(self.goals, (fact.prior, self.seq, fact))
 
 	def push_many(self, facts):
-		heap = self.goals
+		goals = self.goals
+		seq   = self.seq
+		entries = []
 		for fact in facts:
-			insert_heap(heap, fact['prior'], fact)
+			seq += 1
+			entries.append( (fact.prior, seq, fact) )
+		self.seq = seq
+		if len(entries) > len(goals):
+			# Large batch: Re-heapify in bulk, O(n + k) instead of O(k log (n + k))
+			goals.extend( entries )
+			heapify(goals)
+		else:
+			for entry in entries:
+				heappush(goals, entry)
+
+	def pop_batch(self, limit, sym_ids):
+		goals = self.goals
+		prior,_,fact = heappop(goals)
+		batch = [fact]
+		sym_id = fact.sym_id
+		if sym_id in sym_ids:
+			while len(batch) < limit and len(goals) > 0 and goals[0][0] == prior and goals[0][2].sym_id == sym_id:
+				batch.append( heappop(goals)[2] )
+		return batch
 
 	def pop_all(self):
-		return to_array_heap(self.goals)
+		goals = self.goals
+		ls = []
+		while len(goals) > 0:
+			prior,_,fact = heappop(goals)
+			ls.append((prior,fact))
+		return ls
+
+# Goals with small non-negative integer priorities, kept in one FIFO bucket per priority level.
+# min_prior is a lower bound on the lowest non-empty bucket: Pushes lower it, pops advance it past
+# empty buckets, so push and pop are O(1) save for scanning the (bounded) number of levels.
+# Facts with priorities outside of 0..max_prior, which generated code never produces, are kept
+# in an overflow heap rather than rejected.
+class BucketGoals(Goals):
+
+	def __init__(self, max_prior):
+		self.buckets   = [ deque() for _ in xrange(max_prior+1) ]
+		self.max_prior = max_prior
+		self.min_prior = max_prior + 1
+		self.size      = 0
+		self.overflow  = HeapGoals()
+
+	def __len__(self):
+		return self.size + len(self.overflow)
+
+	def pop(self):
+		if self.size > 0:
+			buckets = self.buckets
+			prior = self.min_prior
+			while len(buckets[prior]) == 0:
+				prior += 1
+			self.min_prior = prior
+			overflow = self.overflow.goals
+			if len(overflow) == 0 or overflow[0][0] >= prior:
+				self.size -= 1
+				return buckets[prior].popleft()
+		return self.overflow.pop()
 
+	def push(self, fact):
+		prior = fact.prior
+		if type(prior) == int and 0 <= prior <= self.max_prior:
+			self.buckets[prior].append(fact)
+			self.size += 1
+			if prior < self.min_prior:
+				self.min_prior = prior
+		else:
+			self.overflow.push(fact)
+
+	def push_many(self, facts):
+		push = self.push
+		for fact in facts:
+			push(fact)
+
+	def pop_batch(self, limit, sym_ids):
+		fact = self.pop()
+		batch = [fact]
+		prior  = fact.prior
+		sym_id = fact.sym_id
+		if sym_id in sym_ids and type(prior) == int and 0 <= prior <= self.max_prior:
+			# The fact came from the bucket of its priority, which precedes the overflow heap
+			bucket = self.buckets[prior]
+			while len(batch) < limit and len(bucket) > 0 and bucket[0].sym_id == sym_id:
+				batch.append( bucket.popleft() )
+				self.size -= 1
+		return batch
+
+	def pop_all(self):
+		ls = []
+		while len(self) > 0:
+			fact = self.pop()
+			ls.append((fact.prior,fact))
+		return ls
+
+# Largest priority for which bucketed goals are used
+MAX_BUCKET_PRIORITY = 64
+
+# Goal queue for facts of the given priorities: Bucketed goals if they are all known to be integers 
+# within 0..MAX_BUCKET_PRIORITY, a heap otherwise (including when priorities are not known, i.e., None).
+def new_goals(priorities=None):
+	if priorities != None and len(priorities) > 0:
+		if all(map(lambda p: type(p) == int and 0 <= p <= MAX_BUCKET_PRIORITY, priorities)):
+			return BucketGoals(max(priorities))
+	return HeapGoals()
 
 def test_heap():
 	hg = HeapGoals()
-	hg.push({ 'prior':42, 'value':'gaga' })
-	hg.push({ 'prior':1, 'value':'goa' })
-	hg.push({ 'prior':24, 'value':'asdga' })
-	hg.push({ 'prior':897, 'value':'gsdfga' })
-	hg.push({ 'prior':3, 'value':'gag' })
+	hg.push(FactRepr(42, 0, ('gaga',)))
+	hg.push(FactRepr(1, 0, ('goa',)))
+	hg.push(FactRepr(24, 0, ('asdga',)))
+	hg.push(FactRepr(897, 0, ('gsdfga',)))
+	hg.push(FactRepr(3, 0, ('gag',)))
 	return hg.pop_all()
 
@@ -25,49 +25,81 @@ Iliano Cervesato      iliano@cmu.edu
 '''
 
 from msr_ensemble.facts.term import Term
-from msr_ensemble.facts.fact import Fact, Id, new_id, pretty_id, get_all_fact_classes, get_fact_name
+from msr_ensemble.facts.fact import Fact, get_all_fact_classes, get_fact_name
 from msr_ensemble.rules.rule import get_all_rule_classes
 from msr_ensemble.context.fact_repr import pretty_fact_repr
 
+# Propagation history of a rule: The set of rule instances (tuples of the fact ids of the heads, in
+# order of the heads of the rule) that the rule has been applied to. Since fact ids are only unique
+# within the store of each predicate, keys are in head order, whose predicates (sym_ids) are fixed,
+# regardless of the occurrence that matched them. Each occurrence checks its matches through a checker
+# (see new_checker), given the head order of its matched facts ('history_order' of the occurrence).
+#
+# Entries are garbage collected with the facts: The store of each head keeps the entries that a fact 
+# participates in (see FactStore.history_entries in context/store.py), and deleting any participating 
+# fact from its store removes the entry (see remove_history_entry).
+
 class PropHistory:
 
-	def __init__(self, rule_id):
+	def __init__(self, rule_id, fact_stores):
 		self.rule_id = rule_id
+		self.fact_stores = fact_stores
 		self.history = {}
+		self.sym_ids = ()
+		self.recorded = 0
+		self.peak     = 0
+
+	def __len__(self):
+		return len(self.history)
 
-	def check_history(self, ids):
+	# Returns a function that, given the matched facts of a rule occurrence (in match order), returns True
+	# and records them in the history if they are not already recorded, and returns False otherwise. 
+	# 'order' lists the match positions of the facts of each head, in head order.
+	def new_checker(self, order, sym_ids):
 		history = self.history
-		rule_id = self.rule_id
-		id_sig = ','.join(map(lambda id: str(id['id']) ,ids))
-		if id_sig not in history:
-			# print id_sig
-			history[id_sig] = ()
-			for id in ids:
-				id['history_entries'][rule_id].append(id_sig)
+		self.sym_ids = tuple(sym_ids)
+		stores = [ self.fact_stores[sym_id] for sym_id in sym_ids ]
+		def check_history(fact_reprs):
+			key = tuple([ fact_reprs[i].fact_id for i in order ])
+			if key in history:
+				return False
+			history[key] = True
+			entry = (self,key)
+			for i in xrange(0,len(key)):
+				stores[i].add_history_entry(key[i], entry)
+			self.recorded += 1
+			if len(history) > self.peak:
+				self.peak = len(history)
 			return True
-		else:
-			return False
+		return check_history
+
+	# Remove the given entry, and drop it from the entries of the facts that participate in it.
+	def remove_history_entry(self, key):
+		if self.history.pop(key, None) != None:
+			fact_stores = self.fact_stores
+			entry = (self,key)
+			sym_ids = self.sym_ids
+			for i in xrange(0,len(key)):
+				fact_stores[sym_ids[i]].discard_history_entry(key[i], entry)
 
-	def remove_history_entries(self, id_sigs):
-		history = self.history
-		for id_sig in id_sigs:
-			if id_sig in history:
-				del history[id_sig]
-		
 	def __str__(self):
 		hist_str = "%s Rule Propagate History:\n" % str(self.rule_id)
-		return hist_str + "\n".join(self.history)
+		return hist_str + "\n".join(map(lambda key: ','.join(map(str,key)), self.history))
 
-def new_histories():
+def new_histories(fact_stores):
 	histories = {}
 	for rule_id in get_all_rule_classes():
-		histories[rule_id] = PropHistory(rule_id)
+		histories[rule_id] = PropHistory(rule_id, fact_stores)
 	return histories
 
-def check_history(histories, rule_id, ids):
-	return histories[rule_id].check_history(ids)
-
-def remove_history_entry(histories, rule_id, id):
-	history = histories[rule_id]
-	history.remove_history_entries(id['history_entries'][rule_id])
+# History size of each rule that has propagated: Current and peak number of entries, and number
+# of entries ever recorded (the difference being collected with deleted facts).
+def pretty_history_sizes(histories):
+	strs = []
+	for rule_id in sorted(histories.keys()):
+		history = histories[rule_id]
+		if history.recorded > 0:
+			strs.append( "%s: %s entries (peak %s, recorded %s)" % (get_all_rule_classes()[rule_id].__name__,len(history)
+                                                                               ,history.peak,history.recorded) )
+	return '\n'.join(strs)
 
@@ -25,12 +25,16 @@ Iliano Cervesato      iliano@cmu.edu
 '''
 
 import sys
+import operator
 
 from msr_ensemble.facts.term import Term
-from msr_ensemble.facts.fact import Fact, Id, new_id, pretty_id, get_all_fact_classes, get_fact_name
-from msr_ensemble.context.fact_repr import pretty_fact_repr
+from msr_ensemble.facts.fact import Fact, SET_MODIFIER, MIN_MODIFIER, MAX_MODIFIER, get_all_fact_classes, get_fact_name
+from msr_ensemble.context.fact_repr import FactRepr, pretty_fact_repr
 
+from array import array
+from bisect import bisect_left, bisect_right, insort
 from collections import defaultdict
+from itertools import izip
 from cPickle import dumps
 
 class FactStore:
@@ -40,15 +44,27 @@ class FactStore:
 		self.next_id  = 0
 		self.hash_pats   = []
 		self.hash_tables = []
+		self.range_pats   = []
+		self.range_tables = []
 		self.main_table  = {}
-		#self.size = 0
+		self.history_entries = {}
+		self.has_filters = False
+		self.value_keys  = None
+		self.agg_index   = None
+		self.copies      = None
+		self.size = 0
 
+	# Generate (or reuse) the hash index that serves lookups of the given fact pattern.
+	# Binded variables and constant arguments both form the hash key, so candidates
+	# returned by the index agree with the pattern on all of its ground arguments.
+	# A lookup is exact if the pattern has no free arguments: Every candidate in its
+	# hash bucket is then a match, i.e., the bucket is an existence/count index for it.
 	def generate_lookup(self, fact):
-		lookup_pat = build_lookup_pat(fact)
-		lookup_filter_info = build_lookup_and_filter(fact, lookup_pat)
+		lookup_pat  = build_lookup_pat(fact)
+		lookup_info = build_lookup_keys(fact, lookup_pat)
 		
-		if 'lookup_key' in lookup_filter_info:
-			hash_pat    = (lookup_pat['binded_keys'],lookup_pat['binded_hashs'])
+		if 'lookup_key' in lookup_info:
+			hash_pat    = lookup_info['key_indices']
 			hash_pats   = self.hash_pats
 			hash_tables = self.hash_tables
 			lookup_index = -1
@@ -58,44 +74,325 @@ class FactStore:
 					break
 			if lookup_index == -1:
 				hash_pats.append(hash_pat)
-				hash_tables.append({ 'hash_table' : defaultdict(dict) 
-                                                   , 'hash_key'   : lookup_filter_info['lookup_key']
+				hash_tables.append({ 'hash_table' : self.new_hash_buckets() 
+                                                   , 'hash_key'   : lookup_info['lookup_key']
                                                    , 'hash_str'   : str(fact) })
 				lookup_index = len(hash_pats) - 1
+				if self.size > 0:
+					self.backfill_hash_table(hash_tables[lookup_index])
 		else:
 			lookup_index = -1
-		return { 'lookup_index':lookup_index, 'filter':lookup_filter_info['filter'] }
+		exact = len(lookup_pat['free']) + len(lookup_pat['duncare']) == 0
+		return { 'lookup_index':lookup_index, 'exact':exact }
 			
+	# Generate (or reuse) the range index that serves lookups of the given fact pattern, ordered
+	# on the argument at the given position. The range index is a hash index (keyed as in
+	# generate_lookup) whose buckets are lists of (value,fact id,fact) entries, kept sorted by insort.
+	def generate_range_lookup(self, fact, position):
+		lookup_pat  = build_lookup_pat(fact)
+		lookup_info = build_lookup_keys(fact, lookup_pat)
+		if 'lookup_key' in lookup_info:
+			range_pat = (lookup_info['key_indices'],position)
+			hash_key  = lookup_info['lookup_key']
+		else:
+			range_pat = ((),position)
+			hash_key  = no_key
+		range_pats = self.range_pats
+		for i in xrange(0,len(range_pats)):
+			if range_pat == range_pats[i]:
+				return { 'range_index':i, 'exact':False }
+		range_pats.append(range_pat)
+		self.range_tables.append({ 'range_table' : defaultdict(list)
+                                         , 'position'    : position
+                                         , 'hash_key'    : hash_key
+                                         , 'hash_str'    : str(fact) })
+		if self.size > 0:
+			self.backfill_range_table(self.range_tables[-1])
+		return { 'range_index':len(range_pats)-1, 'exact':False }
+
+	# Indexes generated on a live store (e.g., when rule occurrences are re-planned) are backfilled
+	# with the stored facts. The hash key of a new hash index goes last in the facts' 'hash_values'.
+	def backfill_hash_table(self, hash_table):
+		buckets  = hash_table['hash_table']
+		hash_key = hash_table['hash_key']
+		for fact_repr in self.main_table.itervalues():
+			hash_val = hash_key(fact_repr.values)
+			fact_repr.hash_values += (hash_val,)
+			buckets[hash_val][fact_repr.fact_id] = fact_repr
+
+	def backfill_range_table(self, range_table):
+		buckets  = range_table['range_table']
+		hash_key = range_table['hash_key']
+		position = range_table['position']
+		for fact_repr in self.main_table.itervalues():
+			values = fact_repr.values
+			insort(buckets[hash_key(values)], (values[position],fact_repr.fact_id,fact_repr))
+
+	def add_to_ranges(self, values, id_val, handle):
+		for range_table in self.range_tables:
+			insort(range_table['range_table'][range_table['hash_key'](values)], (values[range_table['position']],id_val,handle))
+
+	def del_from_ranges(self, values, id_val):
+		for range_table in self.range_tables:
+			buckets  = range_table['range_table']
+			hash_val = range_table['hash_key'](values)
+			bucket = buckets[hash_val]
+			del bucket[bisect_left(bucket, (values[range_table['position']],id_val))]
+			if len(bucket) == 0:
+				del buckets[hash_val]
+
+	# Drops the hash and range indexes of the store whose positions are not among the given ones (e.g., indexes
+	# that no rule occurrence looks up anymore after re-planning). The kept indexes are renumbered in order, and
+	# the new positions of the kept hash and range indexes are returned, as dicts from their old positions.
+	def drop_indexes(self, hash_indices, range_indices):
+		hash_kept  = filter(lambda i: i in hash_indices, xrange(0,len(self.hash_tables)))
+		range_kept = filter(lambda i: i in range_indices, xrange(0,len(self.range_tables)))
+		if len(hash_kept) < len(self.hash_tables):
+			self.hash_pats   = map(lambda i: self.hash_pats[i], hash_kept)
+			self.hash_tables = map(lambda i: self.hash_tables[i], hash_kept)
+			self.drop_hash_values(hash_kept)
+		if len(range_kept) < len(self.range_tables):
+			self.range_pats   = map(lambda i: self.range_pats[i], range_kept)
+			self.range_tables = map(lambda i: self.range_tables[i], range_kept)
+		return (dict([ (old,new) for (new,old) in enumerate(hash_kept) ]), dict([ (old,new) for (new,old) in enumerate(range_kept) ]))
+
+	# Keeps the hash keys of the stored facts in the kept hash indexes only. Copies of counted records may
+	# still hold the hash keys of dropped indexes, which is why deletions read them off the stored record.
+	def drop_hash_values(self, hash_kept):
+		for fact_repr in self.main_table.itervalues():
+			hash_values = fact_repr.hash_values
+			fact_repr.hash_values = tuple(map(lambda i: hash_values[i], hash_kept))
+
+	# Hash buckets of a new hash index: Each bucket maps fact ids to stored facts.
+	def new_hash_buckets(self):
+		return defaultdict(dict)
+
 	def add_to_store(self, fact_repr):
+		if self.copies != None and self.add_copy(fact_repr):
+			return
 		self.next_id += 1
-		fact_id = new_id(self.next_id)
-		fact_repr['fact_id'] = fact_id
-		id_val = fact_id['id']
+		id_val = self.next_id
+		fact_repr.fact_id = id_val
 		self.main_table[id_val] = fact_repr
-		#self.size += 1
-		values  = fact_repr['values']
-		# id      = fact_repr['fact_id']
-		fact_id_add_hash_value = fact_id['hash_values'].append
+		self.size += 1
+		values  = fact_repr.values
+		hash_values = []
 		for hash_table in self.hash_tables:
 			hash_val = hash_table['hash_key'](values)
 			# print hash_val
-			fact_id_add_hash_value(hash_val)
+			hash_values.append(hash_val)
 			table = hash_table['hash_table'][hash_val]
 			table[id_val] = fact_repr
+		fact_repr.hash_values = tuple(hash_values)
+		if len(self.range_tables) > 0:
+			self.add_to_ranges(values, id_val, fact_repr)
+		if self.has_filters:
+			self.add_to_filters(fact_repr)
+		if self.copies != None:
+			self.add_record(fact_repr)
 
-	def del_from_store(self, fact_id):
-		id_val      = fact_id['id']
-		hash_values = fact_id['hash_values']
+	def del_from_store(self, fact_repr):
+		if self.copies != None and self.del_copy(fact_repr):
+			return
+		id_val      = fact_repr.fact_id
 		hash_tables = self.hash_tables
 		# sys.stdout.write("%s\n" % pretty_candidates(self.main_table))
-		del self.main_table[id_val]
+		hash_values = self.main_table.pop(id_val).hash_values
 		for i in xrange(0,len(hash_values)):
 			hash_table = hash_tables[i]['hash_table']
 			can_table = hash_table[hash_values[i]]
 			del can_table[id_val]
 			if None == next(can_table.itervalues(),None):
 				del hash_table[hash_values[i]]
-		#self.size -= 1
+		if len(self.range_tables) > 0:
+			self.del_from_ranges(fact_repr.values, id_val)
+		if id_val in self.history_entries:
+			self.del_history_entries(id_val)
+		if self.has_filters:
+			self.del_from_filters(fact_repr)
+		self.size -= 1
+
+	# Bulk insertion and deletion: The main table is updated for the whole batch first, then each index in
+	# turn, with its key function and buckets looked up once per batch rather than once per fact. Stores 
+	# with insertion filters or counted records insert (and delete) fact by fact.
+
+	def add_many_to_store(self, fact_reprs):
+		if self.has_filters or self.copies != None:
+			for fact_repr in fact_reprs:
+				self.add_to_store(fact_repr)
+			return
+		main_table = self.main_table
+		id_val = self.next_id
+		for fact_repr in fact_reprs:
+			id_val += 1
+			fact_repr.fact_id = id_val
+			main_table[id_val] = fact_repr
+		self.next_id = id_val
+		self.size += len(fact_reprs)
+		all_keys = []
+		for hash_table in self.hash_tables:
+			hash_key = hash_table['hash_key']
+			buckets  = hash_table['hash_table']
+			keys = [ hash_key(fact_repr.values) for fact_repr in fact_reprs ]
+			for fact_repr,hash_val in izip(fact_reprs, keys):
+				buckets[hash_val][fact_repr.fact_id] = fact_repr
+			all_keys.append( keys )
+		if len(all_keys) > 0:
+			for fact_repr,hash_values in izip(fact_reprs, izip(*all_keys)):
+				fact_repr.hash_values = hash_values
+		else:
+			for fact_repr in fact_reprs:
+				fact_repr.hash_values = ()
+		if len(self.range_tables) > 0:
+			for fact_repr in fact_reprs:
+				self.add_to_ranges(fact_repr.values, fact_repr.fact_id, fact_repr)
+
+	def del_many_from_store(self, fact_reprs):
+		if self.has_filters or self.copies != None:
+			for fact_repr in fact_reprs:
+				self.del_from_store(fact_repr)
+			return
+		main_table = self.main_table
+		history_entries = self.history_entries
+		all_hash_values = [ main_table.pop(fact_repr.fact_id).hash_values for fact_repr in fact_reprs ]
+		hash_tables = self.hash_tables
+		for i in xrange(0,len(hash_tables)):
+			buckets = hash_tables[i]['hash_table']
+			for fact_repr,hash_values in izip(fact_reprs, all_hash_values):
+				hash_val = hash_values[i]
+				bucket = buckets[hash_val]
+				del bucket[fact_repr.fact_id]
+				if len(bucket) == 0:
+					del buckets[hash_val]
+		for fact_repr in fact_reprs:
+			id_val = fact_repr.fact_id
+			if len(self.range_tables) > 0:
+				self.del_from_ranges(fact_repr.values, id_val)
+			if id_val in history_entries:
+				self.del_history_entries(id_val)
+		self.size -= len(fact_reprs)
+
+	# Whether the given fact (given its fact id when stored) is still in the store. Copies of a counted 
+	# record are in the store as long as the record is.
+	def is_stored(self, fact_repr):
+		record = self.main_table.get(fact_repr.fact_id)
+		return record is fact_repr or (record != None and self.copies != None)
+
+	# Propagation history entries (see context/prop_history.py) that each stored fact participates in,
+	# by fact id, as sets of (<history>,<key>). Entries are removed from their history when the fact is
+	# deleted.
+
+	def add_history_entry(self, id_val, entry):
+		history_entries = self.history_entries
+		if id_val in history_entries:
+			history_entries[id_val].add(entry)
+		else:
+			history_entries[id_val] = set([entry])
+
+	def discard_history_entry(self, id_val, entry):
+		entries = self.history_entries.get(id_val)
+		if entries != None:
+			entries.discard(entry)
+			if len(entries) == 0:
+				del self.history_entries[id_val]
+
+	def del_history_entries(self, id_val):
+		for (history,key) in self.history_entries.pop(id_val):
+			history.remove_history_entry(key)
+
+	# Insertion filters, for predicates declared with the 'set', 'min' or 'max' modifiers. The store of a
+	# set predicate keeps the encoded argument values of its facts in 'value_keys'. The store of a min (max)
+	# predicate keeps, in 'agg_index', the fact with the least (greatest) last argument among the facts that 
+	# agree on all other arguments (its group). An arriving fact is admitted (see string_up_filtered_funcs in
+	# interpret/mpi_runtime.py) unless it is an exact duplicate of a fact of a set predicate, or it is not
+	# better than the fact of its group. An admitted fact replaces the fact of its group once it is stored,
+	# i.e., unless an occurrence tried before it is stored consumes it. The replaced fact is then deleted.
+
+	def enable_set_semantics(self):
+		self.value_keys  = set()
+		self.has_filters = True
+
+	# better: Comparison of last arguments, that holds if the first is better than the second
+	def enable_aggregate(self, better):
+		self.agg_index   = {}
+		self.agg_better  = better
+		self.has_filters = True
+
+	def admit(self, fact_repr):
+		values = fact_repr.values
+		if self.value_keys != None and encode_key_value(values) in self.value_keys:
+			return False
+		if self.agg_index != None:
+			best = self.agg_index.get( encode_key_value(values[:-1]) )
+			if best != None and not self.agg_better(values[-1], best.values[-1]):
+				return False
+		return True
+
+	def add_to_filters(self, fact_repr):
+		values = fact_repr.values
+		if self.value_keys != None:
+			self.value_keys.add( encode_key_value(values) )
+		if self.agg_index != None:
+			group_key = encode_key_value(values[:-1])
+			best = self.agg_index.get(group_key)
+			if best != None:
+				self.del_from_store(best)
+			self.agg_index[group_key] = fact_repr
+
+	def del_from_filters(self, fact_repr):
+		values = fact_repr.values
+		if self.value_keys != None:
+			self.value_keys.discard( encode_key_value(values) )
+		if self.agg_index != None:
+			group_key = encode_key_value(values[:-1])
+			best = self.agg_index.get(group_key)
+			if best is fact_repr or (best != None and best.fact_id == fact_repr.fact_id):
+				del self.agg_index[group_key]
+
+	# Counted predicates, declared with the 'counted' modifier: Identical facts share one record in the
+	# store (i.e., one fact id, and one entry in the main table and in each index), with their number of 
+	# copies. 'copies' maps the encoded argument values of each record to [<record>,<count>]. A copy of an
+	# existing record is given the fact id (and hash values, row) of the record, and deleting a copy only
+	# decrements the count, until the last copy. Store sizes count records, not copies.
+
+	def enable_counting(self):
+		self.copies = {}
+
+	# Adds a copy of the record of the given fact, returns False if there is no such record
+	def add_copy(self, fact_repr):
+		entry = self.copies.get( encode_key_value(fact_repr.values) )
+		if entry == None:
+			return False
+		record = entry[0]
+		entry[1] += 1
+		fact_repr.fact_id     = record.fact_id
+		fact_repr.hash_values = record.hash_values
+		fact_repr.row         = record.row
+		return True
+
+	def add_record(self, fact_repr):
+		self.copies[encode_key_value(fact_repr.values)] = [fact_repr,1]
+
+	# Deletes a copy of the record of the given fact, returns True if other copies remain
+	def del_copy(self, fact_repr):
+		key   = encode_key_value(fact_repr.values)
+		entry = self.copies[key]
+		if entry[1] > 1:
+			entry[1] -= 1
+			return True
+		del self.copies[key]
+		return False
+
+	def num_copies(self, values):
+		if self.copies == None:
+			return 1
+		return self.copies[encode_key_value(values)][1]
+
+	def pretty_copies(self):
+		if self.copies == None:
+			return ""
+		counted = [ "%sx%s" % (pretty_fact_repr(record),count) for (record,count) in self.copies.values() if count > 1 ]
+		return "--- Copies ---\n{ %s }\n" % ', '.join(counted)
 
 	def get_candidates(self, lookup_index, term_values):
 		if lookup_index >= 0:
@@ -109,24 +406,110 @@ class FactStore:
 		else:
 			return self.main_table.itervalues()
 
-	def get_candidate_lookup_func_from_store(self, lookup_index, term_pats):
+	# Lookup functions of the matching: The lookup key is read from the slots of the matching environment
+	# (see interpret/interpreter.py) given by 'key_slots', in order of the key indices of the lookup.
+	def get_candidate_lookup_func_from_store(self, lookup_index, key_slots):
 		if lookup_index >= 0:
-			hash_table_data = self.hash_tables[lookup_index]
-			hash_table = hash_table_data['hash_table']
-			hash_key   = hash_table_data['hash_key']
-			def lookup_func():
-				# hash_value = hash_key(map(lambda t: t.value,term_pats))
-				values = []
-				for t in term_pats:
-					values.append( t.value )
-				hash_value = hash_key(values)
+			hash_table = self.hash_tables[lookup_index]['hash_table']
+			env_key    = make_key_encoder(key_slots)
+			def lookup_func(env):
+				hash_value = env_key(env)
 				if hash_value in hash_table:
 					return hash_table[hash_value].itervalues()
 				else:
 					return {}.itervalues()
 			return lookup_func
 		else:
-			return self.main_table.itervalues
+			main_table = self.main_table
+			def lookup_func(env):
+				return main_table.itervalues()
+			return lookup_func
+
+	# Lookup functions for generated matchers (see interpret/matcher_gen.py), which compute the encoded 
+	# hash value of a lookup themselves: Bucket lookups return the candidates of the given hash value
+	# (of any hash value for lookup index -1), and range bucket lookups those within the given bounds,
+	# whose inclusiveness is fixed here. An inclusiveness of None means the bound is absent.
+	def get_bucket_lookup_func_from_store(self, lookup_index):
+		if lookup_index >= 0:
+			hash_table = self.hash_tables[lookup_index]['hash_table']
+			def lookup_func(hash_value):
+				if hash_value in hash_table:
+					return hash_table[hash_value].itervalues()
+				else:
+					return {}.itervalues()
+		else:
+			main_table = self.main_table
+			def lookup_func(_):
+				return main_table.itervalues()
+		return lookup_func
+
+	def get_range_bucket_lookup_func_from_store(self, range_index, lower_inclusive, upper_inclusive):
+		buckets = self.range_tables[range_index]['range_table']
+		def lookup_func(hash_value, lower, upper):
+			bucket = buckets.get(hash_value)
+			if bucket == None:
+				return iter([])
+			start = 0
+			end   = len(bucket)
+			if lower_inclusive != None:
+				start = bisect_left(bucket, (lower,)) if lower_inclusive else bisect_right(bucket, (lower,MAX_RANGE_ID))
+			if upper_inclusive != None:
+				end = bisect_right(bucket, (upper,MAX_RANGE_ID)) if upper_inclusive else bisect_left(bucket, (upper,))
+			return (bucket[i][2] for i in xrange(start,end))
+		return lookup_func
+
+	# Key indices, description and hash table of each hash and range index of the store
+	def index_tables(self):
+		tables = []
+		for i in xrange(0,len(self.hash_pats)):
+			tables.append( (self.hash_pats[i],self.hash_tables[i]['hash_str'],self.hash_tables[i]['hash_table']) )
+		for i in xrange(0,len(self.range_pats)):
+			tables.append( (self.range_pats[i][0],self.range_tables[i]['hash_str'],self.range_tables[i]['range_table']) )
+		return tables
+
+	# Store statistics: The number of stored facts, and for each hash (and range) index, its number
+	# of distinct keys and average bucket size. All are read off the store and its indexes as they are.
+	def get_stats(self):
+		index_stats = []
+		for (key_indices,hash_str,table) in self.index_tables():
+			distinct = len(table)
+			index_stats.append({ 'hash_str':hash_str, 'distinct':distinct
+                                           , 'avg_bucket':float(self.size)/distinct if distinct > 0 else 0.0 })
+		return { 'size':self.size, 'indexes':index_stats }
+
+	# Estimated number of candidates of a lookup keyed on the given argument indices: The average
+	# bucket size of the index on these indices, or failing that, of the most selective index on a
+	# subset of them. Without any such index, each key index is assumed to select DEFAULT_KEY_SELECTIVITY.
+	def estimate_candidates(self, key_indices):
+		size = self.size
+		if len(key_indices) == 0 or size == 0:
+			return float(size)
+		key_indices = tuple(key_indices)
+		estimate = None
+		for (index_keys,_,table) in self.index_tables():
+			if len(table) > 0 and set(index_keys) <= set(key_indices):
+				avg_bucket = float(size)/len(table)
+				if index_keys == key_indices:
+					return avg_bucket
+				if estimate == None or avg_bucket < estimate:
+					estimate = avg_bucket
+		if estimate == None:
+			estimate = max(1.0, size * (DEFAULT_KEY_SELECTIVITY ** len(key_indices)))
+		return estimate
+
+	# Range lookups return the stored facts of the hash bucket of the binded (and constant) terms,
+	# whose argument at the range position lies within the given bounds. 'lower' and 'upper' are
+	# (slot,inclusive) pairs or None, and the bounds are read from the environment at lookup time.
+	def get_range_lookup_func_from_store(self, range_index, key_slots, lower, upper):
+		range_func = self.get_range_bucket_lookup_func_from_store(range_index, lower[1] if lower != None else None
+                                                                         ,upper[1] if upper != None else None)
+		env_key = make_key_encoder(key_slots) if len(key_slots) > 0 else no_key
+		lower_slot = lower[0] if lower != None else None
+		upper_slot = upper[0] if upper != None else None
+		def lookup_func(env):
+			return range_func(env_key(env), env[lower_slot] if lower_slot != None else None
+                                         ,env[upper_slot] if upper_slot != None else None)
+		return lookup_func
 
 	def __str__(self):
 		store_header  = "%s Store:" % get_fact_name(self.sym_id)
@@ -137,22 +520,481 @@ class FactStore:
 		for i in xrange(0,len(hash_tables)):
 			hash_contents += "--- Hash Lookup %s: %s ---\n" % (i,hash_tables[i]['hash_str'])
 			hash_contents += pretty_hash_table(hash_tables[i]) + "\n"
-		return '%s' % '\n'.join([store_header,main_header,main_contents,hash_contents])
+		range_tables = self.range_tables
+		for i in xrange(0,len(range_tables)):
+			hash_contents += "--- Range Lookup %s: %s on %s ---\n" % (i,range_tables[i]['hash_str'],range_tables[i]['position'])
+			for key,entries in range_tables[i]['range_table'].iteritems():
+				hash_contents += "%s -> [ %s ]\n" % (key,', '.join([ "#%s" % entry[1] for entry in entries ]))
+		return '%s' % '\n'.join([store_header,main_header,main_contents,self.pretty_copies() + hash_contents])
 
 	def str_brief(self):
 		fact_name  = get_fact_name(self.sym_id)
 		fact_strs = []
 		for fact in candidate_args(self.main_table):
-			fact_strs.append( "%s(%s)" % (fact_name, ','.join( map(str,fact) )) )
+			fact_strs += [ "%s(%s)" % (fact_name, ','.join( map(str,fact) )) ] * self.num_copies(fact)
 		if len(fact_strs) > 0:
 			return ','.join(fact_strs)
 		else:
 			return None
 
-def new_stores():
+# Columnar fact store: Instead of keeping the fact records, each argument position is kept in a column,
+# and a fact is a row across the columns. Hash buckets are sets of row numbers, and candidates are
+# returned as FactRepr views of their row (with 'fact_id' and 'row' set). Rows of deleted facts are
+# recycled through a free list. Fact ids of rows are kept in 'row_ids', where 0 marks a free row.
+class ColumnarFactStore(FactStore):
+
+	def __init__(self, sym_id, arg_types):
+		self.sym_id   = sym_id
+		self.next_id  = 0
+		self.hash_pats   = []
+		self.hash_tables = []
+		self.range_pats   = []
+		self.range_tables = []
+		self.columns   = map(new_column, arg_types)
+		self.history_entries = {}
+		self.has_filters = False
+		self.value_keys  = None
+		self.agg_index   = None
+		self.copies      = None
+		self.row_ids   = array('l')
+		self.free_rows = array('l')
+		self.size = 0
+
+	def new_hash_buckets(self):
+		return defaultdict(set)
+
+	# Hash keys of rows are computed from their values, rather than kept with the facts
+	def drop_hash_values(self, hash_kept):
+		pass
+
+	def backfill_hash_table(self, hash_table):
+		buckets  = hash_table['hash_table']
+		hash_key = hash_table['hash_key']
+		for row in self.live_rows():
+			buckets[hash_key(self.row_view(row).values)].add(row)
+
+	def backfill_range_table(self, range_table):
+		buckets  = range_table['range_table']
+		hash_key = range_table['hash_key']
+		position = range_table['position']
+		for row in self.live_rows():
+			fact_repr = self.row_view(row)
+			values = fact_repr.values
+			insort(buckets[hash_key(values)], (values[position],fact_repr.fact_id,row))
+
+	def add_to_store(self, fact_repr):
+		if self.copies != None and self.add_copy(fact_repr):
+			return
+		self.next_id += 1
+		id_val = self.next_id
+		row_ids = self.row_ids
+		if len(self.free_rows) > 0:
+			row = self.free_rows.pop()
+			row_ids[row] = id_val
+		else:
+			row = len(row_ids)
+			row_ids.append(id_val)
+		fact_repr.fact_id = id_val
+		fact_repr.row     = row
+		self.size += 1
+		values = fact_repr.values
+		columns = self.columns
+		for i in xrange(0,len(columns)):
+			columns[i].set(row, values[i])
+		for hash_table in self.hash_tables:
+			hash_table['hash_table'][hash_table['hash_key'](values)].add(row)
+		if len(self.range_tables) > 0:
+			self.add_to_ranges(values, id_val, row)
+		if self.has_filters:
+			self.add_to_filters(fact_repr)
+		if self.copies != None:
+			self.add_record(fact_repr)
+
+	def del_from_store(self, fact_repr):
+		if self.copies != None and self.del_copy(fact_repr):
+			return
+		row    = fact_repr.row
+		values = fact_repr.values
+		for hash_table in self.hash_tables:
+			buckets  = hash_table['hash_table']
+			hash_val = hash_table['hash_key'](values)
+			bucket = buckets[hash_val]
+			bucket.discard(row)
+			if len(bucket) == 0:
+				del buckets[hash_val]
+		if len(self.range_tables) > 0:
+			self.del_from_ranges(values, fact_repr.fact_id)
+		if fact_repr.fact_id in self.history_entries:
+			self.del_history_entries(fact_repr.fact_id)
+		if self.has_filters:
+			self.del_from_filters(fact_repr)
+		for column in self.columns:
+			column.clear(row)
+		self.row_ids[row] = 0
+		self.free_rows.append(row)
+		self.size -= 1
+
+	def add_many_to_store(self, fact_reprs):
+		if self.has_filters or self.copies != None:
+			for fact_repr in fact_reprs:
+				self.add_to_store(fact_repr)
+			return
+		row_ids   = self.row_ids
+		free_rows = self.free_rows
+		id_val = self.next_id
+		for fact_repr in fact_reprs:
+			id_val += 1
+			if len(free_rows) > 0:
+				row = free_rows.pop()
+				row_ids[row] = id_val
+			else:
+				row = len(row_ids)
+				row_ids.append(id_val)
+			fact_repr.fact_id = id_val
+			fact_repr.row     = row
+		self.next_id = id_val
+		self.size += len(fact_reprs)
+		columns = self.columns
+		for i in xrange(0,len(columns)):
+			set_value = columns[i].set
+			for fact_repr in fact_reprs:
+				set_value(fact_repr.row, fact_repr.values[i])
+		for hash_table in self.hash_tables:
+			hash_key = hash_table['hash_key']
+			buckets  = hash_table['hash_table']
+			for fact_repr in fact_reprs:
+				buckets[hash_key(fact_repr.values)].add(fact_repr.row)
+		if len(self.range_tables) > 0:
+			for fact_repr in fact_reprs:
+				self.add_to_ranges(fact_repr.values, fact_repr.fact_id, fact_repr.row)
+
+	def del_many_from_store(self, fact_reprs):
+		if self.has_filters or self.copies != None:
+			for fact_repr in fact_reprs:
+				self.del_from_store(fact_repr)
+			return
+		for hash_table in self.hash_tables:
+			hash_key = hash_table['hash_key']
+			buckets  = hash_table['hash_table']
+			for fact_repr in fact_reprs:
+				hash_val = hash_key(fact_repr.values)
+				bucket = buckets[hash_val]
+				bucket.discard(fact_repr.row)
+				if len(bucket) == 0:
+					del buckets[hash_val]
+		history_entries = self.history_entries
+		for fact_repr in fact_reprs:
+			if len(self.range_tables) > 0:
+				self.del_from_ranges(fact_repr.values, fact_repr.fact_id)
+			if fact_repr.fact_id in history_entries:
+				self.del_history_entries(fact_repr.fact_id)
+		for column in self.columns:
+			clear = column.clear
+			for fact_repr in fact_reprs:
+				clear(fact_repr.row)
+		row_ids   = self.row_ids
+		free_rows = self.free_rows
+		for fact_repr in fact_reprs:
+			row_ids[fact_repr.row] = 0
+			free_rows.append(fact_repr.row)
+		self.size -= len(fact_reprs)
+
+	def is_stored(self, fact_repr):
+		return fact_repr.row != None and self.row_ids[fact_repr.row] == fact_repr.fact_id
+
+	# Returns a FactRepr view of the fact in the given row.
+	def row_view(self, row):
+		fact_repr = FactRepr(None, self.sym_id, tuple([ column.get(row) for column in self.columns ]))
+		fact_repr.fact_id = self.row_ids[row]
+		fact_repr.row     = row
+		return fact_repr
+
+	def live_rows(self):
+		row_ids = self.row_ids
+		return [ row for row in xrange(0,len(row_ids)) if row_ids[row] != 0 ]
+
+	def get_candidates(self, lookup_index, term_values):
+		if lookup_index >= 0:
+			hash_table_data = self.hash_tables[lookup_index]
+			hash_table = hash_table_data['hash_table']
+			hash_value = hash_table_data['hash_key'](term_values)
+			if hash_value in hash_table:
+				return (self.row_view(row) for row in hash_table[hash_value])
+			else:
+				return iter([])
+		else:
+			return (self.row_view(row) for row in self.live_rows())
+
+	def get_candidate_lookup_func_from_store(self, lookup_index, key_slots):
+		row_view = self.row_view
+		if lookup_index >= 0:
+			hash_table = self.hash_tables[lookup_index]['hash_table']
+			env_key    = make_key_encoder(key_slots)
+			def lookup_func(env):
+				hash_value = env_key(env)
+				if hash_value in hash_table:
+					return (row_view(row) for row in hash_table[hash_value])
+				else:
+					return iter([])
+			return lookup_func
+		else:
+			live_rows = self.live_rows
+			def lookup_func(env):
+				return (row_view(row) for row in live_rows())
+			return lookup_func
+
+	def get_bucket_lookup_func_from_store(self, lookup_index):
+		row_view = self.row_view
+		if lookup_index >= 0:
+			hash_table = self.hash_tables[lookup_index]['hash_table']
+			def lookup_func(hash_value):
+				if hash_value in hash_table:
+					return (row_view(row) for row in hash_table[hash_value])
+				else:
+					return iter([])
+		else:
+			live_rows = self.live_rows
+			def lookup_func(_):
+				return (row_view(row) for row in live_rows())
+		return lookup_func
+
+	def get_range_bucket_lookup_func_from_store(self, range_index, lower_inclusive, upper_inclusive):
+		row_view   = self.row_view
+		range_func = FactStore.get_range_bucket_lookup_func_from_store(self, range_index, lower_inclusive, upper_inclusive)
+		def lookup_func(hash_value, lower, upper):
+			return (row_view(row) for row in range_func(hash_value, lower, upper))
+		return lookup_func
+
+	def __str__(self):
+		store_header  = "%s Store (Columnar):" % get_fact_name(self.sym_id)
+		main_header   = "--- Main ---"
+		main_contents = "{ %s }" % ', '.join([ pretty_fact_repr(self.row_view(row)) for row in self.live_rows() ])
+		hash_tables   = self.hash_tables
+		hash_contents = ""
+		for i in xrange(0,len(hash_tables)):
+			hash_contents += "--- Hash Lookup %s: %s ---\n" % (i,hash_tables[i]['hash_str'])
+			for key,rows in hash_tables[i]['hash_table'].iteritems():
+				hash_contents += "%s -> { %s }\n" % (key,', '.join([ pretty_fact_repr(self.row_view(row)) for row in rows ]))
+		return '%s' % '\n'.join([store_header,main_header,main_contents,self.pretty_copies() + hash_contents])
+
+	def str_brief(self):
+		fact_name  = get_fact_name(self.sym_id)
+		fact_strs = []
+		for row in self.live_rows():
+			values = self.row_view(row).values
+			fact_strs += [ "%s(%s)" % (fact_name, ','.join( map(str,values) )) ] * self.num_copies(values)
+		if len(fact_strs) > 0:
+			return ','.join(fact_strs)
+		else:
+			return None
+
+# Sink fact store: Facts of predicates that no rule head matches are only collected, as results of the
+# ensemble. They are not given fact ids, nor indexed, and are kept in insertion order. Facts of min (max)
+# predicates are only kept in the aggregate index, by group, so that replacing the fact of a group is O(1).
+class SinkFactStore(FactStore):
+
+	def __init__(self, sym_id):
+		FactStore.__init__(self, sym_id)
+		self.facts = []
+
+	def add_to_store(self, fact_repr):
+		if self.copies != None and self.add_copy(fact_repr):
+			return
+		if self.agg_index == None:
+			self.facts.append(fact_repr)
+		if self.has_filters:
+			self.add_to_filters(fact_repr)
+		if self.copies != None:
+			self.add_record(fact_repr)
+		self.size += 1
+
+	def add_many_to_store(self, fact_reprs):
+		if self.has_filters or self.copies != None:
+			for fact_repr in fact_reprs:
+				self.add_to_store(fact_repr)
+			return
+		self.facts.extend(fact_reprs)
+		self.size += len(fact_reprs)
+
+	def del_many_from_store(self, fact_reprs):
+		for fact_repr in fact_reprs:
+			self.del_from_store(fact_repr)
+
+	def is_stored(self, fact_repr):
+		return True
+
+	# Only facts replaced by a better fact of a min (max) predicate are deleted from a sink store
+	def del_from_store(self, fact_repr):
+		if self.agg_index != None:
+			if self.agg_index.get( encode_key_value(fact_repr.values[:-1]) ) is not fact_repr:
+				return
+		else:
+			for i in xrange(0,len(self.facts)):
+				if self.facts[i] is fact_repr:
+					del self.facts[i]
+					break
+			else:
+				return
+		if self.has_filters:
+			self.del_from_filters(fact_repr)
+		self.size -= 1
+
+	def get_facts(self):
+		if self.agg_index != None:
+			return self.agg_index.values()
+		return self.facts
+
+	def __str__(self):
+		store_header  = "%s Store (Sink):" % get_fact_name(self.sym_id)
+		main_header   = "--- Main ---"
+		main_contents = "{ %s }" % ', '.join(map(pretty_fact_repr, self.get_facts()))
+		return '%s\n%s' % ('\n'.join([store_header,main_header,main_contents]),self.pretty_copies())
+
+	def str_brief(self):
+		fact_name  = get_fact_name(self.sym_id)
+		fact_strs = []
+		for fact_repr in self.get_facts():
+			fact_strs += [ "%s(%s)" % (fact_name, ','.join( map(str,fact_repr.values) )) ] * self.num_copies(fact_repr.values)
+		if len(fact_strs) > 0:
+			return ','.join(fact_strs)
+		else:
+			return None
+
+# Columns of the columnar fact store. Integer and floating point arguments are kept in typed arrays,
+# locations and strings are dictionary encoded into an array of codes, and all other arguments in a list.
+# A typed column falls back to a list once it is given a value of another type (e.g., a long int).
+
+ARRAY_COLUMN_TYPES = { 'int':('l',int), 'float':('d',float) }
+DICT_COLUMN_TYPES  = frozenset(['loc','dest','string'])
+
+def is_columnar_type(arg_type):
+	return arg_type in ARRAY_COLUMN_TYPES or arg_type in DICT_COLUMN_TYPES
+
+# Predicates kept in columnar fact stores in STORE_COLUMNAR mode: Those whose declared arguments are all of 
+# columnar types, at least one of which is numeric (i.e., kept in a typed array).
+def is_columnar_pred(arg_types):
+	return arg_types != None and all(map(is_columnar_type, arg_types)) and any(map(lambda t: t in ARRAY_COLUMN_TYPES, arg_types))
+
+def new_column(arg_type):
+	if arg_type in ARRAY_COLUMN_TYPES:
+		(typecode,value_type) = ARRAY_COLUMN_TYPES[arg_type]
+		return ArrayColumn(typecode, value_type)
+	elif arg_type in DICT_COLUMN_TYPES:
+		return DictColumn()
+	else:
+		return ListColumn()
+
+class ListColumn:
+
+	def __init__(self, data=None):
+		self.data = data if data != None else []
+
+	def set(self, row, value):
+		data = self.data
+		if row == len(data):
+			data.append(value)
+		else:
+			data[row] = value
+
+	def get(self, row):
+		return self.data[row]
+
+	def clear(self, row):
+		self.data[row] = None
+
+class ArrayColumn(ListColumn):
+
+	def __init__(self, typecode, value_type):
+		self.data = array(typecode)
+		self.value_type = value_type
+
+	def set(self, row, value):
+		if type(value) != self.value_type and self.value_type != None:
+			self.data = list(self.data)
+			self.value_type = None
+		ListColumn.set(self, row, value)
+
+	def clear(self, row):
+		if self.value_type == None:
+			self.data[row] = None
+
+# Codes are reference counted by the rows that hold them. A code is freed, and its value dropped from
+# the dictionary, once the last row holding it is cleared, and freed codes are handed out again.
+class DictColumn(ListColumn):
+
+	def __init__(self):
+		self.data   = array('l')
+		self.codes  = {}
+		self.decode = []
+		self.counts = array('l')
+		self.free_codes = array('l')
+
+	def set(self, row, value):
+		codes = self.codes
+		if value in codes:
+			code = codes[value]
+			self.counts[code] += 1
+		elif len(self.free_codes) > 0:
+			code = self.free_codes.pop()
+			codes[value] = code
+			self.decode[code] = value
+			self.counts[code] = 1
+		else:
+			code = len(self.decode)
+			codes[value] = code
+			self.decode.append(value)
+			self.counts.append(1)
+		ListColumn.set(self, row, code)
+
+	def get(self, row):
+		return self.decode[self.data[row]]
+
+	def clear(self, row):
+		code = self.data[row]
+		counts = self.counts
+		counts[code] -= 1
+		if counts[code] == 0:
+			del self.codes[self.decode[code]]
+			self.decode[code] = None
+			self.free_codes.append(code)
+
+	def __len__(self):
+		return len(self.codes)
+
+# Store modes: With STORE_COLUMNAR, columnar predicates (see is_columnar_pred) are kept in columnar fact
+# stores, and all other predicates in (default) fact stores.
+STORE_DICT     = 'dict'
+STORE_COLUMNAR = 'columnar'
+
+# Predicate classes (see front_end/compile/pred_analysis.py): Facts of PRED_OUTPUT_ONLY predicates 
+# are collected in sink stores, and facts of PRED_NEVER_STORED predicates are never added to their store.
+PRED_CONSUMABLE   = 'consumable'
+PRED_OUTPUT_ONLY  = 'output_only'
+PRED_NEVER_STORED = 'never_stored'
+
+# sink_sym_ids: Predicates whose facts are kept in sink stores. Stores of predicates declared with the
+# 'set', 'min' or 'max' modifiers are given the corresponding insertion filters.
+# counted_sym_ids: Predicates whose identical facts are stored as one record (see counted_sym_ids in
+# interpret/interpreter.py)
+def new_stores(store_mode=STORE_DICT, sink_sym_ids=(), counted_sym_ids=()):
 	fact_stores = {}
-	for sym_id in get_all_fact_classes():
-		fact_stores[sym_id] = FactStore(sym_id)
+	for sym_id,fact_class in get_all_fact_classes().items():
+		arg_types = fact_class.arg_types
+		if sym_id in sink_sym_ids:
+			fact_stores[sym_id] = SinkFactStore(sym_id)
+		elif store_mode == STORE_COLUMNAR and is_columnar_pred(arg_types):
+			fact_stores[sym_id] = ColumnarFactStore(sym_id, arg_types)
+		else:
+			fact_stores[sym_id] = FactStore(sym_id)
+		modifiers = fact_class.modifiers
+		if SET_MODIFIER in modifiers:
+			fact_stores[sym_id].enable_set_semantics()
+		if MIN_MODIFIER in modifiers:
+			fact_stores[sym_id].enable_aggregate(operator.lt)
+		elif MAX_MODIFIER in modifiers:
+			fact_stores[sym_id].enable_aggregate(operator.gt)
+		if sym_id in counted_sym_ids:
+			fact_stores[sym_id].enable_counting()
 	return fact_stores
 
 def pretty_stores(fact_stores, brief=False):
@@ -168,16 +1010,34 @@ def pretty_stores(fact_stores, brief=False):
 	return '\n'.join(strs) + '\n'
 
 def add_to_stores(fact_stores, fact_repr):
-	fact_stores[fact_repr['sym_id']].add_to_store(fact_repr)
+	fact_stores[fact_repr.sym_id].add_to_store(fact_repr)
 	
 def del_from_stores(fact_stores, fact_repr):
-	fact_stores[fact_repr['sym_id']].del_from_store(fact_repr['fact_id'])
+	fact_stores[fact_repr.sym_id].del_from_store(fact_repr)
+
+# Bulk insertion and deletion of facts of any predicates, in one batch per predicate
+def add_many_to_stores(fact_stores, fact_reprs):
+	for sym_id,batch in group_by_sym_id(fact_reprs).iteritems():
+		fact_stores[sym_id].add_many_to_store(batch)
+
+def del_many_from_stores(fact_stores, fact_reprs):
+	for sym_id,batch in group_by_sym_id(fact_reprs).iteritems():
+		fact_stores[sym_id].del_many_from_store(batch)
+
+def group_by_sym_id(fact_reprs):
+	batches = defaultdict(list)
+	for fact_repr in fact_reprs:
+		batches[fact_repr.sym_id].append(fact_repr)
+	return batches
 
 def get_candidates_from_stores(fact_stores, lookup_index, sym_id, term_pats):
 	return fact_stores[sym_id].get_candidates(lookup_index, map(lambda t: t.value,term_pats))
 
-def get_candidate_lookup_func_from_stores(fact_stores, lookup_index, sym_id, term_pats):
-	return fact_stores[sym_id].get_candidate_lookup_func_from_store(lookup_index, term_pats)
+def get_range_lookup_func_from_stores(fact_stores, range_index, sym_id, key_slots, lower, upper):
+	return fact_stores[sym_id].get_range_lookup_func_from_store(range_index, key_slots, lower, upper)
+
+def get_candidate_lookup_func_from_stores(fact_stores, lookup_index, sym_id, key_slots):
+	return fact_stores[sym_id].get_candidate_lookup_func_from_store(lookup_index, key_slots)
 
 def build_lookup_pat(fact):
 	terms = fact.terms
@@ -215,31 +1075,102 @@ def build_lookup_pat(fact):
 
 	return res
 
-def build_lookup_and_filter(fact, lookup_pat):
-	terms = fact.terms
+def build_lookup_keys(fact, lookup_pat):
 	binded_key_indices  = lookup_pat['binded_keys']	
 	binded_hash_indices = lookup_pat['binded_hashs']
 	const_indices  = lookup_pat['const']
 
 	lookup_info = {}
 
-	# Lookup key function
-	if len(binded_key_indices) + len(binded_hash_indices) > 0:
-		def lookup_key(vs):
-			ks = [vs[index] for index in binded_key_indices] + [ str(vs[index]) for index in binded_hash_indices]		
-			return tuple(ks) if len(ks) > 1 else ks[0]
-		lookup_info['lookup_key'] = lookup_key
-
-	# Post lookup filter function
-	if len(const_indices) > 0:
-		const_values = [terms[index].value for index in const_indices]
-		filter_func = lambda vs: [vs[index] for index in const_indices] == const_values 
-		lookup_info['filter'] = filter_func
-	else:
-		lookup_info['filter'] = lambda _: True
+	# Lookup key function: 'lookup_key' encodes stored values at insertion time (lookups
+	# encode the same key from the matching environment, see get_candidate_lookup_func_from_store).
+	key_indices = sorted(binded_key_indices + binded_hash_indices + const_indices)
+	if len(key_indices) > 0:
+		lookup_info['key_indices'] = tuple(key_indices)
+		lookup_info['lookup_key']  = make_key_encoder(key_indices)
 
 	return lookup_info
 
+# Assumed fraction of facts selected by each key argument of a lookup without index statistics
+DEFAULT_KEY_SELECTIVITY = 0.1
+
+# Range index bucket entries are (value,fact id,fact) tuples: Searching for (value,) finds the first
+# entry of a value, and (value,MAX_RANGE_ID) the first entry past it.
+MAX_RANGE_ID = float('inf')
+
+def no_key(_):
+	return None
+
+# Hash key encoders
+#
+# Lookup keys are built directly from the native argument values of facts: Single
+# keys are the encoded value itself, compound keys are tuples of encoded values.
+# Values of the common scalar types (ints, strings, locations, etc.) are hashable
+# and are used as they are. Only values that are not hashable (e.g. lists, which is
+# also what JSON decoding turns tuples into) are translated into a canonical tuple
+# encoding, marked with a key tag, so that it cannot collide with any native tuple.
+
+NATIVE_KEY_TYPES = frozenset([int, long, float, bool, str, unicode])
+
+class KeyTag(object):
+
+	__slots__ = ['name']
+
+	def __init__(self, name):
+		self.name = name
+
+	def __repr__(self):
+		return "#%s" % self.name
+
+LIST_KEY_TAG  = KeyTag('list')
+TUPLE_KEY_TAG = KeyTag('tuple')
+DICT_KEY_TAG  = KeyTag('dict')
+REPR_KEY_TAG  = KeyTag('repr')
+
+def encode_key_value(v):
+	v_type = type(v)
+	if v_type in NATIVE_KEY_TYPES:
+		return v
+	elif v_type is list:
+		return (LIST_KEY_TAG,) + tuple([encode_key_value(e) for e in v])
+	elif v_type is dict:
+		return (DICT_KEY_TAG,) + tuple(sorted([(encode_key_value(k),encode_key_value(e)) for k,e in v.iteritems()]))
+	try:
+		hash(v)
+		return v
+	except TypeError:
+		if v_type is tuple:
+			return (TUPLE_KEY_TAG,) + tuple([encode_key_value(e) for e in v])
+		else:
+			return (REPR_KEY_TAG, repr(v))
+
+# Returns a function that encodes the lookup key of the given argument indices,
+# from a sequence of values. Keys of one or two indices are encoded without 
+# intermediate allocations.
+def make_key_encoder(indices):
+	native_types = NATIVE_KEY_TYPES
+	if len(indices) == 1:
+		i, = indices
+		def key_encoder(vs):
+			v = vs[i]
+			if type(v) in native_types:
+				return v
+			return encode_key_value(v)
+	elif len(indices) == 2:
+		i,j = indices
+		def key_encoder(vs):
+			v1 = vs[i]
+			v2 = vs[j]
+			if type(v1) not in native_types:
+				v1 = encode_key_value(v1)
+			if type(v2) not in native_types:
+				v2 = encode_key_value(v2)
+			return (v1,v2)
+	else:
+		def key_encoder(vs):
+			return tuple([encode_key_value(vs[i]) for i in indices])
+	return key_encoder
+
 def pretty_hash_table(hash_table):
 	iterate = hash_table['hash_table'].iteritems()
 	strs = []
@@ -266,7 +1197,7 @@ def candidate_args(candidate_dict):
 	while True:
 		can = next(iterate,None)
 		if can != None:
-			can_args.append(can['values'])
+			can_args.append(can.values)
 		else:
 			return can_args
 	
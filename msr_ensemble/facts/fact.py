@@ -33,6 +33,15 @@ FACT_CLASSES = {}
 
 DUMMY_VALUE = 'X'
 
+# Predicate modifiers accepted in fact declarations (e.g., 'predicate set path :: ...'). The 'min' and 'max'
+# modifiers aggregate on the last argument of the predicate, grouped by all other arguments. The 'counted'
+# modifier stores identical facts as one record with a count.
+SET_MODIFIER = 'set'
+MIN_MODIFIER = 'min'
+MAX_MODIFIER = 'max'
+COUNTED_MODIFIER = 'counted'
+FACT_MODIFIERS = [SET_MODIFIER, MIN_MODIFIER, MAX_MODIFIER, COUNTED_MODIFIER]
+
 def register_fact(fact_class):
 	global FACT_SYMBOL_ID
 	FACT_SYMBOL_ID += 1
@@ -79,6 +88,10 @@ def pretty_id(fact_id):
 
 class Fact:
 	terms = None
+	# Declared types of the arguments (e.g., 'int', 'loc'), with None for compound types
+	arg_types = None
+	# Modifiers of the predicate declaration (e.g., 'set')
+	modifiers = []
 
 	def __init__(self, sym_id, *terms):
 		self.sym_id = sym_id
@@ -29,6 +29,10 @@ from msr_ensemble.facts.term import Term
 
 class Guard:
 
+	# Comparison operator of guards of the form 'x <op> y', for which fact stores can serve
+	# ordered (range) lookups. See interpret/interpreter.py.
+	range_op = None
+
 	def initialize(self, sym_str, *terms, **kwargs):
 		self.sym_str = sym_str
 		self.terms   = terms
@@ -53,8 +57,26 @@ class Guard:
 		return True
 
 	def evaluate(self):
+		return self.evaluate_values(*self.get_values())
+
+	# Evaluates the guard on the given values of its terms (in order), without reading the terms.
+	def evaluate_values(self, *values):
 		return False
 
+	# Returns a function that evaluates the guard on the values of its terms. Guard classes that only
+	# define evaluate (i.e., over the values binded to their terms) are evaluated by assigning the
+	# values to their terms.
+	def get_values_evaluator(self):
+		if self.__class__.evaluate_values.im_func is not Guard.evaluate_values.im_func:
+			return self.evaluate_values
+		terms    = self.terms
+		evaluate = self.evaluate
+		def evaluate_values(*values):
+			for i in xrange(0,len(values)):
+				terms[i].value = values[i]
+			return evaluate()
+		return evaluate_values
+
 	def __str__(self):
 		terms = self.terms
 		if self.infix:
@@ -76,38 +98,43 @@ class Guard:
 			return out
 
 class Leq(Guard):
+	range_op = '<='
 	def __init__(self, x, y):
 		self.initialize('<=', x, y, infix=True)
-	def evaluate(self):
-		x,y = self.get_values()
+	def evaluate_values(self, x, y):
 		return x <= y
 
 class Eq(Guard):
 	def __init__(self, x, y):
 		self.initialize('==', x, y, infix=True)
-	def evaluate(self):
-		x,y = self.get_values()
+	def evaluate_values(self, x, y):
 		return x == y
 
 class Geq(Guard):
+	range_op = '>='
 	def __init__(self, x, y):
 		self.initialize('>=', x, y, infix=True)
-	def evaluate(self):
-		x,y = self.get_values()
+	def evaluate_values(self, x, y):
 		return x >= y
 
 class Less(Guard):
+	range_op = '<'
 	def __init__(self, x, y):
 		self.initialize('<', x, y, infix=True)
-	def evaluate(self):
-		x,y = self.get_values()
+	def evaluate_values(self, x, y):
 		return x < y
 
 class Greater(Guard):
+	range_op = '>'
 	def __init__(self, x, y):
 		self.initialize('>', x, y, infix=True)
-	def evaluate(self):
-		x,y = self.get_values()
+	def evaluate_values(self, x, y):
 		return x > y
 
+class Neq(Guard):
+	def __init__(self, x, y):
+		self.initialize('!=', x, y, infix=True)
+	def evaluate_values(self, x, y):
+		return x != y
+
 
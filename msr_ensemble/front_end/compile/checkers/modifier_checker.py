@@ -0,0 +1,84 @@
+'''
+This file is part of MSR Ensemble for Python (MSRE-Py).
+
+MSRE-Py is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+MSRE-Py is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with MSRE-Py. If not, see <http://www.gnu.org/licenses/>.
+
+MSR Ensemble for Python (MSRE-Py) Version 0.9, Prototype Alpha
+
+Authors:
+Edmund S. L. Lam      sllam@qatar.cmu.edu
+Iliano Cervesato      iliano@cmu.edu
+
+* Development of MSRE-Py is funded by the Qatar National Research Fund as project NPRP 09-667-1-100 (Effective Programming for Large Distributed Ensembles)
+'''
+
+
+import msr_ensemble.front_end.parser.msr_ast as ast
+import msr_ensemble.misc.visit as visit
+import msr_ensemble.misc.terminal_color as terminal
+
+from msr_ensemble.facts.fact import FACT_MODIFIERS, SET_MODIFIER, MIN_MODIFIER, MAX_MODIFIER, COUNTED_MODIFIER
+
+from msr_ensemble.front_end.compile.checkers.base_checker import Checker
+
+class PredModifierChecker(Checker):
+
+	def __init__(self, decs, source_text):
+		self.initialize(decs, source_text)
+
+	# Main checking operation
+
+	def check(self):
+		for dec in self.decs:
+			self.int_check(dec)
+
+	@visit.on('ast_node')
+	def int_check(self, ast_node):
+		pass
+
+	@visit.when(ast.EnsemDec)
+	def int_check(self, ast_node):
+		for dec in ast_node.decs:
+			self.int_check(dec)
+
+	@visit.when(ast.FactDec)
+	def int_check(self, ast_node):
+		unknown = filter(lambda m: m not in FACT_MODIFIERS, ast_node.modifiers)
+		if len(unknown) > 0:
+			legend = "Supported modifiers: %s\n" % ','.join(FACT_MODIFIERS)
+			error_report = "Predicate %s has unknown modifier(s) %s." % (ast_node.name,','.join(unknown))
+			error_idx = self.declare_error(error_report, legend)
+			self.extend_error(error_idx, ast_node)
+		aggregates = filter(lambda m: m in [MIN_MODIFIER,MAX_MODIFIER], ast_node.modifiers)
+		if len(set(aggregates)) > 1:
+			error_report = "Predicate %s cannot be both %s and %s." % (ast_node.name,MIN_MODIFIER,MAX_MODIFIER)
+			error_idx = self.declare_error(error_report)
+			self.extend_error(error_idx, ast_node)
+		elif len(aggregates) > 0 and ast_node.type == None:
+			error_report = "Predicate %s has no argument to aggregate on with modifier %s." % (ast_node.name,aggregates[0])
+			legend = "Modifiers %s and %s aggregate on the last argument of the predicate.\n" % (MIN_MODIFIER,MAX_MODIFIER)
+			error_idx = self.declare_error(error_report, legend)
+			self.extend_error(error_idx, ast_node)
+		if COUNTED_MODIFIER in ast_node.modifiers:
+			others = filter(lambda m: m in [SET_MODIFIER,MIN_MODIFIER,MAX_MODIFIER], ast_node.modifiers)
+			if len(others) > 0:
+				error_report = "Predicate %s cannot be both %s and %s." % (ast_node.name,COUNTED_MODIFIER,others[0])
+				legend = "Predicates with modifier %s never hold identical facts, nothing to count.\n" % others[0]
+				error_idx = self.declare_error(error_report, legend)
+				self.extend_error(error_idx, ast_node)
+
+	@visit.when(ast.ASTNode)
+	def int_check(self, ast_node):
+		pass
+
@@ -24,15 +24,21 @@ Iliano Cervesato      iliano@cmu.edu
 * Development of MSRE-Py is funded by the Qatar National Research Fund as project NPRP 09-667-1-100 (Effective Programming for Large Distributed Ensembles)
 '''
 
+import re
+
 import msr_ensemble.front_end.parser.msr_ast as ast
 import msr_ensemble.front_end.parser.msr_parser as p
 import msr_ensemble.misc.visit as visit
 
 from msr_ensemble.front_end.compile.checkers.var_scope_checker import VarScopeChecker
 from msr_ensemble.front_end.compile.checkers.neighbor_restrict_checker import NeighborRestrictChecker
+from msr_ensemble.front_end.compile.checkers.modifier_checker import PredModifierChecker
 from msr_ensemble.front_end.compile.checkers.base_checker import Checker, get_source_header_footer_regions
 
 from msr_ensemble.front_end.compile.inspectors import Inspector
+from msr_ensemble.front_end.compile.pred_analysis import PredClassifier
+
+from msr_ensemble.context.store import STORE_DICT, STORE_COLUMNAR, is_columnar_pred
 
 # from msr_ensemble.front_end.compile.transformers.neighbor_restrict_trans import NeighborRestrictTrans
 
@@ -83,7 +89,7 @@ class MSRCodeGen(CodeGen):
 				self.error_reports = []
 
 	def check_validity(self, decs, source_text):
-		checkers = [VarScopeChecker,NeighborRestrictChecker]
+		checkers = [VarScopeChecker,NeighborRestrictChecker,PredModifierChecker]
 		reports = []
 		for checker in checkers:
 			c = checker(decs,source_text)
@@ -129,7 +135,8 @@ class MSRCodeGen(CodeGen):
 		znr_decs = NeighborRestrictTrans(self.decs, self.source_text).trans()
 	'''
 
-	def gen_code(self):
+	# exec_options: Runtime options passed to execute_msr by the generated executable (see runtime_options in interpret/mpi_runtime.py)
+	def gen_code(self, exec_options=None):
 
 		decs = self.get_decs()
 
@@ -138,7 +145,7 @@ class MSRCodeGen(CodeGen):
 			print "Output written to %s.py" % ensem.name
 
 		for exe in decs['execs']:
-			ExecDecCodeGen(exe).gen_code( mk_py_file_name(self.file_name) )
+			ExecDecCodeGen(exe).gen_code( mk_py_file_name(self.file_name), exec_options=exec_options )
 			print "Output written to %s" % mk_py_file_name(self.file_name)
 
 
@@ -237,6 +244,37 @@ class EnsemDecCodeGen(CodeGen):
 				fs.append(f)	
 		return fs
 
+	# Retrieve Goal Priorities
+	# Sorted distinct priorities of facts that rules of the ensemble assert. Priorities are integer
+	# literals, and facts without one (including initial goals and set comprehensions) have priority 0.
+
+	def get_goal_priorities(self):
+		priorities = set([0])
+		for r in self.get_rule_decs():
+			for rhs in r.rhs:
+				if rhs.type == ast.FACT:
+					priorities.add( rhs.elem.priority )
+		return sorted(priorities)
+
+	# Retrieve Predicate Classes
+	# Class of each predicate of the ensemble (see front_end/compile/pred_analysis.py), as the 
+	# entries of a dict from generated fact classes to predicate classes.
+
+	def get_pred_classes(self):
+		pred_classes = PredClassifier(self.ensem_dec).classify()
+		return map(lambda name: "%s:%s" % (pred_name(name),repr(pred_classes[name])), sorted(pred_classes.keys()))
+
+	# Retrieve Store Mode
+	# STORE_COLUMNAR if some predicate of the ensemble is a columnar predicate, i.e., has numeric arguments
+	# that would be kept in typed arrays (see is_columnar_pred in context/store.py), otherwise STORE_DICT.
+	# The store of each predicate is still chosen on its own arguments.
+
+	def get_store_mode(self):
+		for f in self.get_fact_decs():
+			if is_columnar_pred( FactDecCodeGen(f, self.source_text).arg_types(f) ):
+				return STORE_COLUMNAR
+		return STORE_DICT
+
 	# Generating Code
 
 	def gen_code(self):
@@ -265,9 +303,9 @@ class EnsemDecCodeGen(CodeGen):
 		import_list = template('''
 			from msr_ensemble.facts.fact import Fact, get_all_fact_classes
 
-			from msr_ensemble.facts.term import Term, new_vars, lift, val, inst, _
+			from msr_ensemble.facts.term import Term, new_vars, lift, lift_many, val, inst, _
 			from msr_ensemble.facts.fact import Fact, register_fact, at, priority
-			from msr_ensemble.facts.guard import Guard
+			from msr_ensemble.facts.guard import Guard, Less, Leq, Greater, Geq, Eq, Neq
 			
 			from msr_ensemble.rules.rule import Rule, register_rule
 
@@ -286,12 +324,19 @@ class EnsemDecCodeGen(CodeGen):
 			{| '\\n\\n'.join(rule_dec_codes) |}
 
 			{| ensem_name |}_rule_classes = [{| ', '.join(rule_names) |}]
+
+			{| ensem_name |}_priorities = {| repr(priorities) |}
+
+			{| ensem_name |}_pred_classes = { {| ', '.join(pred_classes) |} }
+
+			{| ensem_name |}_store_mode = {| repr(store_mode) |}
 		''') 
 
 		output = open(self.ensem_dec.name + ".py", 'w')
 		output.write( compile_template(ensem_code, fact_dec_codes=fact_dec_codes, rule_dec_codes=rule_dec_codes, import_list=import_list
                                               ,ensem_name=self.ensem_dec.name, rule_names=rule_names, assign_dec_codes=assign_dec_codes
-                                              ,extern_codes=extern_codes ) )
+                                              ,extern_codes=extern_codes, priorities=self.get_goal_priorities()
+                                              ,pred_classes=self.get_pred_classes(), store_mode=self.get_store_mode() ) )
 
 # Generating Execution
 class ExecDecCodeGen(CodeGen):
@@ -366,8 +411,14 @@ class ExecDecCodeGen(CodeGen):
 				fs.append(f)	
 		return fs
 
-	def gen_code(self, file_name):
+	def gen_code(self, file_name, exec_options=None):
 		ensem_name = self.exec_dec.name
+		if exec_options == None:
+			exec_options = {}
+		exec_args = ''.join( map(lambda opt: ", %s=%s" % (opt,repr(exec_options[opt])), sorted(exec_options.keys())) )
+		# The store mode chosen for the ensemble applies, unless given as an exec option
+		if 'store_mode' not in exec_options:
+			exec_args = ", store_mode=%s_store_mode%s" % (ensem_name,exec_args)
 
 		extern_dec_codes = []
 		for e in self.get_extern_decs():
@@ -418,13 +469,14 @@ class ExecDecCodeGen(CodeGen):
 
 			init_goals = {| ' + '.join(loc_init_names) |}
 
-			execute_msr(init_goals, {| ensem_name |}_rule_classes)
+			execute_msr(init_goals, {| ensem_name |}_rule_classes, goal_priorities={| ensem_name |}_priorities, pred_classes={| ensem_name |}_pred_classes{| exec_args |})
 		''')
 
 		output = open(file_name, 'w')
 
 		output.write( compile_template(exec_dec_code, ensem_name=ensem_name, loc_assigns=loc_assigns, loc_inits=loc_inits
-                                              ,loc_init_names=loc_init_names, import_list=import_list, assign_dec_codes=assign_dec_codes) )
+                                              ,loc_init_names=loc_init_names, import_list=import_list, assign_dec_codes=assign_dec_codes
+                                              ,exec_args=exec_args) )
 
 # generating External Dec
 class ExternDecCodeGen(CodeGen):
@@ -514,6 +566,18 @@ class FactDecCodeGen(CodeGen):
 	def count_terms(self, ast_node):
 		return 1
 
+	# Declared argument types for given fact declaration: Type constructor names for
+	# arguments of simple types (e.g., 'int', 'loc'), None for compound types.
+
+	def arg_types(self, fact_dec):
+		if fact_dec.type == None:
+			types = []
+		elif isinstance(fact_dec.type, ast.TypeTuple):
+			types = fact_dec.type.types
+		else:
+			types = [fact_dec.type]
+		return map(lambda t: t.name if isinstance(t, ast.TypeCons) else None, types)
+
 	# Generating Fact Declarations
 
 	def gen_code(self):
@@ -524,15 +588,19 @@ class FactDecCodeGen(CodeGen):
 			{| source_snippet |}
 			\'\'\'
 			class {|fact_name|}(Fact):
+				arg_types = {| arg_types |}
+				modifiers = {| modifiers |}
 				def __init__(self, {| ', '.join(terms) |}):
 					self.initialize({| ', '.join(terms) |})
 			register_fact({|fact_name|})
 		''')
 	
 		source_snippet = self.fact_dec.gen_snippet(self.source_text)
+		arg_types = repr( self.arg_types(self.fact_dec) )
+		modifiers = repr( list(self.fact_dec.modifiers) )
 
 		return compile_template(fact_dec_code, fact_name=pred_name(self.fact_dec.name), terms=terms
-                                       ,source_snippet=source_snippet)
+                                       ,source_snippet=source_snippet, arg_types=arg_types, modifiers=modifiers)
 
 # Generating Terms:
 
@@ -540,11 +608,14 @@ IGNORE = -1
 TERM_LEVEL = 0
 META_LEVEL = 1
 
+# Variables are generated as Terms, unless raw_vars is set: They then stand for their values, as in the
+# generated evaluate_values of guards, which are given the values of the matching environment.
 class TermCodeGen(CodeGen):
 
-	def __init__(self, term):
+	def __init__(self, term, raw_vars=False):
 		self.initialize()
 		self.term = term
+		self.raw_vars = raw_vars
 
 
 	@visit.on('term')
@@ -565,7 +636,7 @@ class TermCodeGen(CodeGen):
 
 	@visit.when(ast.TermVar)
 	def gen_term_code(self, term, inner=META_LEVEL):
-		return (TERM_LEVEL, var_name(term.name))
+		return (META_LEVEL if self.raw_vars else TERM_LEVEL, var_name(term.name))
 
 	@visit.when(ast.TermApp)
 	def gen_term_code(self, term, inner=META_LEVEL):
@@ -811,6 +882,31 @@ class RuleDecCodeGen(CodeGen):
 		
 		return fstr
 
+	# Generating Guards: Each conjunct of the rule guard is a guard of its own, so that it can be
+	# scheduled as soon as its variables are matched. Comparisons of variables and literals are
+	# generated as instances of the guard classes in facts/guard.py (which also allows ordered
+	# lookups for inequalities), all other guards get a generated guard class over their variables.
+	# Its evaluate_values is generated over the values of the variables, so that evaluating the 
+	# guard on a candidate match allocates no Terms.
+
+	def gen_guard(self, grd, grd_class_name, vars):
+		if isinstance(grd, ast.TermBinOp) and grd.op in SIMPLE_GUARD_CLASSES and is_simple_guard_term(grd.term1) and is_simple_guard_term(grd.term2):
+			term_str1 = TermCodeGen(grd.term1).gen_code(TERM_LEVEL)
+			term_str2 = TermCodeGen(grd.term2).gen_code(TERM_LEVEL)
+			return ("%s(%s,%s)" % (SIMPLE_GUARD_CLASSES[grd.op],term_str1,term_str2), "")
+		grd_var_names = map(lambda t: var_name(t.name), Inspector().filter_atoms( Inspector().get_atoms(grd), var=True ))
+		grd_vars = filter(lambda v: v in grd_var_names, vars)
+		grd_class = compile_template(template(
+			'''
+			class {| grd_class_name |}(Guard):
+				def __init__(self{| ''.join(map(lambda v: ', ' + v, grd_vars)) |}):
+					self.initialize("{| grd_class_name |}"{| ''.join(map(lambda v: ',' + v, grd_vars)) |})
+				def evaluate_values(self{| ''.join(map(lambda v: ', ' + v, grd_vars)) |}):
+					return {| grd_str |}
+			'''
+		), grd_class_name=grd_class_name, grd_vars=grd_vars, grd_str=TermCodeGen(grd, raw_vars=True).gen_code(IGNORE))
+		return ("%s(%s)" % (grd_class_name,','.join(grd_vars)), grd_class)
+
 	# Partitioning RHS
 
 	def partition_rhs(self, rhs):
@@ -830,7 +926,6 @@ class RuleDecCodeGen(CodeGen):
 		
 		props = self.gen_facts( map(lambda f: f.elem, self.rule_dec.plhs) )
 		simps = self.gen_facts( map(lambda f: f.elem, self.rule_dec.slhs) )
-		grds  = map(lambda g: TermCodeGen(g).gen_code(IGNORE), self.rule_dec.grd)
 
 		rhs_atoms,rhs_comps = self.partition_rhs(self.rule_dec.rhs)
 		consq = self.gen_facts( map(lambda f: f.elem, rhs_atoms) )
@@ -864,20 +959,15 @@ class RuleDecCodeGen(CodeGen):
 		for assign in self.rule_dec.where:
 			wheres.append( AssignDecCodeGen(assign).gen_code() )
 
-		grd_class = ""
-		grd_inst = ""
-		if len(grds) > 0:
-			grd_inst = mk_rule_name(self.rule_dec.name) + "Grd(%s)" % ','.join(vars)
-			grd_class = compile_template(template(
-				'''
-				class {| grd_class_name |}(Guard):
-					def __init__(self, {| ', '.join(vars) |}):
-						self.initialize(\"{| grd_class_name |}\",{| ','.join(vars) |})
-					def evaluate(self):
-						{| ','.join(vars) |} = self.get_vars()
-						return {| ' and '.join(grds) |}
-				'''
-			), grd_class_name=mk_rule_name(self.rule_dec.name) + "Grd", vars=vars, grds=grds)
+		grd_insts   = []
+		grd_classes = []
+		for i in xrange(0,len(self.rule_dec.grd)):
+			grd_class_name = mk_rule_name(self.rule_dec.name) + ("Grd%s" % i if len(self.rule_dec.grd) > 1 else "Grd")
+			(grd_inst,grd_class) = self.gen_guard(self.rule_dec.grd[i], grd_class_name, vars)
+			grd_insts.append( grd_inst )
+			grd_classes.append( grd_class )
+		grd_inst  = ', '.join(grd_insts)
+		grd_class = '\n'.join(grd_classes)
 
 	
 		# Generate code to handle existential variables
@@ -921,7 +1011,9 @@ class RuleDecCodeGen(CodeGen):
 					{| ','.join(vars) |} = self.get_vars()
 					return [{| grd_inst |}]
 				def consequents(self):
-					{| ','.join(vars) |} = self.get_vars()
+					return self.consequents_env( self.get_values() )
+				def consequents_env(self, env):
+					{| env_code |}
 					{| exists_code |}
 					{| loc_exist_code |}
 					{| '\\n'.join(wheres) |}
@@ -932,12 +1024,22 @@ class RuleDecCodeGen(CodeGen):
 			{| grd_class |}
 		''')
 
+		# The consequents only lift the values of the variables that they use into Terms
+		consq_code = '\n'.join(wheres + comp_codes + consq)
+		used_vars  = filter(lambda v: re.search(r'\b%s\b' % v, consq_code) != None, vars)
+		if len(used_vars) == len(vars):
+			env_code = "%s = lift_many(*env[:%s])" % (','.join(vars),len(vars))
+		elif len(used_vars) > 0:
+			env_code = "%s, = lift_many(%s)" % (','.join(used_vars),','.join(map(lambda v: "env[%s]" % vars.index(v), used_vars)))
+		else:
+			env_code = ""
+
 		source_snippet = self.rule_dec.gen_snippet(self.source_text)
 
 		output = compile_template(rule_dec_code, rule_name=mk_rule_name(self.rule_dec.name),source_snippet=source_snippet
                                          ,vars=vars, props=props, simps=simps, grd_class=grd_class, grd_inst=grd_inst, wheres=wheres
                                          ,consq=consq, exists_code=exists_code, loc_exist_code=loc_exist_code, num_of_loc_exists=num_of_loc_exists
-                                         ,comp_codes=comp_codes, comp_set_post_fix=comp_set_post_fix)
+                                         ,comp_codes=comp_codes, comp_set_post_fix=comp_set_post_fix, env_code=env_code)
 	
 		return compact(output)
 
@@ -961,6 +1063,11 @@ def mk_rule_name(name):
 def mk_py_file_name(file_name):
 	return file_name.replace(".msr",".py")
 
+SIMPLE_GUARD_CLASSES = { '<':'Less', '<=':'Leq', '>':'Greater', '>=':'Geq', '==':'Eq', '!=':'Neq' }
+
+def is_simple_guard_term(term):
+	return isinstance(term, ast.TermVar) or isinstance(term, ast.TermLit)
+
 def coerce_term(term_str, gen_level, req_level):
 	if req_level == IGNORE:
 		return term_str
@@ -0,0 +1,101 @@
+
+'''
+This file is part of MSR Ensemble for Python (MSRE-Py).
+
+MSRE-Py is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+MSRE-Py is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with MSRE-Py. If not, see <http://www.gnu.org/licenses/>.
+
+MSR Ensemble for Python (MSRE-Py) Version 0.9, Prototype Alpha
+
+Authors:
+Edmund S. L. Lam      sllam@qatar.cmu.edu
+Iliano Cervesato      iliano@cmu.edu
+
+* Development of MSRE-Py is funded by the Qatar National Research Fund as project NPRP 09-667-1-100 (Effective Programming for Large Distributed Ensembles)
+'''
+
+import msr_ensemble.front_end.parser.msr_ast as ast
+
+from msr_ensemble.front_end.compile.inspectors import Inspector
+
+from msr_ensemble.context.store import PRED_CONSUMABLE, PRED_OUTPUT_ONLY, PRED_NEVER_STORED
+
+# Predicate classification of an ensemble, by predicate name (see PRED_* in context/store.py):
+#   - PRED_OUTPUT_ONLY  : The predicate appears in no rule head. Its facts are never matched, only
+#                         collected as results of the ensemble.
+#   - PRED_NEVER_STORED : Some rule consumes every fact of the predicate on activation: The rule has 
+#                         a single, simplified head whose location and arguments are distinct variables
+#                         (or '_'), and no guards. No earlier rule propagates the predicate, so (with late
+#                         storage) no occurrence of it is ever tried with the fact stored.
+#   - PRED_CONSUMABLE   : All other predicates.
+# Rules are considered in declaration order, which is the order that their occurrences are tried in.
+
+class PredClassifier:
+
+	def __init__(self, ensem_dec):
+		self.ensem_dec = ensem_dec
+
+	def classify(self):
+		inspect = Inspector()
+		decs = self.ensem_dec.decs
+		pred_names = map(lambda dec: dec.name, inspect.filter_decs(decs, fact=True))
+		rule_decs  = inspect.filter_decs(decs, rule=True)
+
+		head_preds = set()
+		propagated = set()
+		consumed   = set()
+		for rule_dec in rule_decs:
+			simp_facts = self.head_facts(rule_dec.slhs)
+			prop_facts = self.head_facts(rule_dec.plhs)
+			if len(simp_facts) == 1 and len(prop_facts) == 0 and len(rule_dec.grd) == 0:
+				(loc,fact) = simp_facts[0]
+				if fact.name not in propagated and self.matches_any(loc, fact):
+					consumed.add( fact.name )
+			for (_,fact) in simp_facts + prop_facts:
+				head_preds.add( fact.name )
+			for (_,fact) in prop_facts:
+				propagated.add( fact.name )
+
+		pred_classes = {}
+		for name in pred_names:
+			if name not in head_preds:
+				pred_classes[name] = PRED_OUTPUT_ONLY
+			elif name in consumed:
+				pred_classes[name] = PRED_NEVER_STORED
+			else:
+				pred_classes[name] = PRED_CONSUMABLE
+		return pred_classes
+
+	# Facts of the given rule heads, with their locations
+	def head_facts(self, heads):
+		facts = []
+		for head in Inspector().get_facts(heads):
+			if isinstance(head, ast.FactLoc):
+				for fact in head.facts:
+					facts.append( (head.loc,fact) )
+			else:
+				facts.append( (None,head) )
+		return facts
+
+	# Whether the head pattern matches any fact of its predicate
+	def matches_any(self, loc, fact):
+		names = []
+		for term in ([loc] if loc != None else []) + fact.terms:
+			if isinstance(term, ast.TermVar):
+				if term.name in names:
+					return False
+				names.append( term.name )
+			elif not isinstance(term, ast.TermUnderscore):
+				return False
+		return True
+
@@ -26,73 +26,324 @@ Iliano Cervesato      iliano@cmu.edu
 
 
 from collections import defaultdict
+from itertools import permutations
 
 from msr_ensemble.facts.term import Term
-from msr_ensemble.facts.fact import Fact, get_all_fact_classes
+from msr_ensemble.facts.fact import Fact, get_all_fact_classes, DUMMY_VALUE, COUNTED_MODIFIER
 from msr_ensemble.rules.rule import Rule, get_all_rule_classes
-from msr_ensemble.context.store import FactStore, new_stores
+from msr_ensemble.context.store import FactStore, new_stores, build_lookup_pat
 from msr_ensemble.context.fact_repr import make_fact_pat
 
 # interp_rules :: { <sym_id> : [<interp_rule>] }
-# interp_rule  :: { 'rule_id':int, 'occ_id':int, 'propagated':bool, 'entry':<fact_pat>, 'match_steps':[<lookup_step>], 'has_no_simplify':bool, 'rhs': _ -> [<fact_pat>]  
-#                 , 'exist_locs': _ -> [String], 'has_exist_locs':bool }
-# match_step   :: { 'is_lookup':True, 'propagated':bool, 'lookup_index':int, 'fact_pat':<fact_pat>, 'filter':[Term] -> bool, 'free_terms':[Term] }
-#              or { 'is_lookup':False, 'guard':_ -> bool, 'guard_str':str }
+# interp_rule  :: { 'rule_id':int, 'occ_id':int, 'propagated':bool, 'entry':<fact_pat>, 'match_steps':[<lookup_step>], 'has_no_simplify':bool, 'rhs': <env> -> [<fact_pat>]  
+#                 , 'exist_locs': _ -> [String], 'has_exist_locs':bool, 'rule':Rule, 'plan_cost':float
+#                 , 'env':<env>, 'entry_slots':[<match_slot>], 'entry_loc_slot':(int,bool) or None
+#                 , 'history_order':[int], 'history_sym_ids':[int], 'entry_stored':bool }
+# match_step   :: { 'is_lookup':True, 'propagated':bool, 'lookup_index':int, 'exact':bool, 'fact_pat':<fact_pat>, 'free_terms':[Term]
+#                 , 'range':<range_lookup> or None, 'key_indices':[int], 'key_slots':[int], 'match_slots':[<match_slot>] }
+#              or { 'is_lookup':False, 'guard':<values> -> bool, 'guard_str':str, 'guard_obj':Guard, 'guard_slots':[int] }
+# range_lookup :: { 'range_index':int, 'position':int, 'lower':(Term,bool) or None, 'upper':(Term,bool) or None
+#                 , 'lower_slot':int or None, 'upper_slot':int or None }
 # fact_pat     :: { 'sym_id':int, 'terms':[Term] }
+# match_slot   :: (<argument position>:int, <slot>:int, <binds>:bool)
+# env          :: [<value>]
 
-def interpret_rules(rules, fact_stores):
+# never_stored: Predicates whose facts are never added to their store (see front_end/compile/pred_analysis.py).
+# Occurrences that have one of them as partner can never apply, and are left out.
+
+def interpret_rules(rules, fact_stores, never_stored=()):
 	interp_rules = defaultdict(list)
 
 	for rule in rules:
 		interp_rule = interpret_rule(rule, fact_stores)
 		for rule_occ in interp_rule:
-			interp_rules[rule_occ['entry']['sym_id']].append(rule_occ)
+			if not has_partner_in(rule_occ, never_stored):
+				interp_rules[rule_occ['entry']['sym_id']].append(rule_occ)
 
 	for fact_sym_id in get_all_fact_classes():
 		if fact_sym_id not in interp_rules:
 			interp_rules[fact_sym_id] = []
 
+	assign_late_storage(interp_rules, never_stored=never_stored)
+
 	return interp_rules
 
+# Late storage: An active fact is only inserted into its store when it reaches the first occurrence of 
+# its predicate with a propagated entry (whose propagation history is keyed on the fact id, and after
+# which the fact remains), or after its last occurrence if it survives them all. Until then, no matching 
+# observes the fact in the store: Partner lookups of its own occurrences exclude it by id anyway, and 
+# rule consequents are only activated after it. So a fact consumed by an earlier occurrence is never 
+# indexed. 'entry_stored' marks the occurrences tried after the active fact is stored, the others must 
+# not delete it from the store when they simplify it.
+
+def has_partner_in(interp_rule, sym_ids):
+	for match_step in interp_rule['match_steps']:
+		if match_step['is_lookup'] and match_step['fact_pat']['sym_id'] in sym_ids:
+			return True
+	return False
+
+def late_storage_index(irules):
+	for index in xrange(0,len(irules)):
+		if irules[index]['propagated']:
+			return index
+	return len(irules)
+
+def assign_late_storage(interp_rules, never_stored=()):
+	for sym_id,irules in interp_rules.items():
+		store_index = late_storage_index(irules) if sym_id not in never_stored else len(irules)
+		for index in xrange(0,len(irules)):
+			irules[index]['entry_stored'] = index >= store_index
+
+# Counted predicates: Identical facts of predicates declared with the 'counted' modifier are stored as one
+# record (see FactStore.copies in context/store.py), unless copies of a record must be told apart: For the
+# heads of rules with no simplified heads, whose propagation histories are keyed on fact ids, and for the
+# predicates of more than one head of a rule, which could be matched by several copies of a record. Returns
+# the counted predicates stored as records, and the reason why each of the others is not.
+
+def counted_sym_ids(rules):
+	counted = set([ sym_id for sym_id,fact_class in get_all_fact_classes().items() if COUNTED_MODIFIER in fact_class.modifiers ])
+	reasons = {}
+	for rule in rules:
+		heads = map(lambda fact: fact.sym_id, rule.simplify() + rule.propagate())
+		for sym_id in counted & set(heads):
+			if sym_id in reasons:
+				continue
+			if len(rule.simplify()) == 0:
+				reasons[sym_id] = "head of rule %s, which has no simplified heads" % rule.__class__.__name__
+			elif heads.count(sym_id) > 1:
+				reasons[sym_id] = "more than one head of rule %s" % rule.__class__.__name__
+	return (counted - set(reasons.keys()),reasons)
+
 def interpret_rule(rule, fact_stores):
-	
 	rule_entries = map(lambda s: (False,s),rule.simplify()) + map(lambda p: (True,p),rule.propagate())
-	rule_lhs     = map(lambda t: t[1],rule_entries)
 	guards       = rule.guards()
-	variables    = rule.get_vars()
+	return map(lambda i: interpret_rule_occurrence(rule, i, fact_stores, rule_entries=rule_entries, guards=guards)
+                  ,xrange(0,len(rule_entries)))
+
+def interpret_rule_occurrence(rule, occ_id, fact_stores, rule_entries=None, guards=None):
+	if rule_entries == None:
+		rule_entries = map(lambda s: (False,s),rule.simplify()) + map(lambda p: (True,p),rule.propagate())
+	if guards == None:
+		guards = rule.guards()
+	variables = rule.get_vars()
 
 	if len(rule.simplify()) == 0:
 		has_no_simplify = True
 	else:
 		has_no_simplify = False
 
-	rule_name = get_all_rule_classes()[rule.rule_id].__name__
+	propagated,rule_entry = rule_entries[occ_id]
+	partners = rule_entries[:occ_id] + rule_entries[(occ_id+1):]
+
+	rule_entry.exist_bind_terms()
+	early_guard_steps,guards_rest = schedule_guards(guards)
+	match_steps = compute_optimal_matching(fact_stores, partners, guards_rest, early_guard_steps)
+	for var in variables:
+		var.unbind()
+
+	interp_rule = { 'rule_id'         : rule.rule_id, 
+                        'occ_id'          : occ_id,
+                        'propagated'      : propagated, 
+                        'entry'           : make_fact_pat(rule_entry), 
+                        'match_steps'     : match_steps,
+                        'has_no_simplify' : has_no_simplify,
+                        'rhs'             : rule.consequents_env,
+                        'exist_locs'      : rule.get_exist_locs,
+                        'has_exist_locs'  : len(rule.exist_locations) > 0,
+                        'rule'            : rule }
+	assign_slots(rule, interp_rule)
+	assign_history_order(rule_entries, occ_id, interp_rule)
+	interp_rule['plan_cost'] = estimate_plan_cost(fact_stores, interp_rule)
+	return interp_rule
 
-	interp_rule = []
+# Propagation history order: Matched facts of an occurrence come in match order (the entry, then the
+# lookup steps), while propagation histories are keyed in head order (see context/prop_history.py).
+# 'history_order' lists the match position of each head, in head order, and 'history_sym_ids' the
+# predicates of the heads.
 
-	for i in xrange(0,len(rule_entries)):
-		propagated,rule_entry = rule_entries[i]
-		partners   = rule_entries[:i] + rule_entries[(i+1):]
+def assign_history_order(rule_entries, occ_id, interp_rule):
+	heads = [occ_id]
+	for match_step in interp_rule['match_steps']:
+		if match_step['is_lookup']:
+			terms = match_step['fact_pat']['terms']
+			heads.append( filter(lambda i: rule_entries[i][1].terms is terms, xrange(0,len(rule_entries)))[0] )
+	interp_rule['history_order']   = sorted(xrange(0,len(heads)), key=lambda i: heads[i])
+	interp_rule['history_sym_ids'] = map(lambda (_,fact): fact.sym_id, rule_entries)
+
+# Environment slots: Matching binds the values of the rule variables in an environment (a list of values)
+# local to each activation, rather than binding the variable terms shared by all matching. Each variable
+# has the slot of its position in rule.get_vars(), and each constant (or other term, e.g., '_') of the rule
+# occurrence is given a slot after these, holding its value in the initial environment 'env' of the
+# occurrence. An argument of a pattern binds its slot if no earlier match binds it (see <match_slot>),
+# otherwise it is checked against the slot. 'key_slots' are the slots of the key arguments of a lookup, 
+# in order of their positions (see 'key_indices'). Locations of partners are not matched (their slots
+# are left as they are).
+
+def assign_slots(rule, interp_rule):
+	slots = {}
+	variables = rule.get_vars()
+	for i in xrange(0,len(variables)):
+		slots[id(variables[i])] = i
+	env = [None] * len(variables)
+	binded = set()
+
+	def get_slot(term):
+		if id(term) in slots:
+			return slots[id(term)]
+		env.append( term.value if term.is_const() else None )
+		if term.is_const():
+			binded.add(len(env) - 1)
+		return len(env) - 1
+	def match_slots(terms, positions):
+		mslots = []
+		for i in positions:
+			slot = get_slot(terms[i])
+			mslots.append( (i,slot,slot not in binded) )
+			binded.add(slot)
+		return mslots
+	def ground_slot(term):
+		slot = get_slot(term)
+		binded.add(slot)
+		return slot
+
+	entry = interp_rule['entry']
+	terms = entry['terms']
+	interp_rule['entry_slots'] = match_slots(terms, xrange(0,len(terms)))
+	if entry['location'] != None:
+		interp_rule['entry_loc_slot'] = match_slots([entry['location']], [0])[0][1:]
+	else:
+		interp_rule['entry_loc_slot'] = None
+	for match_step in interp_rule['match_steps']:
+		if match_step['is_lookup']:
+			fact_pat = match_step['fact_pat']
+			terms = fact_pat['terms']
+			key_indices = match_step['key_indices']
+			match_step['key_slots']   = map(lambda i: ground_slot(terms[i]), key_indices)
+			match_step['match_slots'] = match_slots(terms, filter(lambda i: i not in key_indices, xrange(0,len(terms))))
+			range_lookup = match_step['range']
+			if range_lookup != None:
+				range_lookup['lower_slot'] = ground_slot(range_lookup['lower'][0]) if range_lookup['lower'] != None else None
+				range_lookup['upper_slot'] = ground_slot(range_lookup['upper'][0]) if range_lookup['upper'] != None else None
+			if fact_pat['location'] != None:
+				ground_slot(fact_pat['location'])
+		else:
+			match_step['guard_slots'] = map(ground_slot, match_step['guard_obj'].get_vars())
+	interp_rule['env'] = env
 
-		rule_entry.exist_bind_terms()
-		early_guard_steps,guards_rest = schedule_guards(guards)
-		match_steps = compute_optimal_matching(fact_stores, partners, guards_rest, early_guard_steps)
-		for var in variables:
-			var.unbind()
+# Adaptive re-planning: Re-estimates the cost of the plan (match steps) of each rule occurrence with
+# the current store statistics, and re-plans the occurrences whose estimate has drifted from the one
+# at planning time by more than the given factor (either way). Returns the (sym_id,index) positions
+# in interp_rules of the occurrences that were re-planned.
 
-		interp_rule.append( { 'rule_id'         : rule.rule_id, 
-                                      'occ_id'          : i,
-                                      'propagated'      : propagated, 
-                                      'entry'           : make_fact_pat(rule_entry), 
-                                      'match_steps'     : match_steps,
-                                      'has_no_simplify' : has_no_simplify,
-                                      'rhs'             : rule.consequents,
-                                      'exist_locs'      : rule.get_exist_locs,
-                                      'has_exist_locs'  : len(rule.exist_locations) > 0 } )
+def replan_rules(interp_rules, fact_stores, threshold):
+	replanned = []
+	for sym_id,irules in interp_rules.items():
+		for index in xrange(0,len(irules)):
+			interp_rule = irules[index]
+			curr_cost = max(1.0, estimate_plan_cost(fact_stores, interp_rule))
+			plan_cost = max(1.0, interp_rule['plan_cost'])
+			if curr_cost > plan_cost * threshold or plan_cost > curr_cost * threshold:
+				irules[index] = interpret_rule_occurrence(interp_rule['rule'], interp_rule['occ_id'], fact_stores)
+				irules[index]['entry_stored'] = interp_rule['entry_stored']
+				replanned.append( (sym_id,index) )
+	return replanned
+
+# Dropping indexes after re-planning: Hash and range indexes that no lookup step of the given rule occurrences
+# (all occurrences in use, in a list of interp_rules) refers to anymore are dropped from their stores, and the
+# lookup steps are renumbered to the kept indexes. Lookup functions already generated from the lookup steps
+# hold on to the buckets of their index, and so remain valid. Returns the number of indexes dropped.
+
+def drop_unused_indexes(fact_stores, all_interp_rules):
+	lookup_steps = []
+	for interp_rules in all_interp_rules:
+		for irules in interp_rules.values():
+			for interp_rule in irules:
+				lookup_steps += filter(lambda match_step: match_step['is_lookup'], interp_rule['match_steps'])
+	hash_used  = defaultdict(set)
+	range_used = defaultdict(set)
+	for match_step in lookup_steps:
+		sym_id = match_step['fact_pat']['sym_id']
+		if match_step['range'] != None:
+			range_used[sym_id].add( match_step['range']['range_index'] )
+		elif match_step['lookup_index'] >= 0:
+			hash_used[sym_id].add( match_step['lookup_index'] )
+	renumbered = {}
+	dropped = 0
+	for sym_id,fact_store in fact_stores.items():
+		num_of_indexes = len(fact_store.hash_tables) + len(fact_store.range_tables)
+		renumbered[sym_id] = fact_store.drop_indexes(hash_used[sym_id], range_used[sym_id])
+		dropped += num_of_indexes - len(fact_store.hash_tables) - len(fact_store.range_tables)
+	for match_step in lookup_steps:
+		hash_kept,range_kept = renumbered[match_step['fact_pat']['sym_id']]
+		if match_step['range'] != None:
+			match_step['range']['range_index'] = range_kept[match_step['range']['range_index']]
+		elif match_step['lookup_index'] >= 0:
+			match_step['lookup_index'] = hash_kept[match_step['lookup_index']]
+	return dropped
+
+# Estimated cost of the match steps of a rule occurrence, with the same cost model as estimate_order_cost
+def estimate_plan_cost(fact_stores, interp_rule):
+	cost = 0.0
+	for step_estimate in estimate_plan_steps(fact_stores, interp_rule):
+		if step_estimate['candidates'] != None:
+			cost += step_estimate['probes'] * (1.0 + step_estimate['candidates'])
+	return cost
+
+# Estimated cardinalities of each match step of a rule occurrence: 'probes' is the estimated number of 
+# partial matches that reach the step, and 'candidates' the estimated number of candidates per probe of
+# a lookup step (None for guard steps).
+def estimate_plan_steps(fact_stores, interp_rule):
+	entry = interp_rule['entry']
+	binded_terms = []
+	def exist_bind(terms):
+		for term in terms:
+			if term.is_unbinded():
+				term.bind(DUMMY_VALUE)
+				binded_terms.append(term)
+	exist_bind( list(entry['terms']) + ([entry['location']] if entry['location'] != None else []) )
+	step_estimates = []
+	partial_matches = 1.0
+	for match_step in interp_rule['match_steps']:
+		if match_step['is_lookup']:
+			fact_pat = match_step['fact_pat']
+			terms = fact_pat['terms']
+			key_indices = filter(lambda i: terms[i].is_binded() or terms[i].is_const(), xrange(0,len(terms)))
+			candidates = fact_stores[fact_pat['sym_id']].estimate_candidates(key_indices)
+			if match_step['range'] != None:
+				candidates *= RANGE_SELECTIVITY
+			step_estimates.append({ 'probes':partial_matches, 'candidates':candidates })
+			partial_matches *= candidates
+			exist_bind( match_step['free_terms'] )
+		else:
+			step_estimates.append({ 'probes':partial_matches, 'candidates':None })
+			partial_matches *= GUARD_SELECTIVITY
+	for term in binded_terms:
+		term.unbind()
+	return step_estimates
 
-	return interp_rule
+# Computing the matching steps of the partners of a rule occurrence: If all partner stores hold facts,
+# the order of partners is chosen by estimated cost (see cost_based_order), otherwise by the static
+# heuristic of compute_heuristic_matching.
 
 def compute_optimal_matching(fact_stores, partners, guards, match_steps):
+	if len(partners) == 0:
+		return match_steps
+	order = cost_based_order(fact_stores, partners, guards)
+	if order == None:
+		return compute_heuristic_matching(fact_stores, partners, guards, match_steps)
+	else:
+		return compute_ordered_matching(fact_stores, map(lambda i: partners[i], order), guards, match_steps)
+
+def compute_ordered_matching(fact_stores, partners, guards, match_steps):
+	for propagated,partner in partners:
+		free_terms = filter(lambda term: term.is_unbinded(), partner.get_terms())
+		add_lookup_step(fact_stores, propagated, partner, free_terms, find_range_lookup(partner, guards), match_steps)
+		partner.exist_bind_terms()
+		guard_steps,guards = schedule_guards(guards)
+		match_steps += guard_steps
+	return match_steps
+
+def compute_heuristic_matching(fact_stores, partners, guards, match_steps):
 	if len(partners) == 0:
 		return match_steps
 
@@ -103,6 +354,7 @@ def compute_optimal_matching(fact_stores, partners, guards, match_steps):
 	curr_propagated = None
 	curr_index = -1
 	curr_free_terms = None
+	curr_range_lookup = None
 
 	for index in xrange(0,len(partners)):
 		propagated,partner = partners[index]
@@ -119,10 +371,11 @@ def compute_optimal_matching(fact_stores, partners, guards, match_steps):
 					num_of_free += 1
 			elif term.is_const():
 				num_of_const += 1
+		range_lookup = find_range_lookup(partner, guards)
 		partner.exist_bind_terms()
 		guard_steps,guards_rest = schedule_guards(guards)
 		guard_count = len(guard_steps)
-		new_max_score = num_of_joins*10 + guard_count + num_of_const - num_of_free
+		new_max_score = num_of_joins*10 + guard_count + num_of_const - num_of_free + (5 if range_lookup != None else 0)
 		if curr_max_score <= new_max_score:
 			curr_max_score = new_max_score
 			curr_guard_steps = guard_steps
@@ -131,29 +384,124 @@ def compute_optimal_matching(fact_stores, partners, guards, match_steps):
 			curr_propagated   = propagated
 			curr_index = index
 			curr_free_terms = free_terms
+			curr_range_lookup = range_lookup
 		for term in free_terms:
 			term.unbind()
 		
-	lookup_info = fact_stores[curr_best_partner.sym_id].generate_lookup(curr_best_partner)
-	best_match_step = { 'is_lookup'    : True
-                          , 'propagated'   : curr_propagated
-                          , 'lookup_index' : lookup_info['lookup_index']
-                          , 'fact_pat'     : make_fact_pat(curr_best_partner)
-                          , 'filter'       : lookup_info['filter']
-                          , 'free_terms'   : curr_free_terms }	
-	match_steps.append( best_match_step )
+	add_lookup_step(fact_stores, curr_propagated, curr_best_partner, curr_free_terms, curr_range_lookup, match_steps)
 	for curr_guard_step in curr_guard_steps:
 		match_steps.append( curr_guard_step )
 	curr_best_partner.exist_bind_terms()
 
-	return compute_optimal_matching(fact_stores, partners[:curr_index]+partners[(curr_index+1):], curr_guards_rest, match_steps)
+	return compute_heuristic_matching(fact_stores, partners[:curr_index]+partners[(curr_index+1):], curr_guards_rest, match_steps)
+
+def add_lookup_step(fact_stores, propagated, partner, free_terms, range_lookup, match_steps):
+	if range_lookup != None:
+		lookup_info = fact_stores[partner.sym_id].generate_range_lookup(partner, range_lookup['position'])
+		range_lookup['range_index'] = lookup_info['range_index']
+		lookup_info['lookup_index'] = -1
+	else:
+		lookup_info = fact_stores[partner.sym_id].generate_lookup(partner)
+	terms = partner.terms
+	match_step = { 'is_lookup'    : True
+                     , 'propagated'   : propagated
+                     , 'lookup_index' : lookup_info['lookup_index']
+                     , 'key_indices'  : filter(lambda i: terms[i].is_binded() or terms[i].is_const(), xrange(0,len(terms)))
+                     , 'fact_pat'     : make_fact_pat(partner)
+                     , 'exact'        : lookup_info['exact']
+                     , 'free_terms'   : free_terms
+                     , 'range'        : range_lookup }	
+	match_steps.append( match_step )
+
+# Cost-based ordering of partners: The cost of an order is the estimated number of candidates tried
+# by the matching, where the candidates of each lookup are estimated from the store statistics (see 
+# FactStore.estimate_candidates), scaled by RANGE_SELECTIVITY for range lookups, and each guard that
+# becomes ground passes GUARD_SELECTIVITY of the partial matches. All orders are enumerated for up to 
+# MAX_PERMUTED_PARTNERS partners, beyond which partners are ordered greedily. Returns None if any
+# partner store is empty, i.e., there are no meaningful statistics yet.
+
+GUARD_SELECTIVITY = 0.5
+RANGE_SELECTIVITY = 1.0/3
+MAX_PERMUTED_PARTNERS = 4
+
+def cost_based_order(fact_stores, partners, guards):
+	for _,partner in partners:
+		if fact_stores[partner.sym_id].size == 0:
+			return None
+	num_of_partners = len(partners)
+	if num_of_partners <= MAX_PERMUTED_PARTNERS:
+		orders = map(list, permutations(range(0,num_of_partners)))
+		costs  = map(lambda order: estimate_order_cost(fact_stores, partners, order, guards), orders)
+		return orders[ costs.index(min(costs)) ]
+	else:
+		order = []
+		rest  = range(0,num_of_partners)
+		while len(rest) > 0:
+			costs = map(lambda i: estimate_order_cost(fact_stores, partners, order + [i], guards), rest)
+			order.append( rest.pop(costs.index(min(costs))) )
+		return order
+
+def estimate_order_cost(fact_stores, partners, order, guards):
+	cost = 0.0
+	partial_matches = 1.0
+	binded_terms = []
+	for index in order:
+		_,partner = partners[index]
+		lookup_pat = build_lookup_pat(partner)
+		key_indices = sorted(lookup_pat['binded_keys'] + lookup_pat['binded_hashs'] + lookup_pat['const'])
+		candidates = fact_stores[partner.sym_id].estimate_candidates(key_indices)
+		if find_range_lookup(partner, guards) != None:
+			candidates *= RANGE_SELECTIVITY
+		cost += partial_matches * (1.0 + candidates)
+		free_terms = filter(lambda term: term.is_unbinded(), partner.get_terms())
+		partner.exist_bind_terms()
+		binded_terms += free_terms
+		guard_steps,guards = schedule_guards(guards)
+		partial_matches *= candidates * (GUARD_SELECTIVITY ** len(guard_steps))
+	for term in binded_terms:
+		term.unbind()
+	return cost
+
+# Ordered lookups: A partner is range constrained if a comparison guard (see Guard.range_op) compares
+# one of its free arguments against a term that is already binded (or constant). Returns the bounds
+# on the first such argument as a <range_lookup> (without 'range_index'), None if there is none.
+
+FLIP_RANGE_OPS = { '<':'>', '<=':'>=', '>':'<', '>=':'<=' }
+
+def find_range_lookup(partner, guards):
+	terms = partner.terms
+	range_lookup = None
+	for guard in guards:
+		op = guard.range_op
+		if op == None:
+			continue
+		x,y = guard.get_vars()
+		if x.is_unbinded() and (y.is_binded() or y.is_const()):
+			free_term,bound_term = x,y
+		elif y.is_unbinded() and (x.is_binded() or x.is_const()):
+			free_term,bound_term = y,x
+			op = FLIP_RANGE_OPS[op]
+		else:
+			continue
+		positions = [ i for i in xrange(0,len(terms)) if terms[i] is free_term ]
+		if len(positions) == 0:
+			continue
+		if range_lookup == None:
+			range_lookup = { 'position':positions[0], 'lower':None, 'upper':None }
+		elif range_lookup['position'] != positions[0]:
+			continue
+		if op in ['>','>='] and range_lookup['lower'] == None:
+			range_lookup['lower'] = (bound_term, op == '>=')
+		elif op in ['<','<='] and range_lookup['upper'] == None:
+			range_lookup['upper'] = (bound_term, op == '<=')
+	return range_lookup
 
 def schedule_guards(guards):
 	guard_match_steps = []
 	unground_guards   = []
 	for guard in guards: 
 		if guard.is_ground():
-			guard_match_steps.append({ 'is_lookup':False, 'guard':guard.evaluate, 'guard_str':str(guard) })
+			guard_match_steps.append({ 'is_lookup':False, 'guard':guard.get_values_evaluator(), 'guard_str':str(guard), 'guard_obj':guard })
 		else:
 			unground_guards.append( guard )
 	return (guard_match_steps,unground_guards)
@@ -175,13 +523,83 @@ def pretty_interp_rule(interp_rule):
 	strs.append( "Rule: %s # %s" % (get_all_rule_classes()[interp_rule['rule_id']].__name__,interp_rule['occ_id']) )
 	strs.append( "Entry: %s %s" % ('Propagate' if interp_rule['propagated'] else 'Simplify', pretty_fact_pat(interp_rule['entry']) ) )
 	strs.append( "Matching Steps:" )
-	for match_step in interp_rule['match_steps']:
+	strs += map(pretty_match_step, interp_rule['match_steps'])
+	return "-----------------------\n" + '\n'.join(strs) + "\n"
+
+def pretty_match_step(match_step):
+	if match_step['is_lookup']:
+		match_type = 'Propagate' if match_step['propagated'] else 'Simplify'
+		match_pat  = pretty_fact_pat(match_step['fact_pat'])
+		if match_step['range'] != None:
+			range_lookup = match_step['range']
+			return "Lookup: %s %s (Store Range Index: %s on %s)" % (match_type,match_pat,range_lookup['range_index'],range_lookup['position'])
+		else:
+			return "Lookup: %s %s (Store Index: %s)" % (match_type,match_pat,match_step['lookup_index'])
+	else:
+		return "Schedule Guard: %s" % match_step['guard_str']
+
+# Explain and analyze: Shows the match steps of each rule occurrence with the estimated cardinalities of
+# each step (see estimate_plan_steps) against the current store statistics. In analyze mode, rule occurrences
+# are instrumented by the runtime (see mpi_runtime.generate_matching_function), which collects the following
+# statistics in 'stats' of each <interp_rule>, and occurrences are shown in decreasing order of time spent.
+#   analyze_stats :: { 'calls':int, 'time':float, 'firings':int, 'steps':[<step_stats>], 'rhs':<step_stats> }
+#   step_stats    :: { 'calls':int, 'candidates':int, 'time':float }
+# 'calls' and 'time' are the number of times the occurrence (step) is tried and the time spent in it, 
+# including the later steps. Rejected candidates and failed guards are inferred from the calls of the
+# next step, and the time of each step excludes that of the next.
+
+def new_analyze_stats(num_of_steps):
+	return { 'calls':0, 'time':0.0, 'firings':0, 'rhs':new_step_stats()
+               , 'steps':map(lambda _: new_step_stats(), xrange(0,num_of_steps)) }
+
+def new_step_stats():
+	return { 'calls':0, 'candidates':0, 'time':0.0 }
+
+def explain_interp_rules(fact_stores, interp_rules, analyze=False):
+	irules = []
+	for sym_id in interp_rules:
+		irules += interp_rules[sym_id]
+	if analyze:
+		irules = filter(lambda interp_rule: 'stats' in interp_rule, irules)
+		irules.sort(key=lambda interp_rule: interp_rule['stats']['time'], reverse=True)
+	else:
+		irules.sort(key=lambda interp_rule: (interp_rule['rule_id'],interp_rule['occ_id']))
+	return '\n'.join( map(lambda interp_rule: explain_interp_rule(fact_stores, interp_rule, analyze=analyze), irules) )
+
+def explain_interp_rule(fact_stores, interp_rule, analyze=False):
+	match_steps = interp_rule['match_steps']
+	step_estimates = estimate_plan_steps(fact_stores, interp_rule)
+	if analyze:
+		stats = interp_rule['stats']
+		step_stats = stats['steps'] + [stats['rhs']]
+	strs = []
+	strs.append( "Rule: %s # %s (Est. Cost: %.1f)" % (get_all_rule_classes()[interp_rule['rule_id']].__name__,interp_rule['occ_id']
+                                                       ,estimate_plan_cost(fact_stores, interp_rule)) )
+	entry_str = "Entry: %s %s" % ('Propagate' if interp_rule['propagated'] else 'Simplify', pretty_fact_pat(interp_rule['entry']) )
+	if analyze:
+		entry_str += " [activations: %s, firings: %s, time: %.6fs, self: %.6fs]" % (stats['calls'],stats['firings'],stats['time']
+                                                                                         ,stats['time'] - step_stats[0]['time'])
+	strs.append( entry_str )
+	for i in xrange(0,len(match_steps)):
+		match_step = match_steps[i]
+		step_estimate = step_estimates[i]
 		if match_step['is_lookup']:
-			match_type = 'Propagate' if match_step['propagated'] else 'Simplify'
-			match_pat  = pretty_fact_pat(match_step['fact_pat'])
-			strs.append( "Lookup: %s %s (Store Index: %s)" % (match_type,match_pat,match_step['lookup_index']) )
+			step_str = "%s. %s (Est. Probes: %.1f, Est. Candidates: %.1f)" % (i+1,pretty_match_step(match_step)
+                                                                                 ,step_estimate['probes'],step_estimate['candidates'])
 		else:
-			strs.append( "Schedule Guard: %s" % match_step['guard_str'] )
+			step_str = "%s. %s (Est. Probes: %.1f)" % (i+1,pretty_match_step(match_step),step_estimate['probes'])
+		if analyze:
+			curr_stats,next_stats = step_stats[i],step_stats[i+1]
+			if match_step['is_lookup']:
+				step_str += " [probes: %s, candidates: %s, rejected: %s, time: %.6fs]" % (curr_stats['calls'],curr_stats['candidates']
+                                                                                                   ,curr_stats['candidates'] - next_stats['calls']
+                                                                                                   ,curr_stats['time'] - next_stats['time'])
+			else:
+				step_str += " [probes: %s, failed: %s, time: %.6fs]" % (curr_stats['calls'],curr_stats['calls'] - next_stats['calls']
+                                                                                 ,curr_stats['time'] - next_stats['time'])
+		strs.append( step_str )
+	if analyze:
+		strs.append( "Rhs: [tried: %s, firings: %s, time: %.6fs]" % (stats['rhs']['calls'],stats['firings'],stats['rhs']['time']) )
 	return "-----------------------\n" + '\n'.join(strs) + "\n"
 
 def pretty_fact_pat(fact_pat):
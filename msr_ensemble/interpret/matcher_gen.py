@@ -0,0 +1,195 @@
+
+'''
+This file is part of MSR Ensemble for Python (MSRE-Py).
+
+MSRE-Py is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+MSRE-Py is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with MSRE-Py. If not, see <http://www.gnu.org/licenses/>.
+
+MSR Ensemble for Python (MSRE-Py) Version 0.9, Prototype Alpha
+
+Authors:
+Edmund S. L. Lam      sllam@qatar.cmu.edu
+Iliano Cervesato      iliano@cmu.edu
+
+* Development of MSRE-Py is funded by the Qatar National Research Fund as project NPRP 09-667-1-100 (Effective Programming for Large Distributed Ensembles)
+'''
+
+import os
+
+from msr_ensemble.facts.guard import Less, Leq, Greater, Geq, Eq, Neq
+from msr_ensemble.rules.rule import get_all_rule_classes
+from msr_ensemble.context.store import NATIVE_KEY_TYPES, encode_key_value
+
+# Generated matchers: Instead of the chain of closures of mpi_runtime.generate_partner_matching_function,
+# the match steps of a rule occurrence are compiled into the Python source of a flat search function, 
+# with a nested for loop over the candidates of each lookup, a local variable for each slot of the
+# environment (see assign_slots in interpret/interpreter.py), and comparison guards inlined as expressions.
+# The search function returns True if the rule is applied, after which the matching function of the 
+# occurrence proceeds as the closure matcher does. Rule applications themselves are left to the 'fire'
+# function given, i.e. the closure that the runtime builds for the end of the match steps, which is
+# given the environment of the variables of the rule. Generated sources are written to dump_dir, if given
+# (created if missing).
+
+# Guards inlined as infix comparisons
+INLINE_GUARD_OPS = { Less:'<', Leq:'<=', Greater:'>', Geq:'>=', Eq:'==', Neq:'!=' }
+
+def compile_matching_function(interp_rule, fact_stores, fire, location=None, dump_dir=None):
+	rule_name = get_all_rule_classes()[interp_rule['rule_id']].__name__
+	func_name = "match_%s_%s" % (rule_name,interp_rule['occ_id'])
+	matcher_gen = MatcherGen(interp_rule, fact_stores, fire, location)
+	source = matcher_gen.gen_source(func_name)
+	if dump_dir != None:
+		make_dump_dir(dump_dir)
+		file_name = os.path.join(dump_dir, "%s.py" % func_name)
+		dump_file = open(file_name, 'w')
+		dump_file.write(source)
+		dump_file.close()
+	else:
+		file_name = "<%s>" % func_name
+	env = matcher_gen.env
+	exec compile(source, file_name, 'exec') in env
+	return env[func_name]
+
+# The dump directory is created if missing. MPI nodes that share it may race to create it.
+def make_dump_dir(dump_dir):
+	if not os.path.isdir(dump_dir):
+		try:
+			os.makedirs(dump_dir)
+		except OSError:
+			if not os.path.isdir(dump_dir):
+				raise
+
+class MatcherGen:
+
+	def __init__(self, interp_rule, fact_stores, fire, location):
+		self.interp_rule = interp_rule
+		self.fact_stores = fact_stores
+		self.location = location
+		self.env = { 'fire':fire, 'native_types':NATIVE_KEY_TYPES, 'encode_key_value':encode_key_value }
+		self.lines = []
+		# Expressions of the values of the slots, initially their values in the initial environment
+		self.slot_exprs = map(lambda value: self.add_env('c', value) if value != None else "None", interp_rule['env'])
+
+	def add_env(self, prefix, obj):
+		name = "%s%s" % (prefix,len(self.env))
+		self.env[name] = obj
+		return name
+
+	def emit(self, depth, line):
+		self.lines.append( ('\t' * depth) + line )
+
+	def fail_stmt(self, depth):
+		return "return False" if depth == 1 else "continue"
+
+	# Matching the value of the given expression against a slot, see <match_slot>
+	def emit_match(self, slot, binds, expr, depth):
+		if binds:
+			self.emit(depth, "s%s = %s" % (slot,expr))
+			self.slot_exprs[slot] = "s%s" % slot
+		else:
+			self.emit(depth, "if %s != %s: %s" % (expr,self.slot_exprs[slot],self.fail_stmt(depth)))
+
+	# Expression of the encoded hash value of the given key slots (see make_key_encoder in context/store.py)
+	def key_expr(self, key_slots):
+		exprs = []
+		for slot in key_slots:
+			v = self.slot_exprs[slot]
+			if v != "s%s" % slot:
+				exprs.append( self.add_env('k', encode_key_value(self.interp_rule['env'][slot])) )
+			else:
+				exprs.append( "(%s if type(%s) in native_types else encode_key_value(%s))" % (v,v,v) )
+		if len(exprs) == 0:
+			return "None"
+		elif len(exprs) == 1:
+			return exprs[0]
+		else:
+			return "(%s,)" % ','.join(exprs)
+
+	def gen_source(self, func_name):
+		interp_rule = self.interp_rule
+		entry = interp_rule['entry']
+		self.emit(0, "def search(act):")
+		self.emit(1, "vs = act.values")
+		for (position,slot,binds) in interp_rule['entry_slots']:
+			self.emit_match(slot, binds, "vs[%s]" % position, 1)
+		if self.location != None and interp_rule['entry_loc_slot'] != None:
+			(slot,binds) = interp_rule['entry_loc_slot']
+			self.emit_match(slot, binds, self.add_env('loc', self.location.value), 1)
+
+		facts = [ ('act',entry['sym_id'],interp_rule['propagated']) ]
+		depth = 1
+		for match_step in interp_rule['match_steps']:
+			if match_step['is_lookup']:
+				depth = self.gen_lookup(match_step, facts, depth)
+			else:
+				self.gen_guard(match_step, depth)
+
+		num_of_vars = len(interp_rule['rule'].get_vars())
+		simplify  = [ name for (name,_,propagated) in facts if not propagated ]
+		if not interp_rule['propagated'] and not interp_rule['entry_stored']:
+			# Active fact not stored yet (see late storage in interpret/interpreter.py)
+			simplify = simplify[1:]
+		propagate = [ name for (name,_,propagated) in facts if propagated ]
+		self.emit(depth, "if fire([%s], None, [%s], [%s]):" % (','.join(self.slot_exprs[:num_of_vars]),','.join(simplify),','.join(propagate)))
+		self.emit(depth+1, "return True")
+		self.emit(1, "return False")
+		self.emit(0, "")
+
+		self.emit(0, "def %s(act):" % func_name)
+		if interp_rule['propagated']:
+			self.emit(1, "while search(act):")
+			self.emit(2, "pass")
+			self.emit(1, "return True")
+		else:
+			self.emit(1, "return not search(act)")
+		return '\n'.join(self.lines) + '\n'
+
+	def gen_lookup(self, match_step, facts, depth):
+		sym_id = match_step['fact_pat']['sym_id']
+		fact_store = self.fact_stores[sym_id]
+		hash_expr = self.key_expr( match_step['key_slots'] )
+		can = "can%s" % len(facts)
+		range_lookup = match_step['range']
+		if range_lookup != None:
+			lower = range_lookup['lower']
+			upper = range_lookup['upper']
+			lookup = self.add_env('lookup', fact_store.get_range_bucket_lookup_func_from_store(range_lookup['range_index']
+                                                      ,lower[1] if lower != None else None, upper[1] if upper != None else None))
+			lower_expr = self.slot_exprs[range_lookup['lower_slot']] if lower != None else "None"
+			upper_expr = self.slot_exprs[range_lookup['upper_slot']] if upper != None else "None"
+			self.emit(depth, "for %s in %s(%s, %s, %s):" % (can,lookup,hash_expr,lower_expr,upper_expr))
+		else:
+			lookup = self.add_env('lookup', fact_store.get_bucket_lookup_func_from_store(match_step['lookup_index']))
+			self.emit(depth, "for %s in %s(%s):" % (can,lookup,hash_expr))
+		depth += 1
+		# A candidate is not a fact already matched by the rule occurrence
+		for (name,fact_sym_id,_) in facts:
+			if fact_sym_id == sym_id:
+				self.emit(depth, "if %s.fact_id == %s.fact_id: continue" % (can,name))
+		facts.append( (can,sym_id,match_step['propagated']) )
+		match_slots = match_step['match_slots']
+		if len(match_slots) > 0:
+			vs = "vs%s" % (len(facts)-1)
+			self.emit(depth, "%s = %s.values" % (vs,can))
+			for (position,slot,binds) in match_slots:
+				self.emit_match(slot, binds, "%s[%s]" % (vs,position), depth)
+		return depth
+
+	def gen_guard(self, match_step, depth):
+		guard = match_step['guard_obj']
+		slot_exprs = map(lambda slot: self.slot_exprs[slot], match_step['guard_slots'])
+		if guard.__class__ in INLINE_GUARD_OPS:
+			x,y = slot_exprs
+			self.emit(depth, "if not (%s %s %s): %s" % (x,INLINE_GUARD_OPS[guard.__class__],y,self.fail_stmt(depth)))
+		else:
+			self.emit(depth, "if not %s(%s): %s" % (self.add_env('guard', match_step['guard']),','.join(slot_exprs),self.fail_stmt(depth)))
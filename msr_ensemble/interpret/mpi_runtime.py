@@ -31,27 +31,81 @@ import time
 
 from msr_ensemble.facts.location import loc, loc_rank, loc_proc_id
 from msr_ensemble.facts.term import lift
-from msr_ensemble.context.fact_repr import make_fact_repr, make_fact_repr_loc, make_fact_pat, pretty_fact_repr
-from msr_ensemble.context.store import new_stores, add_to_stores, del_from_stores, pretty_stores, get_candidates_from_stores, get_candidate_lookup_func_from_stores
-from msr_ensemble.context.goals import add_goals, next_goal, HeapGoals
+from msr_ensemble.facts.fact import get_fact_name
+from msr_ensemble.context.fact_repr import make_fact_repr, make_fact_repr_loc, fact_repr_from_msg, make_fact_pat, pretty_fact_repr
+from msr_ensemble.context.store import STORE_DICT, PRED_OUTPUT_ONLY, PRED_NEVER_STORED, new_stores, add_to_stores, del_from_stores, pretty_stores, get_candidate_lookup_func_from_stores, get_range_lookup_func_from_stores
+from msr_ensemble.context.goals import add_goals, next_goal, new_goals
 from msr_ensemble.rules.rule import get_all_rule_classes
-from msr_ensemble.context.prop_history import new_histories
+from msr_ensemble.context.prop_history import new_histories, pretty_history_sizes
 
 from msr_ensemble.misc.timeout import exec_timeout_in
 
-from msr_ensemble.interpret.interpreter import interpret_rules, pretty_interp_rules
+from msr_ensemble.interpret.interpreter import interpret_rules, counted_sym_ids, replan_rules, drop_unused_indexes, late_storage_index, assign_late_storage, pretty_interp_rules, explain_interp_rules, new_analyze_stats
+from msr_ensemble.interpret.semi_naive import DeltaSets, semi_naive_rules, pretty_semi_naive_rules, split_semi_naive_rules, run_semi_naive_round, delta_sym_ids
+from msr_ensemble.interpret.matcher_gen import compile_matching_function
 
-from msr_ensemble.misc.mpi_process import MasterProcess, WorkerProcess, send_facts, receive_fact_future_mpi
+from msr_ensemble.misc.mpi_process import MasterProcess, WorkerProcess, AggregatingSender, receive_fact_future_mpi, default_receiver
+from msr_ensemble.misc.codec import CODEC_BINARY, new_codec
 from msr_ensemble.misc.msr_logging import init_logger, get_logger, log_debug, log_info, log_warn, log_error, log_critical
 
+# Runtime options
+#   - store_mode       : Fact store mode, STORE_DICT or STORE_COLUMNAR (see context/store.py)
+#   - replan_interval  : Number of activations between checks for re-planning rule occurrences, 0 to never re-plan.
+#                        Indexes that no plan uses anymore are dropped after re-planning (see drop_unused_indexes)
+#   - replan_threshold : Factor by which the cost estimate of a plan must drift for it to be re-planned
+#   - explain          : Log the match steps of each rule occurrence, with estimated cardinalities, before rewriting
+#   - analyze          : Instrument rule occurrences and log the measured statistics of each match step after 
+#                        rewriting (see explain_interp_rules in interpret/interpreter.py)
+#   - matcher_mode     : Matching functions of rule occurrences, MATCHER_CLOSURE or MATCHER_COMPILED (see 
+#                        interpret/matcher_gen.py). Analyze mode always uses closure matchers.
+#   - matcher_dump_dir : Directory to write the sources of compiled matchers to, None to not write them
+#   - goal_priorities  : Priorities of all facts the ensemble can assert (generated as <ensemble>_priorities), 
+#                        to select a bucketed goal queue, None if unknown (see new_goals in context/goals.py)
+#   - pred_classes     : Dict from fact classes to their predicate class (generated as <ensemble>_pred_classes, 
+#                        see front_end/compile/pred_analysis.py), None if unknown. Output-only predicates are
+#                        kept in sink stores, and never-stored predicates are never added to their store.
+#   - semi_naive       : Evaluate the rules that are eligible in rounds of semi-naive evaluation, rather than by
+#                        the occurrences of active facts (see interpret/semi_naive.py). Eligibility of the rules
+#                        is logged in this mode, and in explain mode.
+#   - activation_batch : Maximum number of goals of a predicate activated as a batch (see string_up_batch_funcs), 
+#                        0 to activate goals one at a time
+#   - send_batch       : Maximum number of facts sent to another MPI node in one message, 1 to send facts one at a
+#                        time. Batches are also bounded in bytes, and sent when the rewrite loop goes idle (see 
+#                        AggregatingSender in misc/mpi_process.py)
+#   - max_pending_sends: Maximum number of outstanding sends to other MPI nodes, before sending stalls (see SendPool
+#                        in misc/mpi_process.py)
+#   - codec_mode       : Wire codec of the facts sent to other MPI nodes, CODEC_BINARY or CODEC_JSON (see 
+#                        misc/codec.py)
+
+MATCHER_CLOSURE  = 'closure'
+MATCHER_COMPILED = 'compiled'
+
+def runtime_options(store_mode=STORE_DICT, replan_interval=0, replan_threshold=2.0, explain=False, analyze=False
+                   ,matcher_mode=MATCHER_CLOSURE, matcher_dump_dir=None, goal_priorities=None
+                   ,pred_classes=None, semi_naive=False, activation_batch=0, send_batch=64
+                   ,max_pending_sends=256, codec_mode=CODEC_BINARY):
+	return { 'store_mode':store_mode, 'replan_interval':replan_interval, 'replan_threshold':replan_threshold
+               , 'explain':explain, 'analyze':analyze, 'matcher_mode':matcher_mode, 'matcher_dump_dir':matcher_dump_dir
+               , 'goal_priorities':goal_priorities, 'pred_classes':pred_classes, 'semi_naive':semi_naive
+               , 'activation_batch':activation_batch, 'send_batch':send_batch, 'max_pending_sends':max_pending_sends
+               , 'codec_mode':codec_mode }
+
+# Sym ids of the predicates of the given class, according to the 'pred_classes' option
+def pred_class_sym_ids(options, pred_class):
+	pred_classes = options['pred_classes']
+	if pred_classes == None:
+		return set()
+	return set([ fact_class.sym_id for fact_class,c in pred_classes.items() if c == pred_class ])
+
 # Top-level Execution
 
-def execute_msr(init_goals, rule_classes, use_mpi=True):
+def execute_msr(init_goals, rule_classes, use_mpi=True, **kwargs):
+	options = runtime_options(**kwargs)
 
 	if not use_mpi:
 		logger = init_logger("msr", log_file="msr.log")
 		log_info(logger,"Started")
-		rewrite_loop(rule_classes, init_goals, logger, (lambda: lambda: None), (lambda _: None), (lambda x: None), None )
+		rewrite_loop(rule_classes, init_goals, logger, (lambda: lambda: None), (lambda _: None), (lambda x: None), None, options=options )
 		log_info(logger,"Shutting Down!")
 	else:
 		comm = MPI.COMM_WORLD
@@ -66,14 +120,20 @@ def execute_msr(init_goals, rule_classes, use_mpi=True):
 				break
 
 		if allow_dynamic_spawning:
-			mp = MSRMasterProcess(rank, init_goals, rule_classes, file_logging=True, output_file="output.log")
+			mp = MSRMasterProcess(rank, init_goals, rule_classes, file_logging=True, output_file="output.log", options=options)
 			mp.start()
 		else:
 			logger = init_logger("rank_%s" % rank, log_file="rank_%s.log" % rank)
 			output_logger = init_logger("output", log_file="output.log")
 			log_info(logger,"Started")
 			init_goals = filter_goals_by_rank(init_goals, rank)
-			rewrite_loop(rule_classes, init_goals, logger, receive_fact_future_mpi, send_facts, lambda x: None, lift(loc(rank)), output_logger=output_logger)
+			codec  = new_codec(options['codec_mode'])
+			sender = AggregatingSender(max_facts=options['send_batch'], max_pending=options['max_pending_sends'], receiver=default_receiver(codec)
+                                                  ,codec=codec)
+			rewrite_loop(rule_classes, init_goals, logger, receive_fact_future_mpi, sender.send, lambda x: None, lift(loc(rank)), output_logger=output_logger
+                                    ,options=options, flush_msgs_func=sender.flush, poll_msgs_func=sender.poll)
+			sender.wait()
+			log_info(logger,"Sent: %s" % sender.pretty_stats())
 			log_info(logger,"Shutting Down!")
 
 # Goal filtering
@@ -98,11 +158,16 @@ def partition_goals_by_proc_id(goals, proc_id):
 
 class MSRMasterProcess(MasterProcess):
 
-	def __init__(self, rank, init_goals, rule_classes, sleep_length=0.1, sleep_factor=2, sleep_limit=3, init_workers=1, file_logging=False, output_file=None):
+	def __init__(self, rank, init_goals, rule_classes, sleep_length=0.1, sleep_factor=2, sleep_limit=3, init_workers=1, file_logging=False, output_file=None
+                    ,options=None):
+		if options == None:
+			options = runtime_options()
 		self.initialize(rank, sleep_length=sleep_length, sleep_factor=sleep_factor, sleep_limit=sleep_limit
-                               ,init_workers=init_workers, file_logging=file_logging)
+                               ,init_workers=init_workers, file_logging=file_logging, send_batch=options['send_batch']
+                               ,max_pending_sends=options['max_pending_sends'], codec_mode=options['codec_mode'])
 		self.init_goals   = filter_goals_by_rank(init_goals, rank)
 		self.rule_classes = rule_classes
+		self.options      = options
 		if not (output_file == None):
 			self.output_logger = init_logger("output", log_file=output_file)
 		else:
@@ -113,7 +178,7 @@ class MSRMasterProcess(MasterProcess):
 		(filtered,rest) = partition_goals_by_proc_id(self.init_goals, proc_id)
 		self.init_goals = rest
 		return MSRWorkerProcess(rank, proc_id, worker_channel, master_channel, filtered, self.rule_classes, file_logging=self.file_logging
-                                       ,output_logger=self.output_logger)
+                                       ,output_logger=self.output_logger, options=self.options)
 
 pause_times    = 5
 default_steps  = 1
@@ -121,35 +186,85 @@ backoff_factor = 2
 
 class MSRWorkerProcess(WorkerProcess):
 
-	def __init__(self, rank, proc_id, worker_channel, master_channel, init_goals, rule_classes, file_logging=False, output_logger=None):
+	def __init__(self, rank, proc_id, worker_channel, master_channel, init_goals, rule_classes, file_logging=False, output_logger=None, options=None):
 		self.initialize(rank, proc_id, worker_channel, master_channel, file_logging=file_logging)
 		self.init_goals   = init_goals
 		self.rule_classes = rule_classes
 		self.location = lift( loc(rank, proc_id) )
 		self.output_logger = output_logger
+		self.options = options
 
 	def routine(self):
 		log_info(self.logger,"Started")
 
 		rewrite_loop(self.rule_classes, self.init_goals, self.logger, lambda: self.get_msg, self.send_msgs, self.create_new_worker
-                            ,self.location, output_logger=self.output_logger)
+                            ,self.location, output_logger=self.output_logger, options=self.options)
 
 		log_info(self.logger,"Shutting Down")
 
 #################################
 
-def rewrite_loop(rule_classes, init_goals, logger, recv_msg_future_func, send_msgs_func, create_new_location_func, location, output_logger=None):
-	fact_stores = new_stores()
-	histories = new_histories()
-
+# Facts sent with send_msgs_func may be held back until flush_msgs_func is called, which the loop does whenever
+# it runs out of goals, before waiting for incoming facts. poll_msgs_func is called whenever the loop checks
+# for incoming facts, to complete outstanding sends.
+def rewrite_loop(rule_classes, init_goals, logger, recv_msg_future_func, send_msgs_func, create_new_location_func, location, output_logger=None
+                ,options=None, flush_msgs_func=None, poll_msgs_func=None):
+	if options == None:
+		options = runtime_options()
 	rules = map(lambda rule_class: rule_class(), rule_classes)
+	counted,uncounted = counted_sym_ids(rules)
+	for sym_id,reason in uncounted.items():
+		log_info(logger, "Counted predicate %s is stored uncounted: %s" % (get_fact_name(sym_id),reason))
+
+	never_stored = pred_class_sym_ids(options, PRED_NEVER_STORED)
+	fact_stores = new_stores(store_mode=options['store_mode'], sink_sym_ids=pred_class_sym_ids(options, PRED_OUTPUT_ONLY)
+                                ,counted_sym_ids=counted)
+	histories = new_histories(fact_stores)
+
 	if location != None:
 		for rule in rules:
 			rule.set_rank( loc_rank(location.value) )
-	interp_rules = interpret_rules(rules, fact_stores)
-
-	goals = HeapGoals()
-	matching_funcs = generate_matching_functions(goals, fact_stores, histories, interp_rules, logger, send_msgs_func, create_new_location_func, location=location)
+	interp_rules = interpret_rules(rules, fact_stores, never_stored=never_stored)
+
+	if options['explain']:
+		log_info(logger, "Explain:\n%s" % explain_interp_rules(fact_stores, interp_rules))
+
+	semi_naive_ids,not_semi_naive = semi_naive_rules(rules, fact_stores)
+	if options['explain'] or options['semi_naive']:
+		log_info(logger, "Semi-naive Evaluation:\n%s" % pretty_semi_naive_rules(semi_naive_ids, not_semi_naive))
+	if options['semi_naive'] and len(semi_naive_ids) > 0:
+		delta_rules = split_semi_naive_rules(interp_rules, semi_naive_ids)
+		assign_late_storage(interp_rules, never_stored=never_stored)
+		delta_sets  = DeltaSets(delta_sym_ids(rules, semi_naive_ids))
+	else:
+		delta_rules = {}
+		delta_sets  = None
+
+	goals = new_goals(options['goal_priorities'])
+	occ_funcs = generate_occurrence_functions(goals, fact_stores, histories, interp_rules, logger, send_msgs_func, create_new_location_func
+                                                 ,location=location, options=options)
+	delta_funcs = generate_occurrence_functions(goals, fact_stores, histories, delta_rules, logger, send_msgs_func, create_new_location_func
+                                                   ,location=location, options=options, delta_sets=delta_sets)
+	matching_funcs = generate_matching_functions(fact_stores, occ_funcs, interp_rules, never_stored=never_stored, delta_sets=delta_sets)
+	activation_batch = options['activation_batch']
+	if activation_batch > 1:
+		batch_funcs = generate_batch_functions(fact_stores, occ_funcs, interp_rules, never_stored=never_stored, delta_sets=delta_sets)
+	else:
+		batch_funcs = None
+
+	replan_interval = options['replan_interval']
+	def replan():
+		replanned = replan_rules(interp_rules, fact_stores, options['replan_threshold'])
+		for (sym_id,index) in replanned:
+			interp_rule = interp_rules[sym_id][index]
+			log_info(logger, "Re-planned Rule: %s # %s" % (get_all_rule_classes()[interp_rule['rule_id']].__name__,interp_rule['occ_id']))
+			occ_funcs[sym_id][index] = generate_matching_function(goals, fact_stores, histories, sym_id, interp_rule, logger, send_msgs_func
+                                                                             ,create_new_location_func, location=location, options=options)
+		if len(replanned) > 0:
+			dropped = drop_unused_indexes(fact_stores, [interp_rules, delta_rules])
+			if dropped > 0:
+				log_info(logger, "Dropped %s unused index(es) after re-planning" % dropped)
+	activations = 0
 
 	for goal in init_goals:
 		goals.push( make_fact_repr(goal) )
@@ -161,13 +276,17 @@ def rewrite_loop(rule_classes, init_goals, logger, recv_msg_future_func, send_ms
 
 	while not done:
 		current_steps = default_steps
+		if poll_msgs_func != None:
+			poll_msgs_func()
 		ext_fact_repr = recv_msg_func()
 
 		if ext_fact_repr != None:
+			received = []
 			while ext_fact_repr != None:
-				goals.push(ext_fact_repr)
+				received.append( fact_repr_from_msg(ext_fact_repr) )
 				recv_msg_func = recv_msg_future_func()
 				ext_fact_repr = recv_msg_func()
+			goals.push_many(received)
 			current_factor = backoff_factor
 		else:
 			current_steps  *= current_factor 
@@ -175,13 +294,32 @@ def rewrite_loop(rule_classes, init_goals, logger, recv_msg_future_func, send_ms
 
 		while current_steps > 0:
 			try:
-				act_fact_repr = goals.pop()
-				matching_funcs[act_fact_repr['sym_id']](act_fact_repr)
-				current_steps -= 1
+				if batch_funcs != None:
+					batch = goals.pop_batch(activation_batch, batch_funcs)
+					if len(batch) > 1:
+						batch_funcs[batch[0].sym_id](batch)
+					else:
+						matching_funcs[batch[0].sym_id](batch[0])
+					num_of_acts = len(batch)
+				else:
+					act_fact_repr = goals.pop()
+					matching_funcs[act_fact_repr.sym_id](act_fact_repr)
+					num_of_acts = 1
+				current_steps -= num_of_acts
+				if replan_interval > 0:
+					activations += num_of_acts
+					if activations >= replan_interval:
+						activations = 0
+						replan()
 			except IndexError:
+				if delta_sets != None and len(delta_sets) > 0:
+					run_semi_naive_round(delta_sets, delta_funcs)
+					continue
+				if flush_msgs_func != None:
+					flush_msgs_func()
 				ext_fact_repr = try_until(recv_msg_func, times=pause_times)
 				if ext_fact_repr != None:
-					goals.push(ext_fact_repr)
+					goals.push(fact_repr_from_msg(ext_fact_repr))
 					recv_msg_func = recv_msg_future_func()
 					current_factor = backoff_factor
 					current_steps  = 0
@@ -189,6 +327,18 @@ def rewrite_loop(rule_classes, init_goals, logger, recv_msg_future_func, send_ms
 					done = True
 					break
 
+	if options['analyze']:
+		log_info(logger, "Explain Analyze:\n%s" % explain_interp_rules(fact_stores, interp_rules, analyze=True))
+		if delta_sets != None:
+			log_info(logger, "Explain Analyze (Semi-naive):\n%s" % explain_interp_rules(fact_stores, delta_rules, analyze=True))
+
+	if delta_sets != None:
+		log_info(logger, "Semi-naive Rounds: %s" % delta_sets.rounds)
+
+	history_sizes = pretty_history_sizes(histories)
+	if len(history_sizes) > 0:
+		log_info(logger, "Propagation History Sizes:\n%s" % history_sizes)
+
 	log_info(logger,pretty_stores( fact_stores ))
 
 	if not (output_logger == None):
@@ -211,88 +361,212 @@ def try_until(func, times=6, sleep_time=0.3, sleep_factor=2):
 
 ##################################
 
-def generate_matching_functions(goals, fact_stores, histories, interp_rules, logger, send_goal_func, create_new_location_func, location=None):
-	matching_funcs = {}
+# Occurrence functions are kept in a list per predicate, which is strung up (by reference) into the 
+# matching function of the predicate, so that re-planned occurrences can be swapped in place.
+
+def generate_occurrence_functions(goals, fact_stores, histories, interp_rules, logger, send_goal_func, create_new_location_func, location=None
+                                 ,options=None, delta_sets=None):
+	occ_funcs = {}
 	for sym_id in interp_rules:
 		irules = interp_rules[sym_id]
-		matching_funcs[sym_id] = string_up_funcs(fact_stores, 
-                                                         map(lambda interp_rule: generate_matching_function(goals, fact_stores, histories, sym_id, 
-                                                                                                            interp_rule, logger, send_goal_func,
-                                                                                                            create_new_location_func, location=location)
-                                                            ,irules) )
+		occ_funcs[sym_id] = map(lambda interp_rule: generate_matching_function(goals, fact_stores, histories, sym_id, 
+                                                                                       interp_rule, logger, send_goal_func,
+                                                                                       create_new_location_func, location=location, options=options
+                                                                                      ,delta_sets=delta_sets)
+                                       ,irules)
+	return occ_funcs
+
+def generate_matching_functions(fact_stores, occ_funcs, interp_rules, never_stored=(), delta_sets=None):
+	matching_funcs = {}
+	for sym_id in occ_funcs:
+		if sym_id in never_stored:
+			matching_funcs[sym_id] = string_up_unstored_funcs(occ_funcs[sym_id])
+		else:
+			store_index = late_storage_index(interp_rules[sym_id])
+			if fact_stores[sym_id].has_filters:
+				matching_funcs[sym_id] = string_up_filtered_funcs(fact_stores, occ_funcs[sym_id], store_index)
+			else:
+				matching_funcs[sym_id] = string_up_funcs(fact_stores, occ_funcs[sym_id], store_index)
+			if delta_sets != None and sym_id in delta_sets.pending:
+				matching_funcs[sym_id] = string_up_delta_func(matching_funcs[sym_id], delta_sets)
 	return matching_funcs
 
-def string_up_funcs(fact_stores, funcs):
+# The active fact is added to the store before the occurrence at store_index (see late storage
+# in interpret/interpreter.py), and not at all if an earlier occurrence consumes it.
+def string_up_funcs(fact_stores, funcs, store_index):
 	def match_func(act_fact_repr):
-		proceed = True
+		for index in xrange(0,store_index):
+			if not funcs[index](act_fact_repr):
+				return
 		add_to_stores(fact_stores, act_fact_repr)
+		for index in xrange(store_index,len(funcs)):
+			if not funcs[index](act_fact_repr):
+				return
+	return match_func
+
+# Facts of predicates with insertion filters (set, min and max predicates) are dropped on activation, before 
+# any occurrence is tried on them, unless admitted by their store (see FactStore.admit in context/store.py).
+# Since the active fact is stored by the end of its activation (unless consumed), one of two duplicates in
+# the goals is always stored by the time the other one is activated.
+def string_up_filtered_funcs(fact_stores, funcs, store_index):
+	def match_func(act_fact_repr):
+		fact_store = fact_stores[act_fact_repr.sym_id]
+		if not fact_store.admit(act_fact_repr):
+			return
+		for index in xrange(0,store_index):
+			if not funcs[index](act_fact_repr):
+				return
+		fact_store.add_to_store(act_fact_repr)
+		for index in xrange(store_index,len(funcs)):
+			if not funcs[index](act_fact_repr):
+				return
+	return match_func
+
+# Batched activation: Goals of a predicate whose facts are stored before any of their occurrences is tried
+# (see late storage in interpret/interpreter.py), and whose store has no insertion filters, can be activated
+# as a batch. The batch is added to the store in bulk, then each fact of the batch that is still stored, i.e.,
+# not consumed as a partner in the activation of an earlier fact of the batch, is tried on the occurrences of 
+# its predicate. Rule instances that can be found from several facts of the batch are propagated once, by
+# their propagation history, as for any stored facts.
+
+def generate_batch_functions(fact_stores, occ_funcs, interp_rules, never_stored=(), delta_sets=None):
+	batch_funcs = {}
+	for sym_id in occ_funcs:
+		if sym_id not in never_stored and late_storage_index(interp_rules[sym_id]) == 0 and not fact_stores[sym_id].has_filters:
+			batch_funcs[sym_id] = string_up_batch_funcs(fact_stores[sym_id], occ_funcs[sym_id])
+			if delta_sets != None and sym_id in delta_sets.pending:
+				batch_funcs[sym_id] = string_up_delta_batch_func(batch_funcs[sym_id], delta_sets)
+	return batch_funcs
+
+def string_up_batch_funcs(fact_store, funcs):
+	def batch_func(act_fact_reprs):
+		fact_store.add_many_to_store(act_fact_reprs)
+		for act_fact_repr in act_fact_reprs:
+			if fact_store.is_stored(act_fact_repr):
+				for index in xrange(0,len(funcs)):
+					if not funcs[index](act_fact_repr):
+						break
+	return batch_func
+
+def string_up_delta_batch_func(batch_func, delta_sets):
+	def delta_batch_func(act_fact_reprs):
+		batch_func(act_fact_reprs)
+		for act_fact_repr in act_fact_reprs:
+			delta_sets.add(act_fact_repr)
+	return delta_batch_func
+
+# Facts of head predicates of semi-naive rules are added to the pending delta once stored (see interpret/semi_naive.py). 
+# Such facts are never consumed, so a fact without an id was dropped by the insertion filters of its store.
+def string_up_delta_func(match_func, delta_sets):
+	def delta_match_func(act_fact_repr):
+		match_func(act_fact_repr)
+		if act_fact_repr.fact_id != None:
+			delta_sets.add(act_fact_repr)
+	return delta_match_func
+
+# Facts of never-stored predicates are consumed by one of their occurrences, never added to the store
+def string_up_unstored_funcs(funcs):
+	def match_func(act_fact_repr):
 		for func in funcs:
-			proceed = func(act_fact_repr)
-			if not proceed:
-				break
-		# if proceed:
-		#	add_to_stores(fact_stores, act_fact_repr)
+			if not func(act_fact_repr):
+				return
 	return match_func
 
-def generate_matching_function(goals, fact_stores, histories, sym_id, interp_rule, logger, send_goal_func, create_new_location_func, location=None):
+# In analyze mode, the occurrence and each of its match steps are instrumented to collect the statistics
+# of the occurrence into interp_rule['stats'] (see explain_interp_rules in interpret/interpreter.py).
+# Otherwise in compiled matcher mode, the match steps are compiled into a generated matcher, which 
+# fires the rule with the closure built for the end of the match steps.
+# Occurrences of semi-naive rules (given delta_sets, see interpret/semi_naive.py) check their matches against 
+# the delta of the round instead of the propagation history, and apply the rule to all of them in one pass.
+
+def generate_matching_function(goals, fact_stores, histories, sym_id, interp_rule, logger, send_goal_func, create_new_location_func, location=None
+                              ,options=None, delta_sets=None):
+	if options == None:
+		options = runtime_options()
 
 	rule_id   = interp_rule['rule_id']
 
-	fact_pat  = interp_rule['entry']
-	term_pats = fact_pat['terms']
+	if delta_sets != None:
+		check_history = delta_sets.new_checker(interp_rule['history_order'], interp_rule['history_sym_ids'])
+	elif interp_rule['has_no_simplify']:
+		check_history = histories[rule_id].new_checker(interp_rule['history_order'], interp_rule['history_sym_ids'])
+	else:
+		check_history = None
+	exhaustive = delta_sets != None
+
+	if options['matcher_mode'] == MATCHER_COMPILED and not options['analyze']:
+		fire = generate_partner_matching_function(goals, rule_id, interp_rule['has_no_simplify'], fact_stores, check_history, [], interp_rule['exist_locs']
+                                                         ,interp_rule['has_exist_locs'], interp_rule['rhs'], logger, send_goal_func, create_new_location_func
+                                                         ,location=location, exhaustive=exhaustive)
+		return compile_matching_function(interp_rule, fact_stores, fire, location=location, dump_dir=options['matcher_dump_dir'])
+
+	if options['analyze']:
+		stats = new_analyze_stats(len(interp_rule['match_steps']))
+		interp_rule['stats'] = stats
+	else:
+		stats = None
+
+	env_init    = interp_rule['env']
+	entry_slots = interp_rule['entry_slots']
 
 	has_no_simplify = interp_rule['has_no_simplify']
 
-	match_partners = generate_partner_matching_function(goals, rule_id, has_no_simplify, fact_stores, histories, interp_rule['match_steps']
+	match_partners = generate_partner_matching_function(goals, rule_id, has_no_simplify, fact_stores, check_history, interp_rule['match_steps']
                                                            ,interp_rule['exist_locs'], interp_rule['has_exist_locs'], interp_rule['rhs']
-                                                           ,logger, send_goal_func, create_new_location_func, location=location)
+                                                           ,logger, send_goal_func, create_new_location_func, location=location, stats=stats
+                                                           ,exhaustive=exhaustive)
 
 	rule_name = "Rule: %s # %s" % (get_all_rule_classes()[interp_rule['rule_id']].__name__,interp_rule['occ_id'])
 
-	if location != None:
-		loc_pat = fact_pat['location']
-		def match_loc():
-			return match_terms_inplace([loc_pat], [location.value])
-		def unbind_loc():
-			loc_pat.unbind()
+	if location != None and interp_rule['entry_loc_slot'] != None:
+		loc_slots  = [ (0,) + interp_rule['entry_loc_slot'] ]
+		loc_values = [ location.value ]
+		def match_loc(env):
+			return match_slots_inplace(env, loc_slots, loc_values)
 	else:
-		def match_loc():
+		def match_loc(env):
 			return True
-		def unbind_loc():
-			pass
 
 	if interp_rule['propagated']:
 
 		def match_func(act_fact_repr):
 			# print rule_name
-			if match_terms_inplace(term_pats, act_fact_repr['values']) and match_loc():
+			env = list(env_init)
+			if match_slots_inplace(env, entry_slots, act_fact_repr.values) and match_loc(env):
 				matched = True
-				ids = [(act_fact_repr['sym_id'],act_fact_repr['fact_id']['id'])] 
+				ids = [(act_fact_repr.sym_id,act_fact_repr.fact_id)] 
 				while matched:
-					matched = match_partners(ids, [], [act_fact_repr])
-				# map(lambda t: t.unbind(),term_pats)
-				for t in term_pats:
-					t.unbind()
-				unbind_loc()
+					matched = match_partners(env, ids, [], [act_fact_repr])
 			return True
+	elif interp_rule['entry_stored']:
+		def match_func(act_fact_repr):
+			# print rule_name
+			env = list(env_init)
+			if match_slots_inplace(env, entry_slots, act_fact_repr.values) and match_loc(env):
+				ids = [(act_fact_repr.sym_id,act_fact_repr.fact_id)] 
+				done = match_partners(env, ids, [act_fact_repr], [])
+				return not done
+			else:
+				return True
 	else:
+		# Active fact not stored yet: Consumed without being deleted from the store
 		def match_func(act_fact_repr):
 			# print rule_name
-			if match_terms_inplace(term_pats, act_fact_repr['values']) and match_loc():
-				ids = [(act_fact_repr['sym_id'],act_fact_repr['fact_id']['id'])] 
-				done = match_partners(ids, [act_fact_repr], [])
-				# map(lambda t: t.unbind(),term_pats)
-				for t in term_pats:
-					t.unbind()
-				unbind_loc()
+			env = list(env_init)
+			if match_slots_inplace(env, entry_slots, act_fact_repr.values) and match_loc(env):
+				ids = [(act_fact_repr.sym_id,act_fact_repr.fact_id)] 
+				done = match_partners(env, ids, [], [])
 				return not done
 			else:
 				return True
-			
+
+	if stats != None:
+		return timed_func(match_func, stats)
 	return match_func
 
-def generate_partner_matching_function(goals, rule_id, has_no_simplify, fact_stores, histories, match_steps, exist_locs_func, has_exist_locs,
-                                       rhs, logger, send_goal_func, create_new_location_func, location=None):
+# In exhaustive mode, the rule is applied to every match that passes check_history, which is never found again.
+def generate_partner_matching_function(goals, rule_id, has_no_simplify, fact_stores, check_history, match_steps, exist_locs_func, has_exist_locs,
+                                       rhs, logger, send_goal_func, create_new_location_func, location=None, stats=None, exhaustive=False):
 	if len(match_steps) == 0:
 		if location != None:
 			if has_exist_locs:
@@ -305,7 +579,7 @@ def generate_partner_matching_function(goals, rule_id, has_no_simplify, fact_sto
 			else:
 				def spawn_new_locs():
 					pass
-			def exec_rhs():
+			def exec_rhs(env):
 				log_info(logger, "Applying rule %s" % rule_id)
 				# sys.stdout.write("Local: ")
 				# for goal in local_goals:
@@ -315,19 +589,31 @@ def generate_partner_matching_function(goals, rule_id, has_no_simplify, fact_sto
 				# 	sys.stdout.write("%s, " % goal)
 				# sys.stdout.write("\n\n")
 				# add_goals(goals, local_goals)
-				(local_goals,external_goals) = partition_goals_by_proc_id(rhs(), loc_proc_id(location.value))
+				(local_goals,external_goals) = partition_goals_by_proc_id(rhs(env), loc_proc_id(location.value))
 				spawn_new_locs()
 				log_info(logger, "Sending internal goals: %s" % map(make_fact_repr_loc,local_goals) )
 				log_info(logger, "Sending external goals: %s" % map(make_fact_repr_loc,external_goals) )
 				goals.push_many( map(make_fact_repr,local_goals) )
 				send_goal_func( map(make_fact_repr_loc,external_goals) )
 		else:
-			def exec_rhs():
-				goals.push_many(map(make_fact_repr,rhs()))
+			def exec_rhs(env):
+				goals.push_many(map(make_fact_repr,rhs(env)))
 				# add_goals(goals, rhs())
 
-		if not has_no_simplify:
-			def match_partners(ids, simplify, propagate):
+		if stats != None:
+			step_stats = stats['rhs']
+			fire_rhs = exec_rhs
+			def exec_rhs(env):
+				stats['firings'] += 1
+				fire_rhs(env)
+
+		if exhaustive:
+			def match_partners(env, ids, simplify, propagate):
+				if check_history(propagate):
+					exec_rhs(env)
+				return False
+		elif not has_no_simplify:
+			def match_partners(env, ids, simplify, propagate):
 				# print "Ids: %s" % ids
 				# print "Deleting: %s" % ','.join( map(pretty_fact_repr,simplify) )
 				for fact_pat in simplify:
@@ -335,24 +621,16 @@ def generate_partner_matching_function(goals, rule_id, has_no_simplify, fact_sto
 				# print "Adding: %s" % ','.join( map(str,rhs_goals) )
 				# add_goals(goals, rhs())
 				
-				exec_rhs()
+				exec_rhs(env)
 					
 				return True
 		else:
-			check_history = histories[rule_id].check_history
-			remove_history_entries = histories[rule_id].remove_history_entries
-			def match_partners(ids, simplify, propagate):
-				fact_ids = map(lambda can: can['fact_id'],propagate)
-				if check_history(fact_ids):
-					# print "Deleting: %s" % ','.join( map(pretty_fact_repr,simplify) )
-					# for fact_pat in simplify:
-					# 	del_from_stores(fact_stores, fact_pat)
+			def match_partners(env, ids, simplify, propagate):
+				if check_history(propagate):
 					# print "Adding: %s" % ','.join( map(str,rhs_goals) )
-					# for id in fact_ids:
-					#	remove_history_entries(id['history_entries'][rule_id])
 					# add_goals(goals, rhs())
 					
-					exec_rhs()
+					exec_rhs(env)
 
 					return True
 				else:
@@ -360,62 +638,104 @@ def generate_partner_matching_function(goals, rule_id, has_no_simplify, fact_sto
 	else:
 		curr_step  = match_steps[0] 
 		rest_steps = match_steps[1:]
-		rest_match_partners = generate_partner_matching_function(goals, rule_id, has_no_simplify, fact_stores, histories, rest_steps, exist_locs_func
-                                                                        ,has_exist_locs, rhs, logger, send_goal_func, create_new_location_func, location=location)
+		rest_match_partners = generate_partner_matching_function(goals, rule_id, has_no_simplify, fact_stores, check_history, rest_steps, exist_locs_func
+                                                                        ,has_exist_locs, rhs, logger, send_goal_func, create_new_location_func, location=location
+                                                                        ,stats=stats, exhaustive=exhaustive)
+		if stats != None:
+			step_stats = stats['steps'][len(stats['steps']) - len(match_steps)]
 		if curr_step['is_lookup']:
 			lookup_index = curr_step['lookup_index']
-			filter_func  = curr_step['filter']
 			fact_pat     = curr_step['fact_pat']
 			sym_id       = fact_pat['sym_id']
-			term_pats    = fact_pat['terms']
-			free_terms   = curr_step['free_terms']
-			get_candidates = get_candidate_lookup_func_from_stores(fact_stores, lookup_index, sym_id, term_pats)
+			key_slots    = curr_step['key_slots']
+			match_slots  = curr_step['match_slots']
+			range_lookup = curr_step['range']
+			if range_lookup != None:
+				lower = (range_lookup['lower_slot'],range_lookup['lower'][1]) if range_lookup['lower'] != None else None
+				upper = (range_lookup['upper_slot'],range_lookup['upper'][1]) if range_lookup['upper'] != None else None
+				get_candidates = get_range_lookup_func_from_stores(fact_stores, range_lookup['range_index'], sym_id, key_slots, lower, upper)
+			else:
+				get_candidates = get_candidate_lookup_func_from_stores(fact_stores, lookup_index, sym_id, key_slots)
+			if stats != None:
+				get_candidates = counted_candidates(get_candidates, step_stats)
 			if curr_step['propagated']:
-				def match_partners(ids, simplify, propagate):
-					#iter_cans = get_candidates_from_stores(fact_stores, lookup_index, sym_id, term_pats) 
-					iter_cans = get_candidates()
+				def match_partners(env, ids, simplify, propagate):
+					iter_cans = get_candidates(env)
 					while True:
 						curr_can = next(iter_cans,None)
 						if curr_can != None:
 							# print "trying %s" % str(curr_can)
-							curr_id = curr_can['fact_id']['id'] 
-							can_values = curr_can['values']
-							if (sym_id,curr_id) not in ids and filter_func(can_values) and match_terms_inplace(term_pats, can_values):
-								done = rest_match_partners(ids+[(sym_id,curr_id)], simplify, propagate+[curr_can])
-								for free_term in free_terms:
-									free_term.unbind()
+							curr_id = curr_can.fact_id
+							if (sym_id,curr_id) not in ids and match_slots_inplace(env, match_slots, curr_can.values):
+								done = rest_match_partners(env, ids+[(sym_id,curr_id)], simplify, propagate+[curr_can])
 								if done:
 									return True
 						else:
 							return False
 			else:
-				def match_partners(ids, simplify, propagate):
-					# iter_cans = get_candidates_from_stores(fact_stores, lookup_index, sym_id, term_pats) 
-					iter_cans = get_candidates()
+				def match_partners(env, ids, simplify, propagate):
+					iter_cans = get_candidates(env)
 					while True:
 						curr_can = next(iter_cans,None)
 						if curr_can != None:
 							# print "trying %s" % str(curr_can)
-							curr_id = curr_can['fact_id']['id'] 
-							can_values = curr_can['values']
+							curr_id = curr_can.fact_id
 							# sys.stdout.write("\n\n(%s,%s) not in %s\n\n" % (sym_id,curr_id,ids))
-							if (sym_id,curr_id) not in ids and filter_func(can_values) and match_terms_inplace(term_pats, can_values):
-								done = rest_match_partners(ids+[(sym_id,curr_id)], simplify+[curr_can], propagate)
-								for free_term in free_terms:
-									free_term.unbind()
+							if (sym_id,curr_id) not in ids and match_slots_inplace(env, match_slots, curr_can.values):
+								done = rest_match_partners(env, ids+[(sym_id,curr_id)], simplify+[curr_can], propagate)
 								if done:
 									return True
 						else:
 							return False
 		else:		
 			guard = curr_step['guard']
-			def match_partners(ids, simplify, propagate):
-				if guard():
-					return rest_match_partners(ids, simplify, propagate)
-				else:
-					return False
+			guard_slots = curr_step['guard_slots']
+			if len(guard_slots) == 2:
+				x,y = guard_slots
+				def match_partners(env, ids, simplify, propagate):
+					if guard(env[x], env[y]):
+						return rest_match_partners(env, ids, simplify, propagate)
+					else:
+						return False
+			else:
+				def match_partners(env, ids, simplify, propagate):
+					if guard(*[ env[slot] for slot in guard_slots ]):
+						return rest_match_partners(env, ids, simplify, propagate)
+					else:
+						return False
+	if stats != None:
+		return timed_func(match_partners, step_stats)
 	return match_partners
 
+# Instrumentation for analyze mode
+
+def timed_func(func, step_stats):
+	def instrumented_func(*args):
+		step_stats['calls'] += 1
+		start = time.time()
+		result = func(*args)
+		step_stats['time'] += time.time() - start
+		return result
+	return instrumented_func
+
+def counted_candidates(get_candidates, step_stats):
+	def instrumented_get_candidates(env):
+		for candidate in get_candidates(env):
+			step_stats['candidates'] += 1
+			yield candidate
+	return instrumented_get_candidates
+
+# Matching the argument values of a fact in the environment of a matching (see assign_slots in
+# interpret/interpreter.py): Each <match_slot> either binds its slot to the value of its argument
+# position, or checks the value against the slot.
+def match_slots_inplace(env, match_slots, values):
+	for (position,slot,binds) in match_slots:
+		if binds:
+			env[slot] = values[position]
+		elif env[slot] != values[position]:
+			return False
+	return True
+
 def match_term_inplace(term_pat, subj):
 	# if term_pat.is_duncare():
 	#	return True
@@ -0,0 +1,160 @@
+
+'''
+This file is part of MSR Ensemble for Python (MSRE-Py).
+
+MSRE-Py is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+MSRE-Py is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with MSRE-Py. If not, see <http://www.gnu.org/licenses/>.
+
+MSR Ensemble for Python (MSRE-Py) Version 0.9, Prototype Alpha
+
+Authors:
+Edmund S. L. Lam      sllam@qatar.cmu.edu
+Iliano Cervesato      iliano@cmu.edu
+
+* Development of MSRE-Py is funded by the Qatar National Research Fund as project NPRP 09-667-1-100 (Effective Programming for Large Distributed Ensembles)
+'''
+
+import sys
+
+from msr_ensemble.facts.fact import get_fact_name
+from msr_ensemble.rules.rule import get_all_rule_classes
+
+# Semi-naive evaluation: Rules with no simplified heads, none of whose heads can ever be deleted from
+# the store, are monotonic. Such rules (e.g., reachability, transitive closure) are evaluated in rounds, 
+# rather than by the occurrences of each active fact: The facts of their head predicates that are stored
+# since the previous round form the delta of the round. Each round joins the delta of each head with the
+# full store, through the hash index lookups of the occurrence of that head (see interpret/interpreter.py), 
+# and applies the rule to every match found, in one pass. A match is found at exactly one occurrence: 
+# The one of its first head whose fact is in the delta, so that earlier heads only match facts stored 
+# before the round. Thus rule instances need not be recorded in propagation histories. 
+#
+# A head can be deleted from the store if some rule simplifies its predicate, or if the predicate is a
+# min/max predicate (see FactStore.admit in context/store.py).
+
+# Rule ids of the rules that can be evaluated semi-naively, and the reason why each of the others cannot
+def semi_naive_rules(rules, fact_stores):
+	consumers = {}
+	for rule in rules:
+		for fact in rule.simplify():
+			if fact.sym_id not in consumers:
+				consumers[fact.sym_id] = rule.rule_id
+	rule_ids = set()
+	reasons  = {}
+	for rule in rules:
+		if len(rule.simplify()) > 0:
+			reasons[rule.rule_id] = "has simplified heads"
+			continue
+		reason = None
+		for fact in rule.propagate():
+			sym_id = fact.sym_id
+			if sym_id in consumers:
+				reason = "head %s is consumed by rule %s" % (get_fact_name(sym_id),rule_name(consumers[sym_id]))
+				break
+			elif fact_stores[sym_id].agg_index != None:
+				reason = "head %s is a min/max predicate" % get_fact_name(sym_id)
+				break
+		if reason == None:
+			rule_ids.add(rule.rule_id)
+		else:
+			reasons[rule.rule_id] = reason
+	return (rule_ids,reasons)
+
+def rule_name(rule_id):
+	return get_all_rule_classes()[rule_id].__name__
+
+def pretty_semi_naive_rules(rule_ids, reasons):
+	strs = []
+	for rule_id in sorted(list(rule_ids) + reasons.keys()):
+		if rule_id in rule_ids:
+			strs.append( "%s: semi-naive" % rule_name(rule_id) )
+		else:
+			strs.append( "%s: not semi-naive, %s" % (rule_name(rule_id),reasons[rule_id]) )
+	if len(reasons) == 0:
+		strs.append( "Rule set is eligible for semi-naive evaluation." )
+	else:
+		strs.append( "%s of %s rules are eligible for semi-naive evaluation." % (len(rule_ids),len(rule_ids) + len(reasons)) )
+	return '\n'.join(strs)
+
+# Removes the occurrences of the given rules from interp_rules, and returns them in the same form. The
+# late storage of interp_rules must be re-assigned after (see assign_late_storage in interpret/interpreter.py).
+def split_semi_naive_rules(interp_rules, rule_ids):
+	delta_rules = {}
+	for sym_id,irules in interp_rules.items():
+		delta_rules[sym_id] = filter(lambda interp_rule: interp_rule['rule_id'] in rule_ids, irules)
+		irules[:] = filter(lambda interp_rule: interp_rule['rule_id'] not in rule_ids, irules)
+	return delta_rules
+
+# Delta sets: The facts of each head predicate of the semi-naive rules that were stored since the previous 
+# round ('pending'), and during a round, the least fact id of the delta of the round of each predicate 
+# ('bounds'). Since fact ids grow in the order facts are stored, facts with smaller ids were stored before
+# the round. 
+
+class DeltaSets:
+
+	def __init__(self, sym_ids):
+		self.pending = dict([ (sym_id,[]) for sym_id in sym_ids ])
+		self.bounds  = dict([ (sym_id,sys.maxint) for sym_id in sym_ids ])
+		self.size   = 0
+		self.rounds = 0
+
+	def __len__(self):
+		return self.size
+
+	def add(self, fact_repr):
+		self.pending[fact_repr.sym_id].append( fact_repr )
+		self.size += 1
+
+	# Starts the next round: Returns its delta and resets the pending facts.
+	def next_round(self):
+		delta = self.pending
+		self.pending = dict([ (sym_id,[]) for sym_id in delta ])
+		for sym_id,fact_reprs in delta.items():
+			if len(fact_reprs) > 0:
+				self.bounds[sym_id] = min([ fact_repr.fact_id for fact_repr in fact_reprs ])
+			else:
+				self.bounds[sym_id] = sys.maxint
+		self.size = 0
+		self.rounds += 1
+		return delta
+
+	# Returns a function that, given the matched facts of a semi-naive rule occurrence (in match order), 
+	# returns True if none of the heads before the entry matched a fact of the delta of the round. 'order'
+	# lists the match positions of the facts of each head, in head order (see 'history_order' in 
+	# interpret/interpreter.py), the entry being at match position 0.
+	def new_checker(self, order, sym_ids):
+		bounds = self.bounds
+		entry_head = list(order).index(0)
+		earlier = [ (order[k],sym_ids[k]) for k in xrange(0,entry_head) ]
+		def check_delta(fact_reprs):
+			for (i,sym_id) in earlier:
+				if fact_reprs[i].fact_id >= bounds[sym_id]:
+					return False
+			return True
+		return check_delta
+
+# Runs a round of semi-naive evaluation: Each semi-naive occurrence is applied to the delta of its entry.
+def run_semi_naive_round(delta_sets, delta_funcs):
+	delta = delta_sets.next_round()
+	for sym_id,fact_reprs in delta.items():
+		for delta_func in delta_funcs[sym_id]:
+			for fact_repr in fact_reprs:
+				delta_func(fact_repr)
+
+# Predicates of the heads of the given semi-naive rules
+def delta_sym_ids(rules, rule_ids):
+	sym_ids = set()
+	for rule in rules:
+		if rule.rule_id in rule_ids:
+			for fact in rule.propagate():
+				sym_ids.add( fact.sym_id )
+	return sym_ids
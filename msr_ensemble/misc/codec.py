@@ -0,0 +1,118 @@
+
+'''
+This file is part of MSR Ensemble for Python (MSRE-Py).
+
+MSRE-Py is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+MSRE-Py is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with MSRE-Py. If not, see <http://www.gnu.org/licenses/>.
+
+MSR Ensemble for Python (MSRE-Py) Version 0.9, Prototype Alpha
+
+Authors:
+Edmund S. L. Lam      sllam@qatar.cmu.edu
+Iliano Cervesato      iliano@cmu.edu
+
+* Development of MSRE-Py is funded by the Qatar National Research Fund as project NPRP 09-667-1-100 (Effective Programming for Large Distributed Ensembles)
+'''
+
+import struct
+import marshal
+
+from json import dumps, loads
+
+# Wire codecs of the facts exchanged between MPI nodes. Facts are sent as dicts (see make_fact_repr_loc
+# in context/fact_repr.py), and in batches of facts addressed to the same rank (see AggregatingSender in
+# misc/mpi_process.py). Facts may carry a 'raw' entry, describing arguments that are sent apart from
+# the batch (see split_raw_values in misc/mpi_process.py). A codec encodes each fact on its own, and 
+# joins encoded facts into a batch:
+#   - encode_fact(fact)               : Encoding of a fact, as a string.
+#   - batch_size(num_of_facts, size)  : Size of the batch of num_of_facts encoded facts, of 'size' bytes in total.
+#   - encode_batch(enc_facts)         : Batch of a list of encoded facts, as a string.
+#   - decode_batch(data)              : List of the facts of a batch, from a string or a buffer.
+# Codec modes: CODEC_BINARY is the compact binary format below, CODEC_JSON a JSON list of fact dicts,
+# for debugging. benchmarks/bench_codec.py compares the two.
+CODEC_BINARY = 'binary'
+CODEC_JSON   = 'json'
+
+def new_codec(codec_mode=CODEC_BINARY):
+	if codec_mode == CODEC_JSON:
+		return JsonCodec()
+	return BinaryCodec()
+
+class JsonCodec:
+
+	def encode_fact(self, fact):
+		return dumps(fact)
+
+	def batch_size(self, num_of_facts, size):
+		return size + max(num_of_facts-1,0) + 2
+
+	def encode_batch(self, enc_facts):
+		return "[%s]" % ",".join(enc_facts)
+
+	def decode_batch(self, data):
+		return loads(str(data))
+
+# Binary codec
+# A batch is its number of facts, followed by the facts. A fact is a struct header of its sym_id,
+# priority, destination rank, length of its proc_id, flags and length of its values, followed by its
+# proc_id and values. Values are encoded with marshal, the typed binary encoding of the interpreter (of
+# ints, floats, strings, lists, tuples, etc.), which is implemented in C. Locations are sent as the 
+# unicode strings they are (see facts/location.py). Unlike JSON, tuples are decoded as tuples and byte 
+# strings as byte strings, as they were sent. Marshal formats may differ between Python versions, so
+# all MPI nodes must run the same one. Numbers in headers are in network byte order.
+# Flags: With FACT_HAS_RAW, the encoded values of the fact are a tuple of its values and a raw entry.
+# The flag tells them apart from values that are themselves a tuple.
+
+BATCH_HEADER = struct.Struct('!I')
+FACT_HEADER  = struct.Struct('!iiiHBI')
+
+FACT_HAS_RAW = 0x1
+
+class BinaryCodec:
+
+	def encode_fact(self, fact):
+		proc_id = str(fact['proc_id'])
+		if 'raw' in fact:
+			values = marshal.dumps( (fact['values'],fact['raw']) )
+			flags  = FACT_HAS_RAW
+		else:
+			values = marshal.dumps(fact['values'])
+			flags  = 0
+		return FACT_HEADER.pack(fact['sym_id'], fact['prior'], fact['rank'], len(proc_id), flags, len(values)) + proc_id + values
+
+	def batch_size(self, num_of_facts, size):
+		return size + BATCH_HEADER.size
+
+	def encode_batch(self, enc_facts):
+		return BATCH_HEADER.pack(len(enc_facts)) + "".join(enc_facts)
+
+	def decode_batch(self, data):
+		(num_of_facts,) = BATCH_HEADER.unpack_from(data, 0)
+		offset = BATCH_HEADER.size
+		header_size = FACT_HEADER.size
+		unpack_header = FACT_HEADER.unpack_from
+		loads_values  = marshal.loads
+		facts = []
+		for _ in xrange(num_of_facts):
+			(sym_id,prior,rank,proc_id_len,flags,values_len) = unpack_header(data, offset)
+			offset += header_size
+			proc_id = data[offset:offset+proc_id_len]
+			offset += proc_id_len
+			values = loads_values(data[offset:offset+values_len])
+			offset += values_len
+			if flags & FACT_HAS_RAW:
+				(values,raw) = values
+				facts.append( { 'prior':prior, 'sym_id':sym_id, 'values':values, 'rank':rank, 'proc_id':proc_id, 'raw':raw } )
+			else:
+				facts.append( { 'prior':prior, 'sym_id':sym_id, 'values':values, 'rank':rank, 'proc_id':proc_id } )
+		return facts
@@ -31,8 +31,9 @@ import time
 from uuid import uuid4
 
 from array import array
+from collections import deque
 from mpi4py import MPI
-from json import dumps, loads
+from msr_ensemble.misc.codec import CODEC_BINARY, new_codec
 
 from multiprocessing import Process, Queue
 
@@ -53,31 +54,245 @@ from msr_ensemble.misc.msr_logging import init_logger, get_logger, log_debug, lo
 # they are not thread safe! Only one process should ever be access them.
 
 FACT_TAG    = 10
-#BUFFER_SIZE = '\0'*128
-BUFFER_SIZE = '\0'*512
+RAW_TAG     = 11
+INIT_BUFFER_SIZE = 512
 
 comm = MPI.COMM_WORLD
 
-def send_facts(facts):
+# Facts travel between MPI nodes in batches: each message is a list of facts, all addressed to the 
+# same rank, encoded by a wire codec (see misc/codec.py). A batch holds at most MAX_BATCH_BYTES bytes, 
+# unless it consists of a single fact that is larger. Receivers size their buffer to each message 
+# (see FactReceiver). All MPI nodes must use the same codec.
+
+MAX_BATCH_BYTES = 64*1024
+
+# Raw values: Fact arguments that are numeric arrays (array.array, of a type code in RAW_TYPECODES) are
+# not encoded. Their buffers are sent as they are, each in a RAW_TAG message that follows the batch of
+# their fact, and received straight into an array of the same type code and length. In the batch, such
+# an argument is None, and the fact has a 'raw' entry of (argument index, type code, length) for each
+# of its raw values. Raw values must not be modified after they are sent. The sequence functions of
+# python/lib.py keep arrays as arrays, so that ensembles which start out with arrays send them raw.
+
+RAW_TYPECODES = 'bBhHiIlLfd'
+
+# Returns the fact, with its raw values taken out, and the list of its raw values
+def split_raw_values(fact):
+	values = fact['values']
+	raw_indices = [ i for i,value in enumerate(values) if type(value) == array and value.typecode in RAW_TYPECODES ]
+	if len(raw_indices) == 0:
+		return (fact, [])
+	raw_values = [ values[i] for i in raw_indices ]
+	values = list(values)
+	for i in raw_indices:
+		values[i] = None
+	fact = dict(fact)
+	fact['values'] = values
+	fact['raw'] = [ (i,raw_value.typecode,len(raw_value)) for i,raw_value in zip(raw_indices,raw_values) ]
+	return (fact, raw_values)
+
+def send_facts(facts, codec=None):
 	for fact in facts:
-		send_fact(fact)
-
-def send_fact(fact):
-	req = comm.Isend([dumps(fact),MPI.CHAR], dest=fact['rank'], tag=FACT_TAG)
-	req.wait()
+		send_fact(fact, codec=codec)
+
+# Send a fact on its own to the MPI node it is addressed to, and wait for the send to complete
+def send_fact(fact, codec=None):
+	if codec == None:
+		codec = new_codec()
+	(fact,raw_values) = split_raw_values(fact)
+	reqs = [ comm.Isend([codec.encode_batch([codec.encode_fact(fact)]),MPI.CHAR], dest=fact['rank'], tag=FACT_TAG) ]
+	for raw_value in raw_values:
+		reqs.append( comm.Isend([raw_value,MPI.BYTE], dest=fact['rank'], tag=RAW_TAG) )
+	MPI.Request.Waitall(reqs)
+
+# Send Pool
+# Sends messages without waiting for them to complete. The request and buffer of each send are kept
+# until poll finds the send completed. Once max_pending sends are outstanding, a new send stalls until
+# some complete. While stalled, the pool keeps receiving into the given FactReceiver, so that two 
+# MPI nodes sending to each other cannot stall each other. The raw values of a batch are sent along
+# with it, never after a stall, as the receiver of the batch blocks until they arrive. wait blocks 
+# until all sends complete.
+class SendPool:
+
+	def __init__(self, max_pending=256, receiver=None):
+		self.max_pending = max_pending
+		self.receiver = receiver
+		self.reqs = []
+		self.bufs = []
+		self.num_of_stalls = 0
+
+	def isend(self, rank, data, raw_values=()):
+		if len(self.reqs) >= self.max_pending:
+			self.poll()
+			if len(self.reqs) >= self.max_pending:
+				self.num_of_stalls += 1
+				while len(self.reqs) >= self.max_pending:
+					if self.receiver != None:
+						self.receiver.receive()
+					self.poll()
+		self.reqs.append( comm.Isend([data,MPI.CHAR], dest=rank, tag=FACT_TAG) )
+		self.bufs.append( data )
+		for raw_value in raw_values:
+			self.reqs.append( comm.Isend([raw_value,MPI.BYTE], dest=rank, tag=RAW_TAG) )
+			self.bufs.append( raw_value )
+
+	# Drop the requests (and buffers) of completed sends
+	def poll(self):
+		if len(self.reqs) > 0 and MPI.Request.Testsome(self.reqs) != None:
+			reqs = []
+			bufs = []
+			for req,buf in zip(self.reqs,self.bufs):
+				if req != MPI.REQUEST_NULL:
+					reqs.append( req )
+					bufs.append( buf )
+			self.reqs = reqs
+			self.bufs = bufs
+
+	def wait(self):
+		MPI.Request.Waitall(self.reqs)
+		self.reqs = []
+		self.bufs = []
+
+	def __len__(self):
+		return len(self.reqs)
+
+# Aggregating Sender
+# Groups outgoing facts by the rank they are addressed to. The batch of a rank is sent when it
+# reaches max_facts facts, when adding a fact would take it over max_bytes, or when flush is called
+# (by the rewrite loop, when it goes idle). max_facts of 1 sends every fact on its own. Batches are 
+# sent through a send pool: poll should be called regularly, and wait before shutting down.
+class AggregatingSender:
+
+	def __init__(self, max_facts=64, max_bytes=MAX_BATCH_BYTES, max_pending=256, receiver=None, codec=None):
+		if codec == None:
+			codec = new_codec()
+		self.codec     = codec
+		self.max_facts = max_facts
+		self.max_bytes = max_bytes
+		self.pool      = SendPool(max_pending=max_pending, receiver=receiver)
+		self.batches   = {}
+		self.sizes     = {}
+		self.raw_values = {}
+		self.num_of_msgs  = 0
+		self.num_of_facts = 0
+		self.num_of_raw_values = 0
+
+	def send(self, facts):
+		batches = self.batches
+		sizes   = self.sizes
+		codec   = self.codec
+		for fact in facts:
+			rank = fact['rank']
+			(fact,raw_values) = split_raw_values(fact)
+			enc_fact = codec.encode_fact(fact)
+			if rank not in batches:
+				batches[rank] = []
+				sizes[rank] = 0
+				self.raw_values[rank] = []
+			elif codec.batch_size(len(batches[rank])+1, sizes[rank]+len(enc_fact)) > self.max_bytes:
+				self.flush_rank(rank)
+			batches[rank].append( enc_fact )
+			sizes[rank] += len(enc_fact)
+			self.raw_values[rank] += raw_values
+			if len(batches[rank]) >= self.max_facts:
+				self.flush_rank(rank)
+
+	def flush_rank(self, rank):
+		batch = self.batches[rank]
+		if len(batch) > 0:
+			raw_values = self.raw_values[rank]
+			self.pool.isend(rank, self.codec.encode_batch(batch), raw_values)
+			self.num_of_msgs  += 1
+			self.num_of_facts += len(batch)
+			self.num_of_raw_values += len(raw_values)
+		self.batches[rank] = []
+		self.sizes[rank]   = 0
+		self.raw_values[rank] = []
+
+	def flush(self):
+		for rank in self.batches:
+			self.flush_rank(rank)
+
+	def poll(self):
+		self.pool.poll()
+
+	def wait(self):
+		self.flush()
+		self.pool.wait()
+
+	def pretty_stats(self):
+		return "%s facts sent in %s messages, %s raw values, %s stalls on pending sends" % (self.num_of_facts,self.num_of_msgs,self.num_of_raw_values
+                                                                                                  ,self.pool.num_of_stalls)
+
+# Fact Receiver
+# Receives batches of facts into a pending queue, and returns them one at a time. Futures share the
+# queue, so they may be dropped after they return a fact. Incoming messages are found with a matched
+# probe, which gives their size, and received into a single buffer that grows (by doubling) to fit.
+# The raw values of a batch are then received from its sender, and put back into their facts.
+class FactReceiver:
+
+	def __init__(self, init_buffer_size=INIT_BUFFER_SIZE, codec=None):
+		if codec == None:
+			codec = new_codec()
+		self.codec   = codec
+		self.pending = deque()
+		self.buf     = bytearray(init_buffer_size)
+		self.status  = MPI.Status()
+
+	def poll(self):
+		pending = self.pending
+		if len(pending) == 0:
+			self.receive()
+		if len(pending) > 0:
+			return pending.popleft()
+		return None
+
+	# Add the facts of a received batch to the pending queue, if a batch has arrived.
+	# A probe that misses only then progresses incoming transfers, so a message that has just arrived
+	# is matched by a second probe, rather than by the next poll, which may be long after.
+	def receive(self):
+		msg = comm.Improbe(source=MPI.ANY_SOURCE, tag=FACT_TAG, status=self.status)
+		if msg == None:
+			msg = comm.Improbe(source=MPI.ANY_SOURCE, tag=FACT_TAG, status=self.status)
+		if msg == None:
+			return False
+		n = self.status.Get_count(MPI.CHAR)
+		if n > len(self.buf):
+			size = len(self.buf)
+			while size < n:
+				size *= 2
+			self.buf = bytearray(size)
+		msg.Recv([self.buf,n,MPI.CHAR])
+		facts = self.codec.decode_batch(buffer(self.buf,0,n))
+		source = self.status.Get_source()
+		for fact in facts:
+			if 'raw' in fact:
+				self.receive_raw_values(fact, source)
+		self.pending.extend( facts )
+		return True
+
+	def receive_raw_values(self, fact, source):
+		values = fact['values']
+		for (index,typecode,length) in fact.pop('raw'):
+			raw_value = array(str(typecode), [0]) * length
+			comm.Recv([raw_value,MPI.BYTE], source=source, tag=RAW_TAG)
+			values[index] = raw_value
+
+	def future(self):
+		return self.poll
 
 def receive_fact_future_mpi():
-	buf = array('c',BUFFER_SIZE)
-	req = comm.Irecv([buf,MPI.CHAR], source=MPI.ANY_SOURCE, tag=FACT_TAG)
-	status = MPI.Status()
-	def future():
-		(received,_) = req.test(status)
-		if received:
-			n = status.Get_count(MPI.CHAR)
-			return loads(buf[:n].tostring())
-		else:
-			return None
-	return future
+	return default_receiver().future()
+
+fact_receiver = None
+
+# The receiver of receive_fact_future_mpi. If a codec is given, it replaces the codec of the receiver.
+def default_receiver(codec=None):
+	global fact_receiver
+	if fact_receiver == None:
+		fact_receiver = FactReceiver(codec=codec)
+	elif codec != None:
+		fact_receiver.codec = codec
+	return fact_receiver
 
 # Auxiliary Functions
 
@@ -111,7 +326,11 @@ class MasterProcess:
 	#   - sleep_length: Base length of each sleep cycle
         #   - sleep_factor: Base multiplier of each sleep cycle
         #   - sleep_limit: Number of consecutive sleeps before sleep length saturates 
-	def initialize(self, rank, sleep_length=0.1, sleep_factor=2, sleep_limit=4, init_workers=1, file_logging=False):
+	#   - send_batch: Maximum number of facts sent to another MPI node in one message (see AggregatingSender)
+	#   - max_pending_sends: Maximum number of outstanding sends to other MPI nodes (see SendPool)
+	#   - codec_mode: Wire codec of the facts sent to other MPI nodes (see misc/codec.py)
+	def initialize(self, rank, sleep_length=0.1, sleep_factor=2, sleep_limit=4, init_workers=1, file_logging=False, send_batch=1
+                      ,max_pending_sends=256, codec_mode=CODEC_BINARY):
 		
 		self.rank = rank
 		self.master_channel  = Queue()
@@ -127,6 +346,8 @@ class MasterProcess:
 
 		self.init_workers = init_workers
 		self.file_logging = file_logging
+		codec = new_codec(codec_mode)
+		self.sender = AggregatingSender(max_facts=send_batch, max_pending=max_pending_sends, receiver=default_receiver(codec), codec=codec)
 
 		if file_logging:
 			master_log_file = "master_%s.log" % rank
@@ -181,11 +402,13 @@ class MasterProcess:
 	#    - Does an asynchronous read from MPI interface for any message and forwards it to the addressed worker
 	#    - Reads from request queue (master_channel) and process either a message delivery request, or worker creation
 	#      request.
+	# Outgoing messages to other MPI nodes are batched, and flushed whenever a cycle has nothing to do.
 	# Loop continues, until liveness condition is no more (see is_alive method for details)
 	def start(self):
 		log_info(self.logger, "Started")
 		master_channel  = self.master_channel
 		worker_channels = self.worker_channels
+		sender = self.sender
 
 		self.create_new_worker(str(self.rank))
 		for _ in range(0,self.init_workers-1):
@@ -207,7 +430,7 @@ class MasterProcess:
 							worker_channels[data['proc_id']].put( data )
 						else:
 							log_info(self.logger, "External message, sending to MPI rank %s" % data['rank'])
-							send_fact( data )
+							sender.send( [data] )
 				elif task_type == CREATE_WORKER:
 					proc_id = int_msg['proc_id']
 					log_info(self.logger, "Creating worker %s" % proc_id)
@@ -224,6 +447,7 @@ class MasterProcess:
 					del self.worker_procs[proc_id]
 				done_something = True
 	
+			sender.poll()
 			mpi_msg = recv_future()
 			
 			if mpi_msg != None:
@@ -235,7 +459,10 @@ class MasterProcess:
 				done_something = False
 				self.reset_sleep()
 			else:
+				sender.flush()
 				self.sleep()
+		sender.wait()
+		log_info(self.logger,"Sent: %s" % sender.pretty_stats())
 		log_info(self.logger,"Shutting Down")
 
 	# Returns a new worker process. This method is to be overwritten 
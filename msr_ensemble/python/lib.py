@@ -24,6 +24,15 @@ Iliano Cervesato      iliano@cmu.edu
 * Development of MSRE-Py is funded by the Qatar National Research Fund as project NPRP 09-667-1-100 (Effective Programming for Large Distributed Ensembles)
 '''
 
+from array import array
+from random import Random
+
+# Sequences are lists or numeric arrays (array.array). Functions that build a sequence build one of
+# the same kind as their (first) argument, so arrays stay arrays, and are sent between MPI nodes as
+# raw values (see split_raw_values in misc/mpi_process.py).
+
+def empty_like(a):
+	return array(a.typecode) if type(a) == array else []
 
 def take(a,i):
 	return a[:i]
@@ -44,8 +53,8 @@ def median(a):
 	return a[len(a)/2]
 
 def partition(a,m):
-	l = []
-	g = []
+	l = empty_like(a)
+	g = empty_like(a)
 	for i in a:
 		if i <= m:
 			l.append(i)
@@ -56,13 +65,13 @@ def partition(a,m):
 def merge(a,b):
 	a_i = 0
 	b_i = 0
-	c = []
+	c = empty_like(a)
 	while True:
 		if a_i >= len(a):
-			c += b[b_i:]
+			c.extend(b[b_i:])
 			break
 		if b_i >= len(b):
-			c += a[a_i:]
+			c.extend(a[a_i:])
 			break
 		if a[a_i] < b[b_i]:
 			c.append(a[a_i])
@@ -73,6 +82,8 @@ def merge(a,b):
 	return c
 
 def sort(a):
+	if type(a) == array:
+		return array(a.typecode, sorted(a))
 	return sorted(a)
 
 def retrieve_mwoe(es):
@@ -89,5 +100,9 @@ def combine_out_edges(es1,es2):
 	for i,o,w in es1 + es2:
  		if o not in map(lambda e: e[0],es1 + es2):
 			es3.append( [i,o,w] )
-	return es3 
+	return es3
 
+# Pseudo-random array('l') of n integers in [0,bound), the same for the same seed
+def random_ints(n, seed, bound=1000000):
+	rand = Random(seed)
+	return array('l', [ rand.randrange(bound) for i in xrange(0,n) ])
@@ -88,6 +88,17 @@ class Rule:
 	def consequents(self):
 		return []
 
+	# Consequents of the rule for the given environment, i.e., the values of the rule variables
+	# in the order of get_vars(), possibly followed by other values (see assign_slots in
+	# interpret/interpreter.py). Rule classes that only define
+	# consequents (i.e., over the values binded to their variables) are given the environment
+	# by assigning the values to their variables.
+	def consequents_env(self, env):
+		variables = self.variables
+		for i in xrange(0,len(variables)):
+			variables[i].value = env[i]
+		return self.consequents()
+
 
 """
 class ColorRule1(Rule):
@@ -0,0 +1,101 @@
+
+'''
+This file is part of MSR Ensemble for Python (MSRE-Py).
+
+MSRE-Py is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+MSRE-Py is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with MSRE-Py. If not, see <http://www.gnu.org/licenses/>.
+
+MSR Ensemble for Python (MSRE-Py) Version 0.9, Prototype Alpha
+
+Authors:
+Edmund S. L. Lam      sllam@qatar.cmu.edu
+Iliano Cervesato      iliano@cmu.edu
+
+* Development of MSRE-Py is funded by the Qatar National Research Fund as project NPRP 09-667-1-100 (Effective Programming for Large Distributed Ensembles)
+'''
+
+# Wire codec tests: Batches of facts decode to the facts they were encoded from, with the JSON and
+# binary codecs (see misc/codec.py), from strings and from buffers as FactReceiver decodes them.
+#
+# Usage: python -m unittest discover -s tests -p 'test_*.py'
+
+import unittest
+
+from msr_ensemble.misc.codec import CODEC_JSON, CODEC_BINARY, new_codec
+
+UUID = 'a619a3ab-364f-4df7-8eca-fe318717a3b9'
+
+def mk_fact(sym_id, values, prior=0, rank=1):
+	return { 'prior':prior, 'sym_id':sym_id, 'values':values, 'rank':rank, 'proc_id':str(rank) }
+
+FACTS = [ mk_fact(0, [])
+        , mk_fact(1, [u'0::0', 42, -7, 3.25], prior=-3)
+        , mk_fact(2, [u'2::2', [1, 54, 32, 12], UUID], rank=2)
+        , mk_fact(3, [u'1::1', [[1, 2, 3], [2, 3, 1]], u'caf\xe9', None, True])
+        , mk_fact(4, [u'3::3', range(100000)]) ]
+
+def round_trip(codec, facts, as_buffer=False):
+	data = codec.encode_batch(map(codec.encode_fact, facts))
+	if as_buffer:
+		padded = bytearray(data + '\0' * 13)
+		data = buffer(padded, 0, len(data))
+	return codec.decode_batch(data)
+
+class CodecTests:
+
+	def test_round_trip(self):
+		self.assertEqual(round_trip(self.codec, FACTS), FACTS)
+
+	def test_round_trip_buffer(self):
+		self.assertEqual(round_trip(self.codec, FACTS, as_buffer=True), FACTS)
+
+	def test_empty_batch(self):
+		self.assertEqual(round_trip(self.codec, []), [])
+
+	def test_batch_size(self):
+		enc_facts = map(self.codec.encode_fact, FACTS)
+		size = self.codec.batch_size(len(enc_facts), sum(map(len, enc_facts)))
+		self.assertEqual(size, len(self.codec.encode_batch(enc_facts)))
+
+	def test_raw_entry(self):
+		fact = mk_fact(5, [u'0::0', None, 7])
+		fact['raw'] = [(1, 'l', 100000)]
+		(decoded,) = round_trip(self.codec, [fact])
+		self.assertEqual(decoded['values'], fact['values'])
+		self.assertEqual(map(tuple, decoded['raw']), fact['raw'])
+
+class JsonCodecTest(CodecTests, unittest.TestCase):
+
+	def setUp(self):
+		self.codec = new_codec(CODEC_JSON)
+
+class BinaryCodecTest(CodecTests, unittest.TestCase):
+
+	def setUp(self):
+		self.codec = new_codec(CODEC_BINARY)
+
+	# Unlike JSON, marshal keeps tuples and byte strings as they were sent
+	def test_value_types(self):
+		fact = mk_fact(6, [u'0::0', (1, 'b', 2.5), 'bytes', 2**40])
+		(decoded,) = round_trip(self.codec, [fact])
+		self.assertEqual(map(type, decoded['values']), map(type, fact['values']))
+		self.assertEqual(decoded['values'], fact['values'])
+
+	# Values that are a tuple are not mistaken for values with a raw entry
+	def test_tuple_values(self):
+		facts = [ mk_fact(7, (1, 2)), mk_fact(7, ((u'0::0', [1, 2]), None)) ]
+		self.assertEqual(round_trip(self.codec, facts), facts)
+		self.assertTrue(all(map(lambda fact: 'raw' not in fact, round_trip(self.codec, facts))))
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,114 @@
+
+'''
+This file is part of MSR Ensemble for Python (MSRE-Py).
+
+MSRE-Py is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+MSRE-Py is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with MSRE-Py. If not, see <http://www.gnu.org/licenses/>.
+
+MSR Ensemble for Python (MSRE-Py) Version 0.9, Prototype Alpha
+
+Authors:
+Edmund S. L. Lam      sllam@qatar.cmu.edu
+Iliano Cervesato      iliano@cmu.edu
+
+* Development of MSRE-Py is funded by the Qatar National Research Fund as project NPRP 09-667-1-100 (Effective Programming for Large Distributed Ensembles)
+'''
+
+# Goal queue tests: Goals are popped lowest priority first, and goals of equal priority in the order 
+# they were pushed (see context/goals.py). Bucketed goals do so for priorities beyond their buckets too.
+#
+# Usage: python -m unittest discover -s tests -p 'test_*.py'
+
+import unittest
+
+from msr_ensemble.context.goals import HeapGoals, BucketGoals, new_goals as new_goal_queue
+from msr_ensemble.context.fact_repr import FactRepr
+
+# New goals of the given priorities, told apart by their values
+def new_goals(priors):
+	return [ FactRepr(priors[i], 0, (i,)) for i in xrange(0,len(priors)) ]
+
+def pop_all(goals):
+	popped = []
+	while len(goals) > 0:
+		fact = goals.pop()
+		popped.append( (fact.prior,fact.values[0]) )
+	return popped
+
+class HeapGoalsTest(unittest.TestCase):
+
+	new_queue = HeapGoals
+
+	def test_priorities(self):
+		goals = self.new_queue()
+		for fact in new_goals([3, 1, 2, 0]):
+			goals.push(fact)
+		self.assertEqual(pop_all(goals), [(0,3), (1,1), (2,2), (3,0)])
+
+	def test_fifo_ties(self):
+		goals = self.new_queue()
+		for fact in new_goals([1, 0, 1, 0, 1, 0]):
+			goals.push(fact)
+		self.assertEqual(pop_all(goals), [(0,1), (0,3), (0,5), (1,0), (1,2), (1,4)])
+
+	# Batches larger than the queue are heapified in bulk, smaller ones pushed fact by fact
+	def test_fifo_ties_many(self):
+		for num_of_pushed in [0, 2, 20]:
+			goals = self.new_queue()
+			facts = new_goals([0, 1] * 10)
+			for fact in facts[:num_of_pushed]:
+				goals.push(fact)
+			goals.push_many(facts[num_of_pushed:])
+			self.assertEqual(pop_all(goals), [ (0,i) for i in xrange(0,20,2) ] + [ (1,i) for i in xrange(1,20,2) ])
+
+	def test_empty(self):
+		goals = self.new_queue()
+		self.assertRaises(IndexError, goals.pop)
+		goals.push_many([])
+		self.assertEqual(len(goals), 0)
+
+class BucketGoalsTest(HeapGoalsTest):
+
+	new_queue = staticmethod(lambda: BucketGoals(3))
+
+	# Priorities beyond the buckets, or negative, are kept in the overflow heap, in order with the buckets
+	def test_overflow(self):
+		goals = self.new_queue()
+		for fact in new_goals([5, 2, -1, 3, 4, 0, 5, -1, 2]):
+			goals.push(fact)
+		self.assertEqual(len(goals.overflow), 5)
+		self.assertEqual(pop_all(goals), [(-1,2), (-1,7), (0,5), (2,1), (2,8), (3,3), (4,4), (5,0), (5,6)])
+
+	def test_overflow_interleaved(self):
+		goals = self.new_queue()
+		goals.push_many(new_goals([1, 7, 3]))
+		self.assertEqual(goals.pop().values, (0,))
+		goals.push_many(new_goals([-2, 2]))
+		self.assertEqual(pop_all(goals), [(-2,0), (2,1), (3,2), (7,1)])
+		self.assertEqual(len(goals), 0)
+
+	# Non-integer priorities are kept in the overflow heap as well
+	def test_non_int_overflow(self):
+		goals = self.new_queue()
+		goals.push_many(new_goals([2, 1.5, 1]))
+		self.assertEqual(pop_all(goals), [(1,2), (1.5,1), (2,0)])
+
+	def test_queue_choice(self):
+		self.assertTrue(isinstance(new_goal_queue([0, 2]), BucketGoals))
+		self.assertEqual(new_goal_queue([0, 2]).max_prior, 2)
+		self.assertTrue(isinstance(new_goal_queue([0, 1000]), HeapGoals))
+		self.assertTrue(isinstance(new_goal_queue([-1, 0]), HeapGoals))
+		self.assertTrue(isinstance(new_goal_queue(None), HeapGoals))
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,241 @@
+
+'''
+This file is part of MSR Ensemble for Python (MSRE-Py).
+
+MSRE-Py is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+MSRE-Py is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with MSRE-Py. If not, see <http://www.gnu.org/licenses/>.
+
+MSR Ensemble for Python (MSRE-Py) Version 0.9, Prototype Alpha
+
+Authors:
+Edmund S. L. Lam      sllam@qatar.cmu.edu
+Iliano Cervesato      iliano@cmu.edu
+
+* Development of MSRE-Py is funded by the Qatar National Research Fund as project NPRP 09-667-1-100 (Effective Programming for Large Distributed Ensembles)
+'''
+
+# Runtime option tests: Example ensembles rewrite to the same final stores with each runtime option as
+# without it, and predicate modifiers hold of the final stores. Ensembles are compiled by msr.py, with
+# the option given as a compiler flag where there is one, and run without MPI in a separate process
+# (fact and rule classes are registered per process), as 'python tests/test_options.py run <exec
+# file> <runtime options>'. The final stores are compared as the multisets of their facts, with the
+# UUIDs of locations created by 'exists' masked. Committed choice makes the final stores of swap and
+# p2p_blocksworld depend on the order of candidates, which the options change, so they are left out.
+#
+# Usage: python -m unittest discover -s tests -p 'test_options.py'
+
+import os
+import re
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+EXAMPLES = ['short_path', 'short_path_min', 'trans_closure', 'merge_sort', 'hyper_quick_sort', 'min_span_tree']
+
+BASE_FLAGS = ['--store-mode=dict']
+
+# Option name -> (compiler flags, runtime options), each applied on top of BASE_FLAGS
+OPTIONS = { 'columnar'         : (['--store-mode=columnar'], {})
+          , 'replan'           : (BASE_FLAGS, { 'replan_interval':20, 'replan_threshold':1.05 })
+          , 'semi_naive'       : (BASE_FLAGS + ['--semi-naive'], {})
+          , 'activation_batch' : (BASE_FLAGS + ['--activation-batch=16'], {})
+          , 'compiled_matcher' : (BASE_FLAGS + ['--matcher-mode=compiled'], {}) }
+
+UUID_PAT = re.compile('[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+
+# Runs the generated executable without MPI, with the given runtime options, and prints the final stores
+# as a JSON dict from predicate names to the sorted list of their facts. Goals never arrive from other
+# MPI nodes, so the rewrite loop ends as soon as it is idle.
+def run_local(exec_file, options):
+	import msr_ensemble.interpret.mpi_runtime as mpi_runtime
+	from msr_ensemble.context.store import SinkFactStore
+	from msr_ensemble.facts.fact import get_fact_name
+	final_stores = {}
+	pretty_stores = mpi_runtime.pretty_stores
+	def capture_stores(fact_stores, brief=False):
+		final_stores.update(fact_stores)
+		return pretty_stores(fact_stores, brief=brief)
+	execute_msr = mpi_runtime.execute_msr
+	def execute_local(init_goals, rule_classes, **kwargs):
+		kwargs.update(options)
+		execute_msr(init_goals, rule_classes, use_mpi=False, **kwargs)
+	mpi_runtime.pause_times   = 0
+	mpi_runtime.pretty_stores = capture_stores
+	mpi_runtime.execute_msr   = execute_local
+	sys.path.insert(0, os.path.dirname(os.path.abspath(exec_file)))
+	execfile(exec_file, { '__name__':'__main__' })
+	facts = {}
+	for sym_id,fact_store in final_stores.items():
+		if isinstance(fact_store, SinkFactStore):
+			fact_reprs = fact_store.get_facts()
+		else:
+			fact_reprs = fact_store.get_candidates(-1, None)
+		fact_strs = []
+		for fact_repr in fact_reprs:
+			fact_strs += [ UUID_PAT.sub('U', repr(tuple(fact_repr.values))) ] * fact_store.num_copies(fact_repr.values)
+		facts[get_fact_name(sym_id)] = sorted(fact_strs)
+	print json.dumps(facts)
+
+def python_env():
+	env = dict(os.environ)
+	env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT_DIR, env.get('PYTHONPATH')]))
+	return env
+
+# Compiles the given MSR source with the given compiler flags and runs it, in a fresh directory.
+# Returns the final stores, as printed by run_local.
+def run_ensemble(msr_source, flags=BASE_FLAGS, options={}):
+	work_dir = tempfile.mkdtemp(prefix='msr_test_')
+	try:
+		msr_file = os.path.join(work_dir, 'test.msr')
+		with open(msr_file, 'w') as f:
+			f.write(msr_source)
+		output = subprocess.check_output([sys.executable, os.path.join(ROOT_DIR, 'msr.py')] + flags + ['test.msr'], cwd=work_dir
+                                                ,env=python_env(), stderr=subprocess.STDOUT)
+		if not os.path.exists(os.path.join(work_dir, 'test.py')):
+			raise AssertionError("Compilation failed:\n%s" % output)
+		proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), 'run', 'test.py', json.dumps(options)], cwd=work_dir
+                                       ,env=python_env(), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+		(output,errors) = proc.communicate()
+		if proc.returncode != 0:
+			raise AssertionError("Run failed:\n%s" % errors)
+		return json.loads(output.splitlines()[-1])
+	finally:
+		shutil.rmtree(work_dir)
+
+def example_source(example):
+	with open(os.path.join(ROOT_DIR, 'examples', '%s.msr' % example)) as f:
+		return f.read()
+
+class ExampleOptionsTest(unittest.TestCase):
+
+	baselines = {}
+
+	def baseline(self, example):
+		if example not in self.baselines:
+			self.baselines[example] = run_ensemble(example_source(example))
+		return self.baselines[example]
+
+	def assert_same_stores(self, option):
+		(flags,options) = OPTIONS[option]
+		for example in EXAMPLES:
+			stores = run_ensemble(example_source(example), flags=flags, options=options)
+			self.assertEqual(stores, self.baseline(example), "%s differs with option %s" % (example,option))
+
+	def test_columnar(self):
+		self.assert_same_stores('columnar')
+
+	def test_replan(self):
+		self.assert_same_stores('replan')
+
+	def test_semi_naive(self):
+		self.assert_same_stores('semi_naive')
+
+	def test_activation_batch(self):
+		self.assert_same_stores('activation_batch')
+
+	def test_compiled_matcher(self):
+		self.assert_same_stores('compiled_matcher')
+
+SET_SOURCE = '''
+ensem linker {
+
+	predicate %(mod)s link :: (int,[int]) -> fact.
+	predicate probe :: int -> fact.
+	predicate %(mod)s found :: int -> fact.
+
+	rule find :: [X]link(N,Ns) \\ [X]probe(N) --o [X]found(N).
+}
+
+execute linker with l0 {
+
+	init l0 :: link(1,[2,3]), link(1,[2,3]), link(1,[3]), link(2,[]), probe(1), probe(1), probe(2).
+
+}
+'''
+
+COUNTED_SOURCE = '''
+ensem counter {
+
+	predicate %s token :: int -> fact.
+	predicate tally :: (int,int) -> fact.
+
+	rule count :: [X]token(N), [X]tally(N,C) --o [X]tally(N,C+1).
+}
+
+execute counter with l0 {
+
+	init l0 :: tally(1,0), tally(2,0), tally(3,0), token(1), token(1), token(1), token(2), token(2), token(3), token(3), token(3), token(3), token(4), token(4).
+
+}
+'''
+
+MAX_SOURCE = '''
+ensem maximum {
+
+	predicate reading :: (int,int) -> fact.
+	predicate max best :: (int,int) -> fact.
+
+	rule keep :: [X]reading(S,V) --o [X]best(S,V).
+}
+
+execute maximum with l0 {
+
+	init l0 :: reading(1,3), reading(1,7), reading(2,4), reading(1,5), reading(2,9), reading(2,1).
+
+}
+'''
+
+class ModifierTest(unittest.TestCase):
+
+	# A set predicate drops facts identical to a stored one, both in a matched store and in a sink store.
+	# Without the modifier, every copy is kept.
+	def test_set(self):
+		for flags in [BASE_FLAGS, ['--store-mode=columnar']]:
+			set_stores = run_ensemble(SET_SOURCE % { 'mod':'set' }, flags=flags)
+			self.assertEqual(map(eval, set_stores['Link']), [(1,[2,3]), (1,[3]), (2,[])])
+			self.assertEqual(map(eval, set_stores['Found']), [(1,), (2,)])
+			stores = run_ensemble(SET_SOURCE % { 'mod':'' }, flags=flags)
+			self.assertEqual(map(eval, stores['Link']), [(1,[2,3]), (1,[2,3]), (1,[3]), (2,[])])
+			self.assertEqual(map(eval, stores['Found']), [(1,), (1,), (2,)])
+			self.assertEqual(stores['Probe'], set_stores['Probe'])
+
+	# Identical facts of a counted predicate rewrite as they do without the modifier
+	def test_counted(self):
+		for flags in [BASE_FLAGS, ['--store-mode=columnar']]:
+			counted = run_ensemble(COUNTED_SOURCE % 'counted', flags=flags)
+			self.assertEqual(counted, run_ensemble(COUNTED_SOURCE % '', flags=flags))
+			self.assertEqual(map(eval, counted['Tally']), [(1,3), (2,2), (3,4)])
+			self.assertEqual(map(eval, counted['Token']), [(4,), (4,)])
+
+	# A max predicate keeps the fact with the greatest last argument of each group
+	def test_max(self):
+		for flags in [BASE_FLAGS, ['--store-mode=columnar']]:
+			best = run_ensemble(MAX_SOURCE, flags=flags)['Best']
+			self.assertEqual(map(eval, best), [(1,7), (2,9)])
+
+	# A min predicate keeps the shortest paths, as the rule that eliminates longer paths in short_path does
+	def test_min(self):
+		for flags in [BASE_FLAGS, ['--store-mode=columnar']]:
+			paths = run_ensemble(example_source('short_path_min'), flags=flags)['Path']
+			self.assertEqual(paths, run_ensemble(example_source('short_path'), flags=flags)['Path'])
+
+if __name__ == '__main__':
+	if len(sys.argv) > 1 and sys.argv[1] == 'run':
+		run_local(sys.argv[2], json.loads(sys.argv[3]))
+	else:
+		unittest.main()
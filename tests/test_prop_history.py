@@ -0,0 +1,196 @@
+
+'''
+This file is part of MSR Ensemble for Python (MSRE-Py).
+
+MSRE-Py is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+MSRE-Py is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with MSRE-Py. If not, see <http://www.gnu.org/licenses/>.
+
+MSR Ensemble for Python (MSRE-Py) Version 0.9, Prototype Alpha
+
+Authors:
+Edmund S. L. Lam      sllam@qatar.cmu.edu
+Iliano Cervesato      iliano@cmu.edu
+
+* Development of MSRE-Py is funded by the Qatar National Research Fund as project NPRP 09-667-1-100 (Effective Programming for Large Distributed Ensembles)
+'''
+
+# Propagation history tests: A propagation rule fires once for each tuple of fact ids of its heads, whichever
+# occurrence matches them, and the history entries of a fact are collected when the fact is deleted (see
+# context/prop_history.py). Histories are tested on their own, over fact stores, and through a compiled
+# ensemble, run without MPI in a separate process as 'python tests/test_prop_history.py run <exec file>'.
+#
+# Usage: python -m unittest discover -s tests -p 'test_*.py'
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+from msr_ensemble.facts.term import Term
+from msr_ensemble.facts.fact import Fact, register_fact
+from msr_ensemble.context.store import FactStore, SinkFactStore
+from msr_ensemble.context.fact_repr import make_fact_repr
+from msr_ensemble.context.prop_history import PropHistory
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class HistItem(Fact):
+	def __init__(self, x1):
+		self.initialize(x1)
+register_fact(HistItem)
+
+class HistProbe(Fact):
+	def __init__(self, x1):
+		self.initialize(x1)
+register_fact(HistProbe)
+
+class PropHistoryTest(unittest.TestCase):
+
+	def setUp(self):
+		self.fact_stores = { HistItem.sym_id:FactStore(HistItem.sym_id), HistProbe.sym_id:FactStore(HistProbe.sym_id) }
+		self.history = PropHistory(0, self.fact_stores)
+		# Checkers of the occurrences of a rule with heads item and probe: The first matches the item first,
+		# the other the probe first
+		self.check_item_first  = self.history.new_checker([0,1], [HistItem.sym_id, HistProbe.sym_id])
+		self.check_probe_first = self.history.new_checker([1,0], [HistItem.sym_id, HistProbe.sym_id])
+
+	def new_fact(self, fact_class, value):
+		fact_repr = make_fact_repr( fact_class(Term(value)) )
+		self.fact_stores[fact_class.sym_id].add_to_store(fact_repr)
+		return fact_repr
+
+	def test_once_per_ids(self):
+		(item,probe) = (self.new_fact(HistItem, 1), self.new_fact(HistProbe, 2))
+		self.assertTrue(self.check_item_first([item, probe]))
+		self.assertFalse(self.check_item_first([item, probe]))
+		self.assertFalse(self.check_probe_first([probe, item]))
+		self.assertEqual(len(self.history), 1)
+
+	# Facts with the same values are told apart by their fact ids
+	def test_equal_values(self):
+		(item1,item2,probe) = (self.new_fact(HistItem, 1), self.new_fact(HistItem, 1), self.new_fact(HistProbe, 2))
+		self.assertTrue(self.check_item_first([item1, probe]))
+		self.assertTrue(self.check_probe_first([probe, item2]))
+		self.assertFalse(self.check_item_first([item2, probe]))
+		self.assertEqual(len(self.history), 2)
+
+	def test_collect_entries(self):
+		(item1,item2) = (self.new_fact(HistItem, 1), self.new_fact(HistItem, 2))
+		(probe1,probe2) = (self.new_fact(HistProbe, 3), self.new_fact(HistProbe, 4))
+		for (item,probe) in [(item1,probe1), (item2,probe1), (item1,probe2)]:
+			self.assertTrue(self.check_item_first([item, probe]))
+		item_store = self.fact_stores[HistItem.sym_id]
+		probe_store = self.fact_stores[HistProbe.sym_id]
+		probe_store.del_from_store(probe1)
+		self.assertEqual(len(self.history), 1)
+		self.assertEqual(item_store.history_entries.keys(), [item1.fact_id])
+		self.assertEqual(probe_store.history_entries.keys(), [probe2.fact_id])
+		item_store.del_from_store(item1)
+		self.assertEqual(len(self.history), 0)
+		self.assertEqual(item_store.history_entries, {})
+		self.assertEqual(probe_store.history_entries, {})
+		self.assertEqual(self.history.recorded, 3)
+		# A fact added again is a new fact
+		self.assertTrue(self.check_item_first([self.new_fact(HistItem, 1), probe2]))
+
+PROP_SOURCE = '''
+ensem history {
+
+	predicate item :: int -> fact.
+	predicate probe :: int -> fact.
+	predicate drop :: int -> fact.
+	predicate seen :: (int,int) -> fact.
+
+	rule pair   :: [X]item(I), [X]probe(J) \\ 1 --o [X]seen(I,J).
+	rule remove :: [X]drop(I) \\ [X]item(I) --o 1.
+}
+
+execute history with l0 {
+
+	init l0 :: item(1), item(1), item(2), probe(7), probe(8), drop(2).
+
+}
+'''
+
+# Runs the generated executable without MPI, and prints the facts of the final stores and the history sizes 
+# of the rules (current and recorded number of entries), as JSON dicts from predicate and rule names.
+def run_histories(exec_file):
+	import msr_ensemble.interpret.mpi_runtime as mpi_runtime
+	from msr_ensemble.facts.fact import get_fact_name
+	from msr_ensemble.rules.rule import get_all_rule_classes
+	final = {}
+	pretty_stores = mpi_runtime.pretty_stores
+	def capture_stores(fact_stores, brief=False):
+		final['stores'] = fact_stores
+		return pretty_stores(fact_stores, brief=brief)
+	new_histories = mpi_runtime.new_histories
+	def capture_histories(fact_stores):
+		final['histories'] = new_histories(fact_stores)
+		return final['histories']
+	execute_msr = mpi_runtime.execute_msr
+	def execute_local(init_goals, rule_classes, **kwargs):
+		execute_msr(init_goals, rule_classes, use_mpi=False, **kwargs)
+	mpi_runtime.pause_times   = 0
+	mpi_runtime.pretty_stores = capture_stores
+	mpi_runtime.new_histories = capture_histories
+	mpi_runtime.execute_msr   = execute_local
+	sys.path.insert(0, os.path.dirname(os.path.abspath(exec_file)))
+	execfile(exec_file, { '__name__':'__main__' })
+	facts = {}
+	for sym_id,fact_store in final['stores'].items():
+		if isinstance(fact_store, SinkFactStore):
+			fact_reprs = fact_store.get_facts()
+		else:
+			fact_reprs = fact_store.get_candidates(-1, None)
+		facts[get_fact_name(sym_id)] = sorted(map(lambda fact_repr: fact_repr.values, fact_reprs))
+	sizes = {}
+	for rule_id,history in final['histories'].items():
+		sizes[get_all_rule_classes()[rule_id].__name__] = [len(history), history.recorded]
+	print json.dumps({ 'facts':facts, 'histories':sizes })
+
+class PropRuleTest(unittest.TestCase):
+
+	def run_ensemble(self, msr_source):
+		work_dir = tempfile.mkdtemp(prefix='msr_test_')
+		env = dict(os.environ)
+		env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT_DIR, env.get('PYTHONPATH')]))
+		try:
+			with open(os.path.join(work_dir, 'test.msr'), 'w') as f:
+				f.write(msr_source)
+			subprocess.check_output([sys.executable, os.path.join(ROOT_DIR, 'msr.py'), '--store-mode=dict', 'test.msr'], cwd=work_dir
+                                               ,env=env, stderr=subprocess.STDOUT)
+			proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), 'run', 'test.py'], cwd=work_dir, env=env
+                                               ,stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+			(output,errors) = proc.communicate()
+			if proc.returncode != 0:
+				raise AssertionError("Run failed:\n%s" % errors)
+			return json.loads(output.splitlines()[-1])
+		finally:
+			shutil.rmtree(work_dir)
+
+	# pair fires once for each (item,probe) pair of fact ids, including items of equal values, and the
+	# entries of item(2) are collected when remove deletes it
+	def test_pair_history(self):
+		result = self.run_ensemble(PROP_SOURCE)
+		self.assertEqual(result['facts']['Seen'], [[1,7], [1,7], [1,8], [1,8], [2,7], [2,8]])
+		self.assertEqual(result['facts']['Item'], [[1], [1]])
+		self.assertEqual(result['histories']['Pair'], [4, 6])
+
+if __name__ == '__main__':
+	if len(sys.argv) > 1 and sys.argv[1] == 'run':
+		run_histories(sys.argv[2])
+	else:
+		unittest.main()
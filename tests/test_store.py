@@ -0,0 +1,317 @@
+
+'''
+This file is part of MSR Ensemble for Python (MSRE-Py).
+
+MSRE-Py is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+MSRE-Py is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with MSRE-Py. If not, see <http://www.gnu.org/licenses/>.
+
+MSR Ensemble for Python (MSRE-Py) Version 0.9, Prototype Alpha
+
+Authors:
+Edmund S. L. Lam      sllam@qatar.cmu.edu
+Iliano Cervesato      iliano@cmu.edu
+
+* Development of MSRE-Py is funded by the Qatar National Research Fund as project NPRP 09-667-1-100 (Effective Programming for Large Distributed Ensembles)
+'''
+
+# Fact store tests: Facts are found through the hash indexes of their store (see context/store.py) as
+# their lookup patterns would find them, with the constant arguments of a pattern in its hash key.
+# Range indexes find the facts of a hash bucket whose argument at the range position lies within the
+# given bounds, in the order of that argument. Columnar fact stores find the same candidates as
+# (default) fact stores. Stores of min (max) predicates keep one fact per group.
+#
+# Usage: python -m unittest discover -s tests -p 'test_*.py'
+
+import unittest
+import operator
+
+from msr_ensemble.facts.term import Term
+from msr_ensemble.facts.fact import Fact, register_fact
+from msr_ensemble.context.store import FactStore, ColumnarFactStore, SinkFactStore, DictColumn, encode_key_value, make_key_encoder, is_columnar_pred
+from msr_ensemble.context.fact_repr import make_fact_repr
+
+class TestEdge(Fact):
+	def __init__(self, x1, x2):
+		self.initialize(x1, x2)
+register_fact(TestEdge)
+
+class TestTriple(Fact):
+	def __init__(self, x1, x2, x3):
+		self.initialize(x1, x2, x3)
+register_fact(TestTriple)
+
+# Arguments of lookup patterns: BOUND is a variable binded by the time of the lookup, FREE a variable
+# that is not, and any other value a constant.
+BOUND = object()
+FREE  = object()
+
+def pattern_term(arg):
+	if arg is BOUND:
+		term = Term()
+		term.bind('X')
+		return term
+	elif arg is FREE:
+		return Term()
+	return Term(arg)
+
+# Returns a new store of the given predicate, with the hash index of the given lookup pattern
+def new_store(fact_class, *args):
+	return index_store(FactStore(fact_class.sym_id), fact_class, *args)
+
+def index_store(store, fact_class, *args):
+	lookup = store.generate_lookup( fact_class(*map(pattern_term, args)) )
+	return (store,lookup)
+
+def new_fact(fact_class, *values):
+	return make_fact_repr( fact_class(*map(Term, values)) )
+
+def add_facts(store, fact_class, all_values):
+	facts = map(lambda values: new_fact(fact_class, *values), all_values)
+	for fact in facts:
+		store.add_to_store(fact)
+	return facts
+
+# Argument values of the candidates of a lookup of the given argument values
+def lookup(store, lookup_index, *values):
+	return sorted(map(lambda fact: tuple(fact.values), store.get_candidates(lookup_index, list(values))))
+
+class KeyEncoderTest(unittest.TestCase):
+
+	def test_native_values(self):
+		for value in [42, 2**70, -1.5, True, 'abc', u'0::0']:
+			self.assertIs(encode_key_value(value), value)
+
+	def test_unhashable_values(self):
+		self.assertEqual(hash(encode_key_value([1, [2, 3]])), hash(encode_key_value([1, [2, 3]])))
+		self.assertEqual(encode_key_value({ 'a':[1] }), encode_key_value({ 'a':[1] }))
+		self.assertNotEqual(encode_key_value([1, 2]), encode_key_value((1, 2)))
+		self.assertNotEqual(encode_key_value(([1],)), encode_key_value(([1],[])))
+
+	def test_key_encoders(self):
+		values = [1, 'b', [2]]
+		self.assertEqual(make_key_encoder((0,))(values), 1)
+		self.assertEqual(make_key_encoder((0,1))(values), (1,'b'))
+		self.assertEqual(make_key_encoder((0,1,2))(values), (1,'b',encode_key_value([2])))
+		self.assertEqual(make_key_encoder((2,))(values), encode_key_value([2]))
+
+class HashKeyTest(unittest.TestCase):
+
+	# Values that print alike are different keys: 1 and '1' (or 1.0), unlike with string keys
+	def test_typed_keys(self):
+		(store,info) = new_store(TestEdge, BOUND, FREE)
+		add_facts(store, TestEdge, [(1, 'a'), ('1', 'b'), (2, 'c'), (1, 'd')])
+		self.assertEqual(lookup(store, info['lookup_index'], 1), [(1, 'a'), (1, 'd')])
+		self.assertEqual(lookup(store, info['lookup_index'], '1'), [('1', 'b')])
+		self.assertEqual(lookup(store, info['lookup_index'], 3), [])
+
+	def test_compound_keys(self):
+		(store,info) = new_store(TestTriple, BOUND, FREE, BOUND)
+		add_facts(store, TestTriple, [(1, 'a', u'0::0'), (1, 'b', u'1::1'), (1, 'c', u'0::0'), (2, 'd', u'0::0')])
+		self.assertEqual(lookup(store, info['lookup_index'], 1, None, u'0::0'), [(1, 'a', u'0::0'), (1, 'c', u'0::0')])
+		self.assertEqual(lookup(store, info['lookup_index'], 2, None, u'1::1'), [])
+
+	# Lists (e.g., decoded tuples) are keyed by their contents
+	def test_list_keys(self):
+		(store,info) = new_store(TestEdge, BOUND, FREE)
+		add_facts(store, TestEdge, [([1, 2], 'a'), ([1, 2], 'b'), ([2, 1], 'c')])
+		self.assertEqual(lookup(store, info['lookup_index'], [1, 2]), [([1, 2], 'a'), ([1, 2], 'b')])
+
+	def test_deletion(self):
+		(store,info) = new_store(TestEdge, BOUND, FREE)
+		facts = add_facts(store, TestEdge, [(1, 'a'), (1, 'b')])
+		store.del_from_store(facts[0])
+		self.assertEqual(lookup(store, info['lookup_index'], 1), [(1, 'b')])
+		store.del_from_store(facts[1])
+		self.assertEqual(store.hash_tables[info['lookup_index']]['hash_table'], {})
+
+class ConstKeyTest(unittest.TestCase):
+
+	# Candidates of a pattern with constant arguments agree with the constants, without filtering
+	def test_const_keys(self):
+		(store,info) = new_store(TestTriple, BOUND, 'b', FREE)
+		add_facts(store, TestTriple, [(1, 'a', 1), (1, 'b', 2), (2, 'b', 3), (1, 'b', 4)])
+		self.assertEqual(store.hash_pats[info['lookup_index']], (0,1))
+		self.assertEqual(lookup(store, info['lookup_index'], 1, 'b', None), [(1, 'b', 2), (1, 'b', 4)])
+		self.assertFalse(info['exact'])
+
+	def test_const_only_keys(self):
+		(store,info) = new_store(TestEdge, 7, FREE)
+		add_facts(store, TestEdge, [(7, 'a'), (8, 'b'), (7, 'c')])
+		self.assertEqual(lookup(store, info['lookup_index'], 7, None), [(7, 'a'), (7, 'c')])
+
+	# Patterns with the same key positions share an index, whether their keys are binded or constant
+	def test_shared_index(self):
+		(store,info) = new_store(TestEdge, BOUND, 'a')
+		other = store.generate_lookup( TestEdge(pattern_term(5), pattern_term(BOUND)) )
+		self.assertEqual(other['lookup_index'], info['lookup_index'])
+		self.assertEqual(len(store.hash_tables), 1)
+
+	# A pattern without free arguments is an exact lookup: Its bucket holds the matching facts only
+	def test_exact_lookup(self):
+		(store,info) = new_store(TestEdge, BOUND, 'a')
+		add_facts(store, TestEdge, [(1, 'a'), (1, 'b'), (1, 'a')])
+		self.assertTrue(info['exact'])
+		self.assertEqual(lookup(store, info['lookup_index'], 1, 'a'), [(1, 'a'), (1, 'a')])
+
+class RangeIndexTest(unittest.TestCase):
+
+	# Returns new (default and columnar) stores of the given predicate, each with the range index of
+	# the given lookup pattern on the argument at the given position, and its pattern terms
+	def new_range_stores(self, fact_class, arg_types, position, *args):
+		stores = []
+		for store in [FactStore(fact_class.sym_id), ColumnarFactStore(fact_class.sym_id, arg_types)]:
+			term_pats = map(pattern_term, args)
+			info = store.generate_range_lookup(fact_class(*term_pats), position)
+			stores.append( (store,info['range_index'],term_pats) )
+		return stores
+
+	# Argument values of the facts within the given bounds, each a (value,inclusive) pair or None. The lookup
+	# reads its key and bounds from an environment of the values of the pattern terms, followed by the bounds.
+	def range_lookup(self, store, range_index, term_pats, lower=None, upper=None):
+		env = map(lambda term: term.value, term_pats) + [ b[0] if b != None else None for b in [lower, upper] ]
+		key_slots = [ i for i in xrange(0,len(term_pats)) if term_pats[i].is_binded() ]
+		slot = lambda b,i: (len(term_pats)+i,b[1]) if b != None else None
+		lookup_func = store.get_range_lookup_func_from_store(range_index, key_slots, slot(lower,0), slot(upper,1))
+		return map(lambda fact: tuple(fact.values), lookup_func(env))
+
+	def test_bounds(self):
+		for (store,range_index,term_pats) in self.new_range_stores(TestEdge, ['int','int'], 1, FREE, FREE):
+			add_facts(store, TestEdge, [(1, 5), (2, 3), (3, 7), (4, 5), (5, 9)])
+			self.assertEqual(self.range_lookup(store, range_index, term_pats), [(2, 3), (1, 5), (4, 5), (3, 7), (5, 9)])
+			self.assertEqual(self.range_lookup(store, range_index, term_pats, lower=(5,True)), [(1, 5), (4, 5), (3, 7), (5, 9)])
+			self.assertEqual(self.range_lookup(store, range_index, term_pats, lower=(5,False)), [(3, 7), (5, 9)])
+			self.assertEqual(self.range_lookup(store, range_index, term_pats, upper=(7,False)), [(2, 3), (1, 5), (4, 5)])
+			self.assertEqual(self.range_lookup(store, range_index, term_pats, lower=(3,True), upper=(7,True))
+                                        , [(2, 3), (1, 5), (4, 5), (3, 7)])
+			self.assertEqual(self.range_lookup(store, range_index, term_pats, lower=(9,False)), [])
+
+	# Range indexes are keyed on the binded arguments of their pattern, read from the environment at lookup time
+	def test_keyed_ranges(self):
+		for (store,range_index,term_pats) in self.new_range_stores(TestTriple, ['int','string','int'], 2, BOUND, FREE, FREE):
+			add_facts(store, TestTriple, [(1, 'a', 4), (2, 'b', 1), (1, 'c', 2), (1, 'd', 8), (3, 'e', 3)])
+			term_pats[0].bind(1)
+			self.assertEqual(self.range_lookup(store, range_index, term_pats, upper=(4,True)), [(1, 'c', 2), (1, 'a', 4)])
+			term_pats[0].bind(2)
+			self.assertEqual(self.range_lookup(store, range_index, term_pats, upper=(4,True)), [(2, 'b', 1)])
+			term_pats[0].bind(4)
+			self.assertEqual(self.range_lookup(store, range_index, term_pats), [])
+
+	def test_deletion(self):
+		for (store,range_index,term_pats) in self.new_range_stores(TestEdge, ['int','int'], 1, FREE, FREE):
+			facts = add_facts(store, TestEdge, [(1, 5), (2, 5), (3, 6)])
+			store.del_from_store(facts[0])
+			self.assertEqual(self.range_lookup(store, range_index, term_pats, lower=(5,True)), [(2, 5), (3, 6)])
+			store.del_from_store(facts[1])
+			store.del_from_store(facts[2])
+			self.assertEqual(store.range_tables[range_index]['range_table'], {})
+
+	# Patterns with the same key positions and range position share a range index
+	def test_shared_ranges(self):
+		store = FactStore(TestTriple.sym_id)
+		info  = store.generate_range_lookup(TestTriple(*map(pattern_term, [BOUND, FREE, FREE])), 2)
+		self.assertEqual(store.generate_range_lookup(TestTriple(*map(pattern_term, [BOUND, 'a', FREE])), 2)['range_index'], 1)
+		self.assertEqual(store.generate_range_lookup(TestTriple(*map(pattern_term, [BOUND, FREE, FREE])), 2), info)
+		self.assertEqual(store.generate_range_lookup(TestTriple(*map(pattern_term, [BOUND, FREE, FREE])), 1)['range_index'], 2)
+
+class ColumnarStoreTest(unittest.TestCase):
+
+	def new_stores(self, *args):
+		return [ new_store(TestEdge, *args)
+                       , index_store(ColumnarFactStore(TestEdge.sym_id, ['int','string']), TestEdge, *args) ]
+
+	def test_same_candidates(self):
+		all_values = [(1, 'a'), (2, 'b'), (1, 'c'), (1, 'a'), (3, 'a')]
+		for (store,info) in self.new_stores(BOUND, FREE):
+			add_facts(store, TestEdge, all_values)
+			self.assertEqual(lookup(store, info['lookup_index'], 1), [(1, 'a'), (1, 'a'), (1, 'c')])
+			self.assertEqual(lookup(store, -1), sorted(all_values))
+
+	# Rows of deleted facts are reused, and no longer found
+	def test_deletion(self):
+		for (store,info) in self.new_stores(BOUND, FREE):
+			facts = add_facts(store, TestEdge, [(1, 'a'), (1, 'b'), (2, 'c')])
+			store.del_from_store(facts[0])
+			store.del_from_store(facts[2])
+			add_facts(store, TestEdge, [(2, 'd')])
+			self.assertEqual(lookup(store, info['lookup_index'], 1), [(1, 'b')])
+			self.assertEqual(lookup(store, info['lookup_index'], 2), [(2, 'd')])
+			self.assertEqual(lookup(store, -1), [(1, 'b'), (2, 'd')])
+		self.assertEqual(len(store.row_ids), 3)
+
+	# Typed columns fall back to lists for values of other types
+	def test_untyped_values(self):
+		(store,info) = self.new_stores(BOUND, FREE)[1]
+		add_facts(store, TestEdge, [(1, 'a'), (2**70, 'b'), ([1, 2], 'c')])
+		self.assertEqual(lookup(store, info['lookup_index'], 2**70), [(2**70, 'b')])
+		self.assertEqual(lookup(store, info['lookup_index'], [1, 2]), [([1, 2], 'c')])
+		self.assertEqual(lookup(store, info['lookup_index'], 1), [(1, 'a')])
+
+	# Dictionary codes are dropped once no row holds them, and are reused
+	def test_dict_codes(self):
+		column = DictColumn()
+		for (row,value) in enumerate(['a', 'b', 'a']):
+			column.set(row, value)
+		self.assertEqual(len(column), 2)
+		column.clear(0)
+		self.assertEqual(len(column), 2)
+		column.clear(1)
+		self.assertEqual(len(column), 1)
+		column.set(1, 'c')
+		self.assertEqual(len(column.decode), 2)
+		self.assertEqual(map(column.get, [1, 2]), ['c', 'a'])
+
+	def test_columnar_preds(self):
+		self.assertTrue(is_columnar_pred(['loc', 'int']))
+		self.assertTrue(is_columnar_pred(['float']))
+		self.assertFalse(is_columnar_pred(['loc', 'dest']))
+		self.assertFalse(is_columnar_pred(['int', None]))
+		self.assertFalse(is_columnar_pred([]))
+		self.assertFalse(is_columnar_pred(None))
+
+class AggregateTest(unittest.TestCase):
+
+	# Admitting a better fact leaves the fact of its group in the store, until the better fact is stored
+	def test_admit_then_store(self):
+		(store,info) = new_store(TestEdge, BOUND, FREE)
+		store.enable_aggregate(operator.gt)
+		add_facts(store, TestEdge, [(1, 5), (2, 4)])
+		better = new_fact(TestEdge, 1, 7)
+		self.assertTrue(store.admit(better))
+		self.assertFalse(store.admit(new_fact(TestEdge, 1, 3)))
+		self.assertEqual(lookup(store, info['lookup_index'], 1), [(1, 5)])
+		store.add_to_store(better)
+		self.assertEqual(lookup(store, info['lookup_index'], 1), [(1, 7)])
+		self.assertEqual(store.size, 2)
+
+	# Sink stores keep the facts of min (max) predicates by group, and only delete facts they hold
+	def test_sink_groups(self):
+		store = SinkFactStore(TestEdge.sym_id)
+		store.enable_aggregate(operator.lt)
+		facts = add_facts(store, TestEdge, [(1, 5), (2, 4), (1, 3)])
+		self.assertFalse(store.admit(new_fact(TestEdge, 2, 6)))
+		self.assertEqual(sorted(map(lambda fact: tuple(fact.values), store.get_facts())), [(1, 3), (2, 4)])
+		self.assertEqual(store.size, 2)
+		store.del_from_store(facts[0])
+		self.assertEqual(store.size, 2)
+		store.del_from_store(facts[2])
+		self.assertEqual(map(lambda fact: tuple(fact.values), store.get_facts()), [(2, 4)])
+		self.assertEqual(store.size, 1)
+
+	def test_sink_absent_fact(self):
+		store = SinkFactStore(TestEdge.sym_id)
+		add_facts(store, TestEdge, [(1, 5)])
+		store.del_from_store(new_fact(TestEdge, 1, 5))
+		self.assertEqual(store.size, 1)
+
+if __name__ == '__main__':
+	unittest.main()
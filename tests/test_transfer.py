@@ -0,0 +1,189 @@
+
+'''
+This file is part of MSR Ensemble for Python (MSRE-Py).
+
+MSRE-Py is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+MSRE-Py is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with MSRE-Py. If not, see <http://www.gnu.org/licenses/>.
+
+MSR Ensemble for Python (MSRE-Py) Version 0.9, Prototype Alpha
+
+Authors:
+Edmund S. L. Lam      sllam@qatar.cmu.edu
+Iliano Cervesato      iliano@cmu.edu
+
+* Development of MSRE-Py is funded by the Qatar National Research Fund as project NPRP 09-667-1-100 (Effective Programming for Large Distributed Ensembles)
+'''
+
+# MPI transfer tests: Facts sent between two MPI nodes arrive complete and in order, in batches per
+# destination rank and through the send pool, with at most max_pending outstanding sends. The fact
+# receiver grows its buffer to the messages it receives, and numeric arrays are sent as raw values (see
+# misc/mpi_process.py). Each check runs on two MPI nodes, as 'mpiexec -n 2 python tests/test_transfer.py
+# <check> [<codec mode>]', and fails with an assertion error. The tests run each check so, with each
+# codec, and are skipped if mpiexec is not found.
+#
+# Usage: python -m unittest discover -s tests -p 'test_*.py'
+
+import os
+import sys
+import time
+import unittest
+import subprocess
+
+from array import array
+from distutils.spawn import find_executable
+
+CODEC_MODES = ['binary', 'json']
+
+def mk_fact(rank, prior, values, sym_id=1):
+	return { 'prior':prior, 'sym_id':sym_id, 'values':values, 'rank':rank, 'proc_id':str(rank) }
+
+# Sends all facts to the other node, and receives as many from it. Without raw values, the send pool
+# never holds more than max_pending sends.
+def exchange(sender, receiver, facts, max_pending=None):
+	got = []
+	for fact in facts:
+		sender.send([fact])
+		if max_pending != None:
+			assert len(sender.pool) <= max_pending
+		sender.poll()
+		received = receiver.poll()
+		if received != None:
+			got.append(received)
+	sender.flush()
+	while len(got) < len(facts):
+		sender.poll()
+		received = receiver.poll()
+		if received != None:
+			got.append(received)
+	sender.wait()
+	return got
+
+# Facts are sent max_facts at a time, and in smaller batches when larger ones would not fit the receive
+# buffer. A flush sends the last, partial batch.
+def check_batches(codec_mode):
+	from msr_ensemble.misc.mpi_process import AggregatingSender, FactReceiver, MAX_BATCH_BYTES, comm
+	from msr_ensemble.misc.codec import new_codec
+	codec = new_codec(codec_mode)
+	other = 1 - comm.Get_rank()
+	receiver = FactReceiver(codec=codec)
+	sender   = AggregatingSender(max_facts=4, codec=codec)
+	got = exchange(sender, receiver, [ mk_fact(other, i, [i]) for i in xrange(1001) ])
+	assert map(lambda fact: fact['values'], got) == map(lambda i: [i], xrange(1001))
+	assert sender.num_of_msgs == 251 and sender.num_of_facts == 1001
+	sender = AggregatingSender(max_facts=64, codec=codec)
+	facts  = [ mk_fact(other, i, [u'x'*(MAX_BATCH_BYTES/4)]) for i in xrange(100) ]
+	got = exchange(sender, receiver, facts)
+	assert map(lambda fact: fact['values'], got) == map(lambda fact: fact['values'], facts)
+	assert sender.num_of_msgs > 100/4
+
+# Small facts in small batches, and large facts that only complete once received: With one pending send,
+# the node that starts first stalls until the other receives, and both still get every fact in order.
+def check_backpressure(codec_mode):
+	from msr_ensemble.misc.mpi_process import AggregatingSender, FactReceiver, comm
+	from msr_ensemble.misc.codec import new_codec
+	codec = new_codec(codec_mode)
+	rank  = comm.Get_rank()
+	other = 1 - rank
+	receiver = FactReceiver(codec=codec)
+	sender   = AggregatingSender(max_facts=4, max_pending=1, receiver=receiver, codec=codec)
+	got = exchange(sender, receiver, [ mk_fact(other, i, [i]) for i in xrange(5000) ], max_pending=1)
+	assert map(lambda fact: fact['values'], got) == map(lambda i: [i], xrange(5000))
+	assert len(sender.pool) == 0
+	sender = AggregatingSender(max_facts=1, max_pending=1, receiver=receiver, codec=codec)
+	if rank == 1:
+		time.sleep(0.5)
+	got = exchange(sender, receiver, [ mk_fact(other, i, [range(i,i+20000)]) for i in xrange(50) ], max_pending=1)
+	assert map(lambda fact: fact['values'], got) == map(lambda i: [range(i,i+20000)], xrange(50))
+	if rank == 0:
+		assert sender.pool.num_of_stalls > 0
+
+# Facts far larger than the initial buffer of the receiver, which grows to fit them
+def check_receiver_growth(codec_mode):
+	from msr_ensemble.misc.mpi_process import AggregatingSender, FactReceiver, comm
+	from msr_ensemble.misc.codec import new_codec
+	codec = new_codec(codec_mode)
+	other = 1 - comm.Get_rank()
+	receiver = FactReceiver(init_buffer_size=64, codec=codec)
+	sender   = AggregatingSender(receiver=receiver, codec=codec)
+	facts = [ mk_fact(other, i, [u'0::0', range(i,i+200000)]) for i in xrange(5) ] + [ mk_fact(other, -1, [7]) ]
+	got = exchange(sender, receiver, facts)
+	assert map(lambda fact: fact['values'], got) == map(lambda fact: fact['values'], facts)
+	assert len(receiver.buf) >= 200000
+
+# Numeric arrays are sent as raw values, by the aggregating sender and by send_fact, and arrive as
+# arrays of the same type code, in the facts they were sent in
+def check_raw_buffers(codec_mode):
+	from msr_ensemble.misc.mpi_process import AggregatingSender, FactReceiver, comm, send_fact
+	from msr_ensemble.misc.codec import new_codec
+	codec = new_codec(codec_mode)
+	rank  = comm.Get_rank()
+	other = 1 - rank
+	receiver = FactReceiver(codec=codec)
+	sender   = AggregatingSender(max_facts=4, max_pending=2, receiver=receiver, codec=codec)
+	def mk_values(i):
+		return [u'0::0', array('l', xrange(i,i+50000)), array('d', [i*0.5]*(i%3)), array('b'), [i]]
+	got = exchange(sender, receiver, [ mk_fact(other, i, mk_values(i)) for i in xrange(20) ])
+	assert map(lambda fact: fact['values'], got) == map(mk_values, xrange(20))
+	assert all(map(lambda fact: type(fact['values'][1]) == array and 'raw' not in fact, got))
+	assert sender.num_of_raw_values == 60
+	comm.Barrier()
+	if rank == 0:
+		send_fact(mk_fact(other, 20, mk_values(20)), codec=codec)
+	else:
+		fact = None
+		while fact == None:
+			fact = receiver.poll()
+		assert fact['values'] == mk_values(20) and fact['values'][1].typecode == 'l'
+
+CHECKS = { 'batches':check_batches, 'backpressure':check_backpressure, 'receiver_growth':check_receiver_growth
+         , 'raw_buffers':check_raw_buffers }
+
+MPIEXEC = find_executable('mpiexec')
+
+# Runs a check on two MPI nodes. OpenMPI is allowed to run as root and on fewer cores than nodes.
+def run_check(check, codec_mode):
+	env = dict(os.environ)
+	env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.path.dirname(os.path.dirname(os.path.abspath(__file__))), env.get('PYTHONPATH')]))
+	env.update({ 'OMPI_ALLOW_RUN_AS_ROOT':'1', 'OMPI_ALLOW_RUN_AS_ROOT_CONFIRM':'1', 'OMPI_MCA_rmaps_base_oversubscribe':'1' })
+	proc = subprocess.Popen([MPIEXEC, '-n', '2', sys.executable, os.path.abspath(__file__), check, codec_mode], env=env
+                               ,stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+	output = proc.communicate()[0]
+	return (proc.returncode, output)
+
+@unittest.skipIf(MPIEXEC == None, "mpiexec not found")
+class TransferTest(unittest.TestCase):
+
+	def assert_check(self, check):
+		for codec_mode in CODEC_MODES:
+			(returncode,output) = run_check(check, codec_mode)
+			self.assertEqual(returncode, 0, output)
+			self.assertEqual(output.count("%s ok" % check), 2, output)
+
+	def test_batches(self):
+		self.assert_check('batches')
+
+	def test_backpressure(self):
+		self.assert_check('backpressure')
+
+	def test_receiver_growth(self):
+		self.assert_check('receiver_growth')
+
+	def test_raw_buffers(self):
+		self.assert_check('raw_buffers')
+
+if __name__ == '__main__':
+	if len(sys.argv) > 1 and sys.argv[1] in CHECKS:
+		CHECKS[sys.argv[1]](sys.argv[2] if len(sys.argv) > 2 else CODEC_MODES[0])
+		print "%s ok" % sys.argv[1]
+	else:
+		unittest.main()